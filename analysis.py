@@ -0,0 +1,345 @@
+"""Analysis of a position: the best few moves, with their scores and
+principal variations, streamed while the search runs.
+
+analyse(board, engine, ...) is a generator of Analysis snapshots, each a
+complete picture of the search so far:
+
+  - "alphabeta" (or "minimax", which computes the same values) deepens
+    iteratively and yields a snapshot after every completed depth. Every
+    root move is searched with a window that only asks for its exact value
+    if it can still be among the multipv best; the others fail low and are
+    left out. Principal variations are read from the transposition table.
+  - "mcts" runs playouts in chunks on one tree and yields a snapshot after
+    every chunk. Moves are ranked by visits, and a principal variation
+    follows the most visited child down the tree.
+
+Scores are from the point of view of the player to move, from -1 to 1: the
+heuristic value of the line for alpha-beta (1 or -1 once a win or loss is
+proven), and 2 * win rate - 1 for MCTS.
+
+To stop early, stop iterating (or close the generator) between snapshots,
+set the stop event (from any thread; an alpha-beta depth in progress is
+abandoned at once, an MCTS chunk is finished first), or give a time limit.
+The last snapshot is the result; if the search is stopped before the first
+depth or chunk completes, there is none. analyse_with_callback does the same
+with a callback, which can return True to stop.
+
+Example:
+    python analysis.py --board_size 7 --moves 4,4 3,3 --engine alphabeta \\
+        --depth 4 --multipv 3
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
+from common_values import MAX_PLAYER
+from game_board import GameBoard, Location
+from mcts_player import MctsConfig, MctsNode
+import minimax_player
+import minimax_player_ab
+
+ENGINES = ("minimax", "alphabeta", "mcts")
+
+# Playouts of MCTS search between snapshots, by default.
+MCTS_CHUNK = 256
+
+
+@dataclass
+class MoveAnalysis:
+    """One of the best moves found. visits is the number of playouts through
+    the move (MCTS only), and pv the expected line of play, starting with
+    the move."""
+    move: Location
+    score: float
+    visits: int = 0
+    pv: List[Location] = field(default_factory=list)
+
+
+@dataclass
+class Analysis:
+    """A snapshot of a search: the best moves so far, best first, the depth
+    completed (alpha-beta) or the playouts run (MCTS), and the time taken."""
+    moves: List[MoveAnalysis]
+    depth: int = 0
+    playouts: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def best(self) -> Optional[MoveAnalysis]:
+        return self.moves[0] if self.moves else None
+
+    def to_json(self) -> str:
+        data = {
+            "moves": [{"move": [line.move.row, line.move.column],
+                       "score": round(line.score, 6),
+                       "visits": line.visits,
+                       "pv": [[move.row, move.column] for move in line.pv]}
+                      for line in self.moves],
+            "depth": self.depth,
+            "playouts": self.playouts,
+            "elapsed": round(self.elapsed, 6),
+        }
+        return json.dumps(data, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, line: str) -> Analysis:
+        data = json.loads(line)
+        return cls(
+            moves=[MoveAnalysis(Location(*entry["move"]), entry["score"],
+                                entry["visits"],
+                                [Location(*move) for move in entry["pv"]])
+                   for entry in data["moves"]],
+            depth=data["depth"],
+            playouts=data["playouts"],
+            elapsed=data["elapsed"])
+
+
+def analyse(board: GameBoard, engine: str = "alphabeta", multipv: int = 3,
+            depth: int = 3, playouts: int = 10000, ucb_const: float = .5,
+            rollout_batch: int = 1, config: Optional[MctsConfig] = None,
+            threads: int = 1,
+            heuristic: Callable[[GameBoard], float] = minimax_player.heuristic,
+            time_limit: Optional[float] = None,
+            stop: Optional[threading.Event] = None,
+            chunk: int = MCTS_CHUNK, rng=random) -> Iterator[Analysis]:
+    """Analyses board with engine, yielding a snapshot of the multipv best
+    moves as the search progresses. depth and heuristic are for alpha-beta;
+    playouts, ucb_const, rollout_batch, config, threads and chunk for MCTS.
+    See the module docstring for how to stop early."""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}")
+    if multipv < 1:
+        raise ValueError("multipv must be at least 1")
+    deadline = None
+    if time_limit is not None:
+        deadline = time.perf_counter() + time_limit
+    if engine == "mcts":
+        config = config or MctsConfig()
+        if config.transpositions:
+            raise ValueError("Analysis does not support transpositions")
+        return _analyse_mcts(board, multipv, playouts, ucb_const,
+                             rollout_batch, config, threads,
+                             chunk, rng, stop, deadline)
+    return _analyse_alphabeta(board, multipv, depth, heuristic, stop,
+                              deadline)
+
+
+def analyse_with_callback(board: GameBoard,
+                          callback: Callable[[Analysis], Optional[bool]],
+                          **options) -> Optional[Analysis]:
+    """Runs analyse(board, **options), passing every snapshot to callback,
+    until the search ends or callback returns True. Returns the last
+    snapshot."""
+    last = None
+    for analysis in analyse(board, **options):
+        last = analysis
+        if callback(analysis):
+            break
+    return last
+
+
+def _stopped(stop: Optional[threading.Event],
+             deadline: Optional[float]) -> bool:
+    return ((stop is not None and stop.is_set())
+            or (deadline is not None and time.perf_counter() >= deadline))
+
+
+def _clamp(score: float) -> float:
+    """Proven results are infinite in the minimax search. Adding 0.0 turns
+    the -0.0 of a negated draw into 0.0."""
+    return max(-1.0, min(1.0, score)) + 0.0
+
+
+def _analyse_alphabeta(board: GameBoard, multipv: int, max_depth: int,
+                       heuristic: Callable[[GameBoard], float],
+                       stop: Optional[threading.Event],
+                       deadline: Optional[float]) -> Iterator[Analysis]:
+    start = time.perf_counter()
+
+    def checked_heuristic(position: GameBoard) -> float:
+        # Leaves are where the time goes, so that is where a stop request
+        # is noticed.
+        if _stopped(stop, deadline):
+            raise minimax_player_ab.SearchStopped()
+        return heuristic(position)
+
+    searcher = minimax_player_ab.MinimaxPlayer(checked_heuristic, max_depth,
+                                               transpositions=True)
+    table = searcher.table
+    player = board.get_active_player()
+    inf = float("inf")
+    # Root moves, best first as ranked by the last completed depth.
+    ranking = board.get_legal_squares()
+    if not ranking:
+        yield Analysis([], 0, 0, time.perf_counter() - start)
+        return
+
+    for depth in range(1, max_depth + 1):
+        if len(table) > minimax_player_ab.MAX_TABLE_SIZE:
+            table.clear()
+        # Score of every root move from the point of view of the player to
+        # move, and whether it is exact or only an upper bound.
+        scores = {}
+        exact_scores: List[float] = []
+        try:
+            for square in ranking:
+                # Only a move that beats the multipv-th best exact score so
+                # far can make the list, so the search may fail low below it.
+                threshold = -inf
+                if len(exact_scores) >= multipv:
+                    threshold = sorted(exact_scores)[-multipv]
+                child = board.make_move_square(square)
+                if player == MAX_PLAYER:
+                    value, _ = searcher.min_value_alpha_beta_pruning(
+                        depth - 1, child, threshold, inf)
+                    score = value
+                else:
+                    value, _ = searcher.max_value_alpha_belta_pruning(
+                        depth - 1, child, -inf, -threshold)
+                    score = -value
+                exact = threshold == -inf or score > threshold
+                scores[square] = (score, exact)
+                if exact:
+                    exact_scores.append(score)
+        except minimax_player_ab.SearchStopped:
+            return
+
+        ranking.sort(key=lambda square: -scores[square][0])
+        best = [square for square in ranking if scores[square][1]][:multipv]
+        moves = [MoveAnalysis(board.location_of(square),
+                              _clamp(scores[square][0]),
+                              pv=_table_pv(board, square, depth, table))
+                 for square in best]
+        yield Analysis(moves, depth, 0, time.perf_counter() - start)
+        if _stopped(stop, deadline):
+            return
+
+
+def _table_pv(board: GameBoard, square: int, depth: int,
+              table) -> List[Location]:
+    """The line starting with square, continued by the best moves stored in
+    the transposition table, up to depth moves long."""
+    pv = [board.location_of(square)]
+    position = board.make_move_square(square)
+    while len(pv) < depth:
+        entry = table.get(position.position_key())
+        if entry is None or entry[3] is None:
+            break
+        position = position.make_move_square(entry[3])
+        if position is None:
+            break
+        pv.append(position.location_of(entry[3]))
+    return pv
+
+
+def _analyse_mcts(board: GameBoard, multipv: int, playouts: int,
+                  ucb_const: float, rollout_batch: int, config: MctsConfig,
+                  threads: int, chunk: int, rng,
+                  stop: Optional[threading.Event],
+                  deadline: Optional[float]) -> Iterator[Analysis]:
+    start = time.perf_counter()
+    root = MctsNode(board, None, ucb_const, config)
+    if not root.legal_moves:
+        yield Analysis([], 0, 0, time.perf_counter() - start)
+        return
+
+    remaining = playouts
+    while remaining > 0:
+        games = min(chunk, remaining)
+        if threads > 1:
+            # Imported here, as MctsPlayer does, because mcts_parallel
+            # builds on mcts_player.
+            from mcts_parallel import tree_parallel_search
+            tree_parallel_search(root, games, threads, rng, rollout_batch)
+        else:
+            root.choose_move_via_mcts(games, rng, rollout_batch)
+        remaining -= games
+
+        children = sorted(root.children.values(),
+                          key=lambda child: -child.total_games_for_this_player)
+        moves = [MoveAnalysis(
+                     board.location_of(child.move),
+                     2 * child.get_win_percentage_if_chosen_by_parent() - 1,
+                     child.total_games_for_this_player, _visits_pv(child))
+                 for child in children[:multipv]
+                 if child.total_games_for_this_player > 0]
+        yield Analysis(moves, 0, root.total_games_for_this_player,
+                       time.perf_counter() - start)
+        if _stopped(stop, deadline):
+            return
+
+
+def _visits_pv(node: MctsNode) -> List[Location]:
+    """The move leading to node, followed by the most visited child at every
+    level below it."""
+    pv = [node.parent.state.location_of(node.move)]
+    while node.children:
+        child = max(node.children.values(),
+                    key=lambda child: child.total_games_for_this_player)
+        if child.total_games_for_this_player == 0:
+            break
+        pv.append(node.state.location_of(child.move))
+        node = child
+    return pv
+
+
+def format_analysis(analysis: Analysis) -> str:
+    """One line per move, for printing."""
+    progress = (f"depth {analysis.depth}" if analysis.depth
+                else f"{analysis.playouts} playouts")
+    lines = [f"{progress}, {analysis.elapsed:.2f}s"]
+    for rank, line in enumerate(analysis.moves, 1):
+        visits = f" ({line.visits} visits)" if line.visits else ""
+        pv = " ".join(f"{move.row},{move.column}" for move in line.pv)
+        lines.append(f"  {rank}. {line.score:+.3f}{visits}  {pv}")
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("--board_size", type=int, default=7, help=(
+        "Size of the game board. 7 by default."))
+    p.add_argument("--moves", nargs="*", default=[], help=(
+        "Moves leading to the position to analyse, as row,column."))
+    p.add_argument("--engine", choices=ENGINES, default="alphabeta", help=(
+        "Search to analyse with. Default=alphabeta."))
+    p.add_argument("--multipv", type=int, default=3, help=(
+        "Number of best moves to report. Default=3."))
+    p.add_argument("--depth", type=int, default=3, help=(
+        "Only relevant for minimax and alphabeta; deepest depth searched."
+        " Default=3."))
+    p.add_argument("--playouts", type=int, default=10000, help=(
+        "Only relevant for mcts; playout budget. Default=10000."))
+    p.add_argument("--ucb", type=float, default=.5, help=(
+        "Only relevant for mcts; UCB exploration constant. Default=.5."))
+    p.add_argument("--time", type=float, default=None, help=(
+        "Stop after this many seconds."))
+    p.add_argument("--seed", type=int, default=None, help=(
+        "Seed for the MCTS playouts."))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    board = GameBoard(args.board_size)
+    for move in args.moves:
+        row, column = (int(part) for part in move.split(","))
+        board = board.make_move(Location(row, column))
+        if board is None:
+            raise ValueError(f"Illegal move {move}")
+    board.display()
+    for analysis in analyse(board, args.engine, args.multipv, args.depth,
+                            args.playouts, args.ucb, time_limit=args.time,
+                            rng=random.Random(args.seed)):
+        print(format_analysis(analysis), flush=True)
+
+
+if __name__ == '__main__':
+    main()
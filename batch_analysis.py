@@ -0,0 +1,347 @@
+"""Batch analysis of positions, such as every position of an archive of
+recorded games, with the results cached on disk.
+
+Positions are read in batches. Within a batch, repeated positions are
+analysed once (positions are identified by GameBoard.position_key, so
+different move orders reaching the same stones count as the same position),
+positions already in the cache are looked up, and only the rest are sent to
+a process pool, with the engine options given. Their results are added to
+the cache as they come in, so an interrupted run keeps what it computed and
+a rerun, or a run over a grown archive, only analyses positions it has not
+seen with the same engine options. The early positions that every game goes
+through are thus analysed once in all.
+
+The cache is an SQLite file with one row per (position, engine options).
+Options that make no difference to the engine chosen are left out of the
+key, minimax and alphabeta (one search in analysis.py) share their entries,
+and a weights file is keyed by its contents. MCTS searches are seeded
+from the position and the options, so they are reproducible. A time limit
+makes results depend on the machine, but is part of the key all the same.
+
+The annotated output holds one JSON line per game: the game's index in the
+input, its moves and, for the position before each move, the Analysis (see
+analysis.Analysis.to_json) or null where the player to move had no move.
+
+Example:
+    python batch_analysis.py games.jsonl.gz --engine alphabeta --depth 3 \\
+        --cache analysis.sqlite --output annotated.jsonl --workers 8
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import random
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from typing import (
+    Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple)
+from analysis import ENGINES, analyse
+from game_board import GameBoard
+from game_record import GameRecord, read_game_records, replay_boards
+from worker_pool import make_pool
+
+# The search each engine of analysis.analyse runs; engines running the same
+# search give the same results, so they share cache entries.
+SEARCHES = {"minimax": "alphabeta", "alphabeta": "alphabeta", "mcts": "mcts"}
+
+# Options of analysis.analyse that affect the results of each search, and so
+# belong in the cache key.
+ENGINE_OPTIONS = {
+    "alphabeta": ("multipv", "depth", "weights", "time"),
+    "mcts": ("multipv", "playouts", "ucb", "rollout_batch", "time"),
+}
+
+# Keys per SQL query when looking positions up in the cache.
+LOOKUP_CHUNK = 500
+
+
+def engine_config(options: Dict[str, Any]) -> str:
+    """The cache key of a set of engine options: the engine's search and the
+    options that matter for it, as canonical JSON."""
+    engine = options["engine"]
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}")
+    search = SEARCHES[engine]
+    config = {"engine": search}
+    for key in ENGINE_OPTIONS[search]:
+        if options.get(key) is not None:
+            config[key] = options[key]
+    if "weights" in config:
+        with open(config["weights"], "rb") as f:
+            config["weights"] = hashlib.sha1(f.read()).hexdigest()
+    return json.dumps(config, sort_keys=True, separators=(",", ":"))
+
+
+def position_hash(board: GameBoard) -> str:
+    """Identifies a position: the board size and the stones of each
+    color."""
+    red, yellow = board.position_key()
+    return f"{board.size}:{red:x}:{yellow:x}"
+
+
+class AnalysisCache:
+    """Analyses stored in an SQLite file, keyed by position hash and engine
+    config."""
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " position TEXT NOT NULL, config TEXT NOT NULL,"
+            " result TEXT NOT NULL, PRIMARY KEY (position, config))")
+
+    def get_many(self, positions: Iterable[str],
+                 config: str) -> Dict[str, str]:
+        """The stored results of those positions that are in the cache."""
+        positions = list(positions)
+        found = {}
+        for i in range(0, len(positions), LOOKUP_CHUNK):
+            chunk = positions[i:i + LOOKUP_CHUNK]
+            rows = self.connection.execute(
+                "SELECT position, result FROM analyses WHERE config = ?"
+                f" AND position IN ({','.join('?' * len(chunk))})",
+                [config, *chunk])
+            found.update(rows)
+        return found
+
+    def put_many(self, results: Iterable[Tuple[str, str]],
+                 config: str) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)",
+                [(position, config, result) for position, result in results])
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> AnalysisCache:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def analyse_position(board: GameBoard, options: Dict[str, Any],
+                     config: str) -> str:
+    """Runs the analysis of board to completion and returns the last
+    snapshot as JSON. Runs in a worker process."""
+    heuristic = {}
+    if options.get("weights") is not None:
+        heuristic["heuristic"] = _evaluator(options["weights"])
+    result = None
+    for result in analyse(
+            board, options["engine"], options.get("multipv", 3),
+            depth=options.get("depth", 3),
+            playouts=options.get("playouts", 10000),
+            ucb_const=options.get("ucb", .5),
+            rollout_batch=options.get("rollout_batch", 1),
+            time_limit=options.get("time"),
+            rng=random.Random(position_hash(board) + config), **heuristic):
+        pass
+    if result is None:
+        raise ValueError("The time limit ran out before the first snapshot"
+                         " of the analysis")
+    return result.to_json()
+
+
+# Feature evaluators of this worker process, by weights file.
+_evaluators: Dict[str, Any] = {}
+
+
+def _evaluator(weights: str):
+    evaluator = _evaluators.get(weights)
+    if evaluator is None:
+        from features import FeatureEvaluator
+        evaluator = _evaluators[weights] = FeatureEvaluator(weights)
+    return evaluator
+
+
+@dataclass
+class Stats:
+    """Counts of positions seen, of distinct positions per batch, of cache
+    hits and of positions analysed."""
+    positions: int = 0
+    unique: int = 0
+    cached: int = 0
+    analysed: int = 0
+
+
+def analyse_positions(boards: Iterable[GameBoard], options: Dict[str, Any],
+                      cache: AnalysisCache, pool, batch_size: int = 10000,
+                      stats: Optional[Stats] = None
+                      ) -> Iterator[Tuple[GameBoard, str]]:
+    """Yields every board of boards with its analysis (as JSON), in order,
+    batch_size boards at a time. Repeated positions within a batch are
+    analysed once, and positions in the cache not at all."""
+    config = engine_config(options)
+    if stats is None:
+        stats = Stats()
+    batch: List[GameBoard] = []
+    for board in boards:
+        batch.append(board)
+        if len(batch) >= batch_size:
+            yield from _analyse_batch(batch, options, config, cache, pool,
+                                      stats)
+            batch = []
+    if batch:
+        yield from _analyse_batch(batch, options, config, cache, pool, stats)
+
+
+def _analyse_batch(batch: List[GameBoard], options: Dict[str, Any],
+                   config: str, cache: AnalysisCache, pool,
+                   stats: Stats) -> Iterator[Tuple[GameBoard, str]]:
+    unique: Dict[str, GameBoard] = {}
+    keys = []
+    for board in batch:
+        key = position_hash(board)
+        keys.append(key)
+        unique.setdefault(key, board)
+    results = cache.get_many(unique, config)
+    stats.positions += len(batch)
+    stats.unique += len(unique)
+    stats.cached += len(results)
+
+    futures = {pool.submit(analyse_position, board, options, config): key
+               for key, board in unique.items() if key not in results}
+    done = []
+    # The first position whose analysis failed, and why. The others are
+    # still collected and cached before the failure is raised.
+    failed: Optional[Tuple[str, BaseException]] = None
+    try:
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                if failed is None:
+                    failed = (key, e)
+                continue
+            done.append((key, results[key]))
+            stats.analysed += 1
+            if len(done) >= 100:
+                cache.put_many(done, config)
+                done = []
+    finally:
+        # Also keeps what was analysed if the run is interrupted.
+        cache.put_many(done, config)
+    if failed is not None:
+        key, error = failed
+        raise RuntimeError(f"Analysis of position {key} failed") from error
+
+    for board, key in zip(batch, keys):
+        yield board, results[key]
+
+
+def analyse_games(records: Iterable[GameRecord], options: Dict[str, Any],
+                  cache: AnalysisCache, pool, batch_size: int = 10000,
+                  stats: Optional[Stats] = None
+                  ) -> Iterator[Tuple[GameRecord, List[Optional[str]]]]:
+    """Yields every game of records with the analysis (as JSON) of the
+    position before each of its moves, or None for a final concession."""
+    # Games whose positions have been read but not all answered yet, in
+    # order, with the analyses received so far and the number expected.
+    pending: Deque[Tuple[GameRecord, List[Optional[str]], int]] = deque()
+
+    def positions() -> Iterator[GameBoard]:
+        for record in records:
+            boards = [board for board, move
+                      in zip(replay_boards(record), record.moves)
+                      if move is not None]
+            pending.append((record, [], len(boards)))
+            yield from boards
+
+    def finished() -> Tuple[GameRecord, List[Optional[str]]]:
+        record, results, _ = pending.popleft()
+        # Only the last move of a game can be a concession.
+        return record, results + [None] * (len(record.moves) - len(results))
+
+    for _, result in analyse_positions(positions(), options, cache, pool,
+                                       batch_size, stats):
+        # Results come in the order the positions were read, so they belong
+        # to the oldest game that still needs some.
+        while len(pending[0][1]) == pending[0][2]:
+            yield finished()
+        pending[0][1].append(result)
+    while pending:
+        yield finished()
+
+
+def annotated_json(index: int, record: GameRecord,
+                   results: List[Optional[str]]) -> str:
+    """One line of the annotated output. The analyses are already JSON, so
+    they are spliced in rather than parsed and dumped again."""
+    analyses = ",".join("null" if result is None else result
+                        for result in results)
+    moves = json.dumps([None if move is None else list(move)
+                        for move in record.moves], separators=(",", ":"))
+    return f'{{"game":{index},"moves":{moves},"analyses":[{analyses}]}}'
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("records", nargs="+", help=(
+        "Game record files (see game_record.py) to analyse."))
+    p.add_argument("--cache", default="analysis.sqlite", help=(
+        "SQLite file of cached analyses. Default=analysis.sqlite."))
+    p.add_argument("--output", default=None, help=(
+        "File to write the annotated games to, one JSON line per game."))
+    p.add_argument("--engine", choices=ENGINES, default="alphabeta", help=(
+        "Search to analyse with. Default=alphabeta."))
+    p.add_argument("--multipv", type=int, default=3, help=(
+        "Number of best moves to keep per position. Default=3."))
+    p.add_argument("--depth", type=int, default=3, help=(
+        "Only relevant for minimax and alphabeta; search depth. Default=3."))
+    p.add_argument("--weights", default=None, help=(
+        "Only relevant for minimax and alphabeta; feature weights written by"
+        " tune_heuristic.py to evaluate with instead of the default"
+        " heuristic."))
+    p.add_argument("--playouts", type=int, default=10000, help=(
+        "Only relevant for mcts; playouts per position. Default=10000."))
+    p.add_argument("--ucb", type=float, default=.5, help=(
+        "Only relevant for mcts; UCB exploration constant. Default=.5."))
+    p.add_argument("--rollout_batch", type=int, default=1, help=(
+        "Only relevant for mcts; playouts per batched rollout. Default=1."))
+    p.add_argument("--time", type=float, default=None, help=(
+        "Time limit per position, in seconds."))
+    p.add_argument("--workers", type=int, default=None, help=(
+        "Number of worker processes. Defaults to the number of CPUs."))
+    p.add_argument("--batch_size", type=int, default=10000, help=(
+        "Positions deduplicated and looked up together. Default=10000."))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    options = {key: getattr(args, key)
+               for key in ("engine", "multipv", "depth", "weights",
+                           "playouts", "ucb", "rollout_batch", "time")}
+    stats = Stats()
+    records = (record for path in args.records
+               for record in read_game_records(path))
+    start = time.perf_counter()
+    output = open(args.output, "w") if args.output is not None else None
+    try:
+        with AnalysisCache(args.cache) as cache, \
+                make_pool(args.workers) as pool:
+            for index, (record, results) in enumerate(analyse_games(
+                    records, options, cache, pool, args.batch_size, stats)):
+                if output is not None:
+                    output.write(annotated_json(index, record, results)
+                                 + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    print(f"{stats.positions} positions, {stats.unique} unique per batch,"
+          f" {stats.cached} from the cache, {stats.analysed} analysed in"
+          f" {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
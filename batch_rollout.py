@@ -0,0 +1,107 @@
+"""Random playouts simulated many at a time with NumPy.
+
+Instead of playing one random game after another in Python, K copies of a
+position are stacked into a (K, size+2, size+2) array and played forward in
+lockstep: every step computes the legal squares of all unfinished games at
+once, picks a uniformly random legal square in each, and places the stones.
+The per-step Python overhead is paid once per step rather than once per game
+and per move, which is where the time goes in single playouts.
+"""
+
+from __future__ import annotations
+from typing import Optional, Tuple
+import numpy as np
+from common_values import EMPTY, RED, YELLOW
+from board_geometry import get_geometry
+from features import neighbour_counts
+from game_board import GameBoard
+
+
+def batch_random_playouts(board: GameBoard, k: int,
+                          rng: np.random.Generator,
+                          max_plies: Optional[int] = None
+                          ) -> Tuple[np.ndarray, np.ndarray]:
+    """Plays k uniformly random games from board. Returns the outcome of
+    each (+1 if the first player won, -1 if the second player did, as for
+    GameBoard.value) and the final grids, of shape (k, size+2, size+2). If
+    max_plies is given, games still going after that many moves are stopped
+    there, with an outcome of 0."""
+    size = board.size
+    final_grids = np.empty((k,) + board.grid.shape, dtype=np.int8)
+    outcomes = np.zeros(k, dtype=np.int8)
+
+    # State of the games still being played; alive holds their indices in
+    # the results. The arrays are only compacted when some game finishes.
+    alive = np.arange(k)
+    grids = np.repeat(board.grid.astype(np.int8)[np.newaxis], k, axis=0)
+    red_placed = np.full(k, board.pieces_placed[RED], dtype=np.int32)
+    yellow_placed = np.full(k, board.pieces_placed[YELLOW], dtype=np.int32)
+    # Friendly neighbour counts of every square, for red (index 0) and
+    # yellow (index 1), over the padded grid. They are counted once and then
+    # updated around each new stone, instead of being recounted over the
+    # whole board at every step.
+    counts = np.zeros((k, 2) + board.grid.shape, dtype=np.int8)
+    counts[:, 0, 1:size + 1, 1:size + 1] = neighbour_counts(board.grid, RED)
+    counts[:, 1, 1:size + 1, 1:size + 1] = neighbour_counts(board.grid,
+                                                            YELLOW)
+    width = size + 2
+    area = width * width
+    offsets = np.array(get_geometry(size).offsets)
+    rows_in_play = np.arange(k)
+    plies = 0
+
+    while len(alive):
+        if max_plies is not None and plies == max_plies:
+            final_grids[alive] = grids
+            break
+        is_red = red_placed == yellow_placed
+        active = np.where(is_red, RED, YELLOW).astype(np.int8)
+        color = (~is_red).astype(np.intp)
+        legal = grids[:, 1:size + 1, 1:size + 1] == EMPTY
+        second_stage = (red_placed >= size - 1) & (yellow_placed >= size - 1)
+        if second_stage.any():
+            friendly = counts[rows_in_play, color, 1:size + 1, 1:size + 1]
+            legal &= ~second_stage[:, np.newaxis, np.newaxis] | (friendly >= 2)
+        # Running count of legal squares in row-major order; its last entry
+        # is the number of legal moves.
+        ranks = legal.reshape(len(alive), -1).cumsum(axis=1, dtype=np.int32)
+        num_legal = ranks[:, -1]
+
+        # Games where the player to move is stuck are over: the other player
+        # has won.
+        finished = num_legal == 0
+        if finished.any():
+            outcomes[alive[finished]] = -active[finished]
+            final_grids[alive[finished]] = grids[finished]
+            playing = ~finished
+            alive = alive[playing]
+            if not len(alive):
+                break
+            grids = grids[playing]
+            counts = counts[playing]
+            red_placed = red_placed[playing]
+            yellow_placed = yellow_placed[playing]
+            ranks = ranks[playing]
+            num_legal = num_legal[playing]
+            active = active[playing]
+            is_red = is_red[playing]
+            color = color[playing]
+            rows_in_play = np.arange(len(alive))
+
+        # A uniformly random legal square per game: the target-th legal
+        # square in row-major order, for a target drawn from 1..num_legal.
+        # This needs one random number per game rather than per square.
+        target = (rng.random(len(alive)) * num_legal).astype(np.int32) + 1
+        choice = (ranks >= target[:, np.newaxis]).argmax(axis=1)
+        row = choice // size + 1
+        column = choice % size + 1
+        grids[rows_in_play, row, column] = active
+        # The 8 neighbours of every new stone, as indices into the flattened
+        # counts; they are distinct, so one fancy-indexed add does them all.
+        square = (rows_in_play * 2 + color) * area + row * width + column
+        counts.reshape(-1)[square[:, np.newaxis] + offsets] += 1
+        red_placed += is_red
+        yellow_placed += ~is_red
+        plies += 1
+
+    return outcomes, final_grids
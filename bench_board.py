@@ -0,0 +1,107 @@
+"""Benchmarks how the board engine scales with the board size.
+
+For each size, measures the cost of the basic board operations on a
+position halfway through a random game (copying the board, making a move,
+listing the legal moves, the heuristic) and of whole random games, played
+one at a time with GameBoard.random_playout and many at a time with
+batch_random_playouts, and of MCTS playouts. The cost of a random game is
+also given per stone placed: if the engine scales with the number of stones
+rather than with the area of the board, that column stays roughly flat as
+the board grows.
+
+Example:
+    python bench_board.py --sizes 7 11 15 19 --games 50
+"""
+
+from __future__ import annotations
+import argparse
+import random
+import time
+from typing import Callable
+import numpy as np
+from batch_rollout import batch_random_playouts
+from game_board import GameBoard
+from mcts_player import MctsNode
+from minimax_player import heuristic
+
+
+def time_per_call(function: Callable[[], object], min_time: float = .2
+                  ) -> float:
+    """Average time of a call to function, in seconds, over as many calls as
+    fit in about min_time seconds."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("--sizes", type=int, nargs="+", default=[7, 11, 15, 19],
+                   help="Board sizes to measure. Default=7 11 15 19.")
+    p.add_argument("--games", type=int, default=50, help=(
+        "Random games played per size to measure playouts. Default=50."))
+    p.add_argument("--batch", type=int, default=64, help=(
+        "Games per call of batch_random_playouts. Default=64."))
+    p.add_argument("--playouts", type=int, default=200, help=(
+        "Playouts of the MCTS search timed per size. Default=200."))
+    p.add_argument("--seed", type=int, default=0, help=(
+        "Seed for the positions and the games. Default=0."))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    rng = random.Random(args.seed)
+    batch_rng = np.random.default_rng(args.seed)
+
+    print(f"{'size':>4}{'stones':>8}{'copy us':>9}{'move us':>9}"
+          f"{'legal us':>10}{'heur us':>9}{'game ms':>9}{'us/stone':>10}"
+          f"{'batch us/stone':>16}{'mcts playouts/s':>17}")
+    for size in args.sizes:
+        empty = GameBoard(size)
+        start = time.perf_counter()
+        stones = 0
+        for _ in range(args.games):
+            final = empty.random_playout(rng)
+            stones += sum(final.pieces_placed.values())
+        game_time = (time.perf_counter() - start) / args.games
+        stones_per_game = stones / args.games
+
+        # A position halfway through a random game.
+        board = empty
+        for _ in range(int(stones_per_game) // 2):
+            board = board.make_move_square(board.get_random_legal_square(rng))
+        move = board.get_random_legal_square(rng)
+
+        copy_time = time_per_call(board.copy)
+        move_time = time_per_call(lambda: board.make_move_square(move))
+        legal_time = time_per_call(board.get_legal_squares)
+        heuristic_time = time_per_call(lambda: heuristic(board))
+
+        start = time.perf_counter()
+        outcomes, final_grids = batch_random_playouts(empty, args.batch,
+                                                      batch_rng)
+        batch_time = time.perf_counter() - start
+        batch_stones = int((final_grids != 0).sum())
+
+        start = time.perf_counter()
+        MctsNode(empty, None, 1.0).choose_move_via_mcts(args.playouts, rng)
+        mcts_rate = args.playouts / (time.perf_counter() - start)
+
+        print(f"{size:>4}{stones_per_game:>8.0f}{copy_time * 1e6:>9.1f}"
+              f"{move_time * 1e6:>9.1f}{legal_time * 1e6:>10.1f}"
+              f"{heuristic_time * 1e6:>9.1f}{game_time * 1e3:>9.2f}"
+              f"{game_time / stones_per_game * 1e6:>10.2f}"
+              f"{batch_time / batch_stones * 1e6:>16.2f}"
+              f"{mcts_rate:>17.0f}")
+
+
+if __name__ == '__main__':
+    main()
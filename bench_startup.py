@@ -0,0 +1,119 @@
+"""Benchmarks start-up costs.
+
+Measures, each in fresh interpreters and as the median of several runs:
+  - the time of "python game.py --help" and of a one-game run of game.py
+    for a few pairs of player types;
+  - the import time of the board and of every player backend, over that of
+    an empty interpreter;
+  - how long a process pool takes to return the first results of a batch of
+    small searches, for a plain pool with spawned workers and for
+    worker_pool.make_pool, and how long a second batch takes once the
+    workers are up.
+
+Example:
+    python bench_startup.py --runs 5 --workers 4
+"""
+
+from __future__ import annotations
+import argparse
+import multiprocessing
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+MODULES = ("game_board", "human_player", "minimax_player",
+           "minimax_player_ab", "features", "mcts_player")
+
+GAMES = (("minimax", "minimax"), ("alphabeta", "alphabeta"),
+         ("mcts", "mcts"))
+
+
+def time_command(command: List[str], runs: int) -> float:
+    """Median wall time of running command, in seconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def small_search(board_size: int, seed: int) -> int:
+    """A search small enough that a worker's start-up dominates it."""
+    import random
+    from game_board import GameBoard
+    from mcts_player import MctsNode
+    root = MctsNode(GameBoard(board_size), None, 1.0)
+    move = root.choose_move_via_mcts(16, random.Random(seed))
+    return move.row
+
+
+def time_pool(make, workers: int, board_size: int, runs: int
+              ) -> List[float]:
+    """Median times until the first batch of workers searches has returned,
+    counted from the creation of the pool, and of a second batch."""
+    first, second = [], []
+    for run in range(runs):
+        start = time.perf_counter()
+        with make() as pool:
+            list(pool.map(small_search, [board_size] * workers,
+                          range(workers)))
+            first.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            list(pool.map(small_search, [board_size] * workers,
+                          range(workers)))
+            second.append(time.perf_counter() - start)
+    return [statistics.median(first), statistics.median(second)]
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("--runs", type=int, default=5, help=(
+        "Runs per measurement; the median is reported. Default=5."))
+    p.add_argument("--workers", type=int, default=2, help=(
+        "Worker processes of the pools. Default=2."))
+    p.add_argument("--board_size", type=int, default=7, help=(
+        "Size of the game board. 7 by default."))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    python = sys.executable
+
+    print(f"{'command':<44}{'s':>10}")
+    help_time = time_command([python, "game.py", "--help"], args.runs)
+    print(f"{'game.py --help':<44}{help_time:>10.3f}")
+    for first, second in GAMES:
+        elapsed = time_command(
+            [python, "game.py", first, second, "--silent", "--num_games",
+             "1", "--board_size", "5", "--playouts1", "50", "--playouts2",
+             "50"], args.runs)
+        print(f"{'game.py ' + first + ' ' + second:<44}{elapsed:>10.3f}")
+
+    print(f"\n{'import':<44}{'s':>10}")
+    empty = time_command([python, "-c", "pass"], args.runs)
+    for module in MODULES:
+        elapsed = time_command([python, "-c", f"import {module}"], args.runs)
+        print(f"{module:<44}{elapsed - empty:>10.3f}")
+
+    from worker_pool import make_pool, start_method
+    pools = [
+        ("spawn", lambda: ProcessPoolExecutor(
+            args.workers, mp_context=multiprocessing.get_context("spawn"))),
+        (f"make_pool ({start_method()})", lambda: make_pool(
+            args.workers, [args.board_size]))]
+    print(f"\n{'pool':<44}{'first s':>10}{'next s':>10}")
+    for name, make in pools:
+        first, second = time_pool(make, args.workers, args.board_size,
+                                  args.runs)
+        print(f"{name:<44}{first:>10.3f}{second:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Tables describing the shape of a board of a given size.
+
+Everything here depends only on the board size, so it is built once per size
+by get_geometry and then shared by every board, player and search of that
+size. Squares are identified by their index in the flattened
+(size+2)x(size+2) grid, i.e. row*(size+2) + column; see GameBoard.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+
+
+@dataclass(eq=True, frozen=True, slots=True)
+class Location:
+    row: int
+    column: int
+
+
+class BoardGeometry:
+    """Precomputed tables for one board size.
+
+    size:          number of rows (and columns) that can be played on
+    width:         size + 2, the width of the padded grid
+    squares:       indices of the playable squares, in row-major order
+    square_array:  squares as a NumPy array, for indexing flattened grids
+    locations:     the Location of every square index, None off the board
+    on_board:      whether each square index is playable
+    neighbours:    for every square index, the indices of its playable
+                   orthogonal and diagonal neighbours
+    offsets:       index offsets of the 8 neighbours of a square
+    symmetries:    the 8 rotations/reflections of the board, each a tuple
+                   mapping every square index to its image
+    """
+
+    __slots__ = ("size", "width", "squares", "square_array", "locations",
+                 "on_board", "neighbours", "offsets", "symmetries")
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.width = width = size + 2
+        num_squares = width * width
+
+        self.squares: Tuple[int, ...] = tuple(
+            row*width + column
+            for row in range(1, size+1) for column in range(1, size+1))
+        self.square_array: np.ndarray = np.array(self.squares,
+                                                 dtype=np.intp)
+
+        self.locations: List[Optional[Location]] = [None] * num_squares
+        for square in self.squares:
+            self.locations[square] = Location(*divmod(square, width))
+
+        self.on_board: Tuple[bool, ...] = tuple(
+            location is not None for location in self.locations)
+
+        self.offsets: Tuple[int, ...] = (
+            -width-1, -width, -width+1, -1, 1, width-1, width, width+1)
+
+        neighbours: List[Tuple[int, ...]] = [()] * num_squares
+        for square in self.squares:
+            neighbours[square] = tuple(
+                square + offset for offset in self.offsets
+                if self.on_board[square + offset])
+        self.neighbours: Tuple[Tuple[int, ...], ...] = tuple(neighbours)
+
+        symmetries = []
+        for transform in _transforms(size):
+            image = list(range(num_squares))
+            for square in self.squares:
+                row, column = divmod(square, width)
+                new_row, new_column = transform(row, column)
+                image[square] = new_row*width + new_column
+            symmetries.append(tuple(image))
+        self.symmetries: Tuple[Tuple[int, ...], ...] = tuple(symmetries)
+
+
+def _transforms(size: int):
+    """The 8 symmetries of the square, acting on 1-based (row, column)."""
+    last = size + 1
+    return (
+        lambda r, c: (r, c),
+        lambda r, c: (c, last - r),
+        lambda r, c: (last - r, last - c),
+        lambda r, c: (last - c, r),
+        lambda r, c: (r, last - c),
+        lambda r, c: (last - r, c),
+        lambda r, c: (c, r),
+        lambda r, c: (last - c, last - r),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_geometry(size: int) -> BoardGeometry:
+    """Returns the (shared) geometry tables for boards of the given size."""
+    return BoardGeometry(size)
@@ -0,0 +1,392 @@
+"""Serves the engines over a local socket.
+
+An asyncio server accepts any number of connections, over TCP or a Unix
+socket, and speaks a JSON-lines protocol: every request is one JSON object
+on a line, and gets exactly one JSON object on a line back. Games live on the
+server, so a client can hold several at once. Searches run in a process pool,
+so the event loop keeps serving other sessions while an engine thinks; every
+worker process imports the engines and warms them up on the configured board
+sizes when it starts.
+
+Requests ("id", if given, is echoed back in the reply):
+    {"cmd": "new_game", "board_size": 7}
+        -> {"ok": true, "game": "<game id>", "to_move": 1}
+    {"cmd": "move", "game": "<id>", "row": 3, "column": 4}
+        -> {"ok": true, "to_move": -1, "winner": null}
+    {"cmd": "engine_move", "game": "<id>", "engine": "mcts",
+     "playouts": 1000, "time": 2.0}
+        -> {"ok": true, "move": [2, 2], "elapsed": 1.93, "to_move": 1,
+            "winner": null}
+    {"cmd": "state", "game": "<id>"}
+        -> {"ok": true, "board_size": 7, "moves": [[3, 4], [2, 2]],
+            "to_move": 1, "legal_moves": [[1, 1], ...], "winner": null}
+    {"cmd": "end_game", "game": "<id>"}
+        -> {"ok": true}
+Failed requests get {"ok": false, "error": "<message>"}.
+
+engine is one of "minimax", "alphabeta" or "mcts". The search limits are
+"depth" (plies, for the minimax engines), "playouts" and "ucb" (for mcts)
+and "time" (seconds, for all of them). Every search has a time limit: the
+one given, capped by the server's --max_time, or --max_time itself. The
+minimax engines deepen iteratively up to depth, do not start a depth they are
+unlikely to finish, and play the move of the last depth completed if the
+time runs out during one; mcts stops after the playout batch during which
+time runs out. Playouts are capped by --max_playouts. A winner of 1 or -1
+means that the game is over (the other player has no legal move). New games
+are refused beyond --max_board_size or once --max_games games are live;
+clients should end the games they are done with.
+
+Example:
+    python engine_server.py --port 7777 --workers 4 --board_sizes 7 9
+    echo '{"cmd": "new_game", "board_size": 7}' | nc localhost 7777
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+from board_geometry import get_geometry
+from game_board import GameBoard, Location
+from mcts_player import MctsNode
+import minimax_player
+import minimax_player_ab
+from worker_pool import make_pool
+
+ENGINES = ("minimax", "alphabeta", "mcts")
+
+# Playouts of MCTS search run between checks of the time limit.
+MCTS_CHUNK = 64
+
+
+def search(board: GameBoard, engine: str, depth: int, playouts: int,
+           ucb_const: float, time_limit: Optional[float],
+           seed: int) -> Optional[Tuple[int, int]]:
+    """Chooses a move for the player to move on board. Runs in a worker
+    process. Returns (row, column), or None if there is no legal move."""
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    if engine == "mcts":
+        root = MctsNode(board, None, ucb_const)
+        rng = random.Random(seed)
+        move = None
+        while playouts > 0:
+            chunk = min(MCTS_CHUNK, playouts)
+            # Playouts accumulate in root's tree, so every chunk continues
+            # the same search.
+            move = root.choose_move_via_mcts(chunk, rng)
+            playouts -= chunk
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        if move is None:
+            move = board.get_random_legal_move(rng)
+    else:
+        player = _minimax_player(engine, depth, deadline)
+        if deadline is None:
+            move = player.choose_move(board)
+        else:
+            move = None
+            # Cost of a depth over that of the one before; the number of
+            # legal moves until two depths have been timed.
+            growth = max(board.count_legal_moves(), 2)
+            previous = None
+            try:
+                for plies in range(1, depth + 1):
+                    start = time.perf_counter()
+                    player.plies = plies
+                    move = player.choose_move(board)
+                    now = time.perf_counter()
+                    if previous:
+                        growth = max((now - start) / previous, 2)
+                    previous = now - start
+                    if now + growth * previous >= deadline:
+                        break
+            except minimax_player_ab.SearchStopped:
+                # The move of the last completed depth stands.
+                pass
+            if move is None:
+                move = board.get_random_legal_move(random.Random(seed))
+    if move is None:
+        return None
+    return (move.row, move.column)
+
+
+# Engine instances of this worker process, by engine name.
+_players: Dict[str, Any] = {}
+
+
+def _minimax_player(engine: str, plies: int, deadline: Optional[float]):
+    """This worker's (reused) player for one of the minimax engines, whose
+    search raises minimax_player_ab.SearchStopped once deadline (if any) has
+    passed."""
+    module = minimax_player if engine == "minimax" else minimax_player_ab
+    player = _players.get(engine)
+    if player is None:
+        player = module.MinimaxPlayer(module.heuristic, plies)
+        _players[engine] = player
+    player.plies = plies
+    player.heuristic = module.heuristic
+    if deadline is not None:
+        def checked_heuristic(position: GameBoard) -> float:
+            # Leaves are where the time goes, so that is where the deadline
+            # is noticed.
+            if time.perf_counter() >= deadline:
+                raise minimax_player_ab.SearchStopped()
+            return module.heuristic(position)
+        player.heuristic = checked_heuristic
+    return player
+
+
+def warm_up(board_sizes: List[int]) -> None:
+    """Worker initializer: builds the geometry tables of each board size and
+    runs a tiny search with every engine, so that the first real request
+    does not pay for them."""
+    for size in board_sizes:
+        get_geometry(size)
+        board = GameBoard(size)
+        for engine in ENGINES:
+            search(board, engine, 1, 8, 1.0, None, 0)
+
+
+class Game:
+    """A game being played on the server."""
+
+    def __init__(self, board_size: int) -> None:
+        self.board = GameBoard(board_size)
+        self.moves: List[Tuple[int, int]] = []
+        # Requests on one game are handled one at a time.
+        self.lock = asyncio.Lock()
+
+    def winner(self) -> Optional[int]:
+        value = self.board.value()
+        return value if value != 0 else None
+
+    def play(self, row: int, column: int) -> None:
+        board = None
+        if 1 <= row <= self.board.size and 1 <= column <= self.board.size:
+            board = self.board.make_move(Location(row, column))
+        if board is None:
+            raise ValueError(f"illegal move {row},{column}")
+        self.board = board
+        self.moves.append((row, column))
+
+    def status(self) -> Dict[str, Any]:
+        return {"to_move": self.board.get_active_player(),
+                "winner": self.winner()}
+
+
+class EngineServer:
+    """Holds the games and the worker pool, and answers requests."""
+
+    def __init__(self, workers: int, board_sizes: List[int],
+                 max_time: float, max_pending: int, max_board_size: int = 19,
+                 max_games: int = 1000, max_playouts: int = 100000) -> None:
+        self.workers = workers
+        self.board_sizes = board_sizes
+        self.pool = self.make_pool()
+        self.max_time = max_time
+        self.max_pending = max_pending
+        self.max_board_size = max_board_size
+        self.max_games = max_games
+        self.max_playouts = max_playouts
+        self.pending = 0
+        self.games: Dict[str, Game] = {}
+
+    def make_pool(self):
+        return make_pool(self.workers, initializer=warm_up,
+                         initargs=(self.board_sizes,))
+
+    def replace_pool(self, broken) -> None:
+        """Replaces the pool if it is still the broken one; several requests
+        may find out that it broke."""
+        if self.pool is broken:
+            self.pool = self.make_pool()
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                reply = await self.handle_line(line)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_line(self, line: bytes) -> Dict[str, Any]:
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            request_id = request.get("id")
+            handler = getattr(self, "cmd_" + str(request.get("cmd")), None)
+            if handler is None:
+                raise ValueError(f"unknown command {request.get('cmd')!r}")
+            reply = await handler(request)
+            reply["ok"] = True
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"ok": False, "error": str(e)}
+        except BrokenProcessPool:
+            reply = {"ok": False,
+                     "error": "a search process died, try again"}
+        except Exception as e:
+            # Anything else, such as an error raised by a search in a
+            # worker, fails the request rather than the connection.
+            reply = {"ok": False, "error": f"internal error: {e!r}"}
+        if request_id is not None:
+            reply["id"] = request_id
+        return reply
+
+    def game(self, request: Dict[str, Any]) -> Game:
+        game = self.games.get(request["game"])
+        if game is None:
+            raise ValueError(f"unknown game {request['game']!r}")
+        return game
+
+    async def cmd_new_game(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        board_size = int(request.get("board_size", 7))
+        if not 2 <= board_size <= self.max_board_size:
+            raise ValueError("board_size must be between 2 and"
+                             f" {self.max_board_size}")
+        if len(self.games) >= self.max_games:
+            raise ValueError("too many live games, end some first")
+        game_id = uuid.uuid4().hex
+        game = Game(board_size)
+        self.games[game_id] = game
+        return {"game": game_id, **game.status()}
+
+    async def cmd_move(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        game = self.game(request)
+        async with game.lock:
+            if game.winner() is not None:
+                raise ValueError("the game is over")
+            game.play(int(request["row"]), int(request["column"]))
+            return game.status()
+
+    async def cmd_engine_move(self, request: Dict[str, Any]
+                              ) -> Dict[str, Any]:
+        game = self.game(request)
+        engine = request.get("engine", "mcts")
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine!r}")
+        depth = int(request.get("depth", 2))
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        playouts = int(request.get("playouts", 1000))
+        if not 0 <= playouts <= self.max_playouts:
+            raise ValueError("playouts must be between 0 and"
+                             f" {self.max_playouts}")
+        ucb_const = float(request.get("ucb", .5))
+        time_limit = self.max_time
+        if request.get("time") is not None:
+            requested = float(request["time"])
+            if not (math.isfinite(requested) and requested >= 0):
+                raise ValueError("time must be a finite number of seconds,"
+                                 " at least 0")
+            time_limit = min(requested, self.max_time)
+
+        async with game.lock:
+            if game.winner() is not None:
+                raise ValueError("the game is over")
+            if self.pending >= self.max_pending:
+                raise ValueError("server busy, try again later")
+            self.pending += 1
+            start = time.perf_counter()
+            pool = self.pool
+            try:
+                move = await asyncio.get_running_loop().run_in_executor(
+                    pool, search, game.board, engine, depth, playouts,
+                    ucb_const, time_limit, random.getrandbits(64))
+            except BrokenProcessPool:
+                # A worker died (killed, out of memory, ...); the pool
+                # takes no more work, so later requests need a new one.
+                self.replace_pool(pool)
+                raise
+            finally:
+                self.pending -= 1
+            elapsed = time.perf_counter() - start
+            if move is not None:
+                game.play(*move)
+            return {"move": move, "elapsed": elapsed, **game.status()}
+
+    async def cmd_state(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        game = self.game(request)
+        return {"board_size": game.board.size, "moves": game.moves,
+                "legal_moves": [(move.row, move.column)
+                                for move in game.board.get_legal_moves()],
+                **game.status()}
+
+    async def cmd_end_game(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        self.game(request)
+        del self.games[request["game"]]
+        return {}
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1", help=(
+        "Address to listen on. Default=127.0.0.1."))
+    p.add_argument("--port", type=int, default=7777, help=(
+        "TCP port to listen on. Default=7777."))
+    p.add_argument("--unix", default=None, help=(
+        "Listen on this Unix socket path instead of TCP."))
+    p.add_argument("--workers", type=int, default=None, help=(
+        "Number of search processes. Defaults to the number of CPUs."))
+    p.add_argument("--board_sizes", type=int, nargs="*", default=[7], help=(
+        "Board sizes each worker warms up for. Default=7."))
+    p.add_argument("--max_time", type=float, default=10.0, help=(
+        "Cap on the time limit of a search, in seconds. Default=10."))
+    p.add_argument("--max_pending", type=int, default=64, help=(
+        "Searches that may be queued or running at once; further engine"
+        " moves are refused until some finish. Default=64."))
+    p.add_argument("--max_board_size", type=int, default=19, help=(
+        "Largest board size a new game may have. Default=19."))
+    p.add_argument("--max_playouts", type=int, default=100000, help=(
+        "Most playouts an mcts search may ask for. Default=100000."))
+    p.add_argument("--max_games", type=int, default=1000, help=(
+        "Games that may be live at once; further new games are refused"
+        " until some end. Default=1000."))
+    return p.parse_args()
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = EngineServer(args.workers, args.board_sizes, args.max_time,
+                          args.max_pending, args.max_board_size,
+                          args.max_games, args.max_playouts)
+    if args.unix is not None:
+        listener = await asyncio.start_unix_server(
+            server.handle_connection, path=args.unix)
+    else:
+        listener = await asyncio.start_server(
+            server.handle_connection, args.host, args.port)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.pool.shutdown(cancel_futures=True)
+
+
+def main() -> None:
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Board features for learned evaluation functions.
+
+Features are computed with NumPy directly from the padded grid, so they work
+equally on a single board's grid of shape (size+2, size+2) and on a stack of
+grids of shape (N, size+2, size+2). Everything needed (whose turn it is,
+which stage the game is in) is recovered from the stones on the grid. Every
+feature is written from the max (red) player's point of view, so a positive
+weight means "good for red".
+
+FeatureEvaluator turns a weight vector over these features into a heuristic
+for MinimaxPlayer.
+"""
+
+from __future__ import annotations
+import json
+from typing import Tuple, Union
+import numpy as np
+from common_values import EMPTY, RED, YELLOW
+
+FEATURE_NAMES = (
+    "mobility",
+    "potential",
+    "frontier",
+    "adjacency",
+    "isolated",
+    "edge",
+    "tempo",
+    "stage",
+    "stage_frontier",
+)
+
+
+def neighbour_counts(grid: np.ndarray, piece: int) -> np.ndarray:
+    """Number of neighbours (orthogonal or diagonal) of each interior square
+    holding piece. The result has the shape of the interior of the grid."""
+    mask = (grid == piece).astype(np.int8)
+    rows = mask.shape[-2] - 2
+    cols = mask.shape[-1] - 2
+    counts = np.zeros(mask.shape[:-2] + (rows, cols), dtype=np.int8)
+    for row_offset in (0, 1, 2):
+        for col_offset in (0, 1, 2):
+            if row_offset == 1 and col_offset == 1:
+                continue
+            counts += mask[..., row_offset:row_offset + rows,
+                           col_offset:col_offset + cols]
+    return counts
+
+
+def extract_features(grid: np.ndarray) -> np.ndarray:
+    """Feature vector(s) for a padded grid or a stack of padded grids. The
+    last axis of the result indexes FEATURE_NAMES."""
+    return _features(np.asarray(grid))[0]
+
+
+def _features(grid: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Features along with the number of legal moves for red and for
+    yellow."""
+    size = grid.shape[-1] - 2
+    area = float(size * size)
+    interior = grid[..., 1:size + 1, 1:size + 1]
+    empty = interior == EMPTY
+    red = interior == RED
+    yellow = interior == YELLOW
+    sum_axes = (-2, -1)
+
+    red_placed = red.sum(axis=sum_axes)
+    yellow_placed = yellow.sum(axis=sum_axes)
+    second_stage = (red_placed >= size - 1) & (yellow_placed >= size - 1)
+
+    red_counts = neighbour_counts(grid, RED)
+    yellow_counts = neighbour_counts(grid, YELLOW)
+
+    # Squares each player could move to in the second stage, and squares that
+    # touch at least one of their stones.
+    red_potential = (empty & (red_counts >= 2)).sum(axis=sum_axes)
+    yellow_potential = (empty & (yellow_counts >= 2)).sum(axis=sum_axes)
+    red_frontier = (empty & (red_counts >= 1)).sum(axis=sum_axes)
+    yellow_frontier = (empty & (yellow_counts >= 1)).sum(axis=sum_axes)
+
+    num_empty = empty.sum(axis=sum_axes)
+    red_mobility = np.where(second_stage, red_potential, num_empty)
+    yellow_mobility = np.where(second_stage, yellow_potential, num_empty)
+
+    # Each friendly pair of neighbours is counted from both ends.
+    red_adjacency = (red_counts * red).sum(axis=sum_axes)
+    yellow_adjacency = (yellow_counts * yellow).sum(axis=sum_axes)
+    red_isolated = (red & (red_counts == 0)).sum(axis=sum_axes)
+    yellow_isolated = (yellow & (yellow_counts == 0)).sum(axis=sum_axes)
+
+    # Stones on the outermost ring of the playable area.
+    ring = np.ones((size, size), dtype=bool)
+    ring[1:-1, 1:-1] = False
+    red_edge = (red & ring).sum(axis=sum_axes)
+    yellow_edge = (yellow & ring).sum(axis=sum_axes)
+
+    frontier = (red_frontier - yellow_frontier) / area
+    tempo = np.where(red_placed == yellow_placed, 1.0, -1.0)
+    stage = np.minimum(
+        (red_placed + yellow_placed) / (2.0 * max(size - 1, 1)), 1.0)
+
+    features = np.stack([
+        (red_mobility - yellow_mobility) / area,
+        (red_potential - yellow_potential) / area,
+        frontier,
+        (red_adjacency - yellow_adjacency) / (2 * area),
+        (red_isolated - yellow_isolated) / area,
+        (red_edge - yellow_edge) / area,
+        tempo,
+        stage,
+        stage * frontier,
+    ], axis=-1).astype(np.float64)
+    return features, red_mobility, yellow_mobility
+
+
+class FeatureEvaluator:
+    """Heuristic that scores a board as tanh(w . features), with the weight
+    vector w usually fitted by tune_heuristic.py. Instances can be passed to
+    MinimaxPlayer anywhere a heuristic function is expected. Boards on which
+    the player to move has no legal moves get the exact value +1 or -1."""
+
+    def __init__(self, weights: Union[str, np.ndarray]) -> None:
+        if isinstance(weights, str):
+            weights = load_weights(weights)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        if self.weights.shape != (len(FEATURE_NAMES),):
+            raise ValueError("Expected one weight per feature in "
+                             + str(FEATURE_NAMES))
+
+    def __call__(self, board) -> float:
+        features, red_mobility, yellow_mobility = _features(board.grid)
+        if board.get_active_player() == RED:
+            if red_mobility == 0:
+                return -1.0
+        elif yellow_mobility == 0:
+            return 1.0
+        return float(np.tanh(features @ self.weights))
+
+
+def save_weights(path: str, weights: np.ndarray) -> None:
+    """Stores a weight vector, one weight per feature, as JSON."""
+    with open(path, "w") as f:
+        json.dump({"features": list(FEATURE_NAMES),
+                   "weights": [float(w) for w in weights]}, f, indent=1)
+
+
+def load_weights(path: str) -> np.ndarray:
+    """Loads a weight vector written by save_weights."""
+    with open(path) as f:
+        data = json.load(f)
+    if tuple(data["features"]) != FEATURE_NAMES:
+        raise ValueError("Weights in " + path + " are for features "
+                         + str(data["features"]) + ", expected "
+                         + str(list(FEATURE_NAMES)))
+    return np.array(data["weights"], dtype=np.float64)
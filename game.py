@@ -7,33 +7,50 @@ You should not modify any code in this file.
 """
 
 
+from __future__ import annotations
 import random
 import argparse
-from typing import Optional, Dict
-from game_board import GameBoard, Location
-from player import Player
-from human_player import HumanPlayer
-from minimax_player import MinimaxPlayer, heuristic
-from mcts_player import MctsPlayer
+import time
+from typing import TYPE_CHECKING, Optional, Dict, Any, Callable, Sequence
 from common_values import (
     PLAYER_1, PLAYER_2, COLOR_NAMES, MARKERS)
 
+# The board (and with it NumPy) and the player backends are imported where
+# they are first needed, so that "--help" is instant and a run only loads the
+# engines it plays with.
+if TYPE_CHECKING:
+    from game_board import GameBoard, Location
+    from game_record import GameRecord
+    from mcts_player import MctsConfig
+    from player import Player
+
 
 def parse_args() -> argparse.Namespace:
     """ Parse command line arguments.
     """
     p = argparse.ArgumentParser()
 
-    p.add_argument("player1type", choices=['human', 'minimax', 'mcts'])
-    p.add_argument("player2type", choices=['human', 'minimax', 'mcts'])
+    p.add_argument("player1type", choices=['human', 'minimax', 'alphabeta',
+                                             'mcts'])
+    p.add_argument("player2type", choices=['human', 'minimax', 'alphabeta',
+                                             'mcts'])
 
     p.add_argument("--plies1", type=int, default=1, help=(
-        "Only relevant if player1type is minimax; number of plies ahead that"
-        " it should look. Default=1."))
+        "Only relevant if player1type is minimax or alphabeta; number of"
+        " plies ahead that it should look. Default=1."))
 
     p.add_argument("--plies2", type=int, default=1, help=(
-        "Only relevant if player2type is minimax; number of plies ahead that"
-        " it should look. Default=1"))
+        "Only relevant if player2type is minimax or alphabeta; number of"
+        " plies ahead that it should look. Default=1"))
+
+    p.add_argument("--weights1", type=str, default=None, help=(
+        "Only relevant if player1type is minimax or alphabeta; file of feature"
+        " weights written by tune_heuristic.py. If given, the feature-based"
+        " evaluator is used instead of the default heuristic."))
+
+    p.add_argument("--weights2", type=str, default=None, help=(
+        "Only relevant if player2type is minimax or alphabeta; as"
+        " --weights1."))
 
     p.add_argument("--playouts1", type=int, default=0, help=(
         "Only relevant if player1type is mcts; number of playouts it should"
@@ -51,6 +68,111 @@ def parse_args() -> argparse.Namespace:
         "Only relevant if player2type is mcts; value for its UCB exploration"
         " constant. Default=.5"))
 
+    p.add_argument("--rollout_batch1", type=int, default=1, help=(
+        "Only relevant if player1type is mcts; number of random playouts run"
+        " together (vectorised) from each newly expanded node. Each counts"
+        " as one of the playouts. Default=1."))
+
+    p.add_argument("--rollout_batch2", type=int, default=1, help=(
+        "Only relevant if player2type is mcts; as --rollout_batch1."))
+
+    p.add_argument("--threads1", type=int, default=1, help=(
+        "Only relevant if player1type is mcts; number of threads searching"
+        " one shared tree (see mcts_parallel). Combine with --rollout_batch1"
+        " so the threads can overlap. Default=1."))
+
+    p.add_argument("--threads2", type=int, default=1, help=(
+        "Only relevant if player2type is mcts; as --threads1."))
+
+    p.add_argument("--widening1", action="store_true", default=False, help=(
+        "Only relevant if player1type is mcts; use progressive widening,"
+        " unlocking moves in order of prior as nodes are visited."))
+
+    p.add_argument("--widening2", action="store_true", default=False, help=(
+        "Only relevant if player2type is mcts; as --widening1."))
+
+    p.add_argument("--puct1", type=float, default=None, help=(
+        "Only relevant if player1type is mcts; select children by PUCT with"
+        " this exploration constant instead of UCB."))
+
+    p.add_argument("--puct2", type=float, default=None, help=(
+        "Only relevant if player2type is mcts; as --puct1."))
+
+    p.add_argument("--prior1", choices=['adjacency', 'heuristic'],
+                   default='adjacency', help=(
+        "Only relevant with --widening1 or --puct1; how move priors are"
+        " computed. Default=adjacency."))
+
+    p.add_argument("--prior2", choices=['adjacency', 'heuristic'],
+                   default='adjacency', help=(
+        "Only relevant with --widening2 or --puct2; as --prior1."))
+
+    p.add_argument("--rave1", type=float, default=None, help=(
+        "Only relevant if player1type is mcts; blend all-moves-as-first"
+        " (RAVE) statistics into move selection, with this equivalence"
+        " parameter (roughly the number of playouts after which a move's own"
+        " statistics count as much as its AMAF ones, e.g. 300)."))
+
+    p.add_argument("--rave2", type=float, default=None, help=(
+        "Only relevant if player2type is mcts; as --rave1."))
+
+    p.add_argument("--transpositions1", choices=['exact', 'symmetric'],
+                   default=None, help=(
+        "Only relevant if player1type is mcts; search a DAG in which"
+        " transposed positions share statistics. 'symmetric' also merges"
+        " rotations and reflections."))
+
+    p.add_argument("--transpositions2", choices=['exact', 'symmetric'],
+                   default=None, help=(
+        "Only relevant if player2type is mcts; as --transpositions1."))
+
+    p.add_argument("--max_nodes1", type=int, default=None, help=(
+        "Only relevant if player1type is mcts; cap on the number of tree"
+        " nodes. Least visited subtrees are pruned when it is reached."))
+
+    p.add_argument("--max_nodes2", type=int, default=None, help=(
+        "Only relevant if player2type is mcts; as --max_nodes1."))
+
+    p.add_argument("--leaf_eval1", choices=['rollout', 'heuristic',
+                                            'alphabeta'],
+                   default='rollout', help=(
+        "Only relevant if player1type is mcts; evaluate new nodes by random"
+        " rollouts, by the minimax heuristic or by a shallow alpha-beta"
+        " search. Default=rollout."))
+
+    p.add_argument("--leaf_eval2", choices=['rollout', 'heuristic',
+                                            'alphabeta'],
+                   default='rollout', help=(
+        "Only relevant if player2type is mcts; as --leaf_eval1."))
+
+    p.add_argument("--leaf_depth1", type=int, default=1, help=(
+        "Only relevant with --leaf_eval1 alphabeta; search depth. Default=1."))
+
+    p.add_argument("--leaf_depth2", type=int, default=1, help=(
+        "Only relevant with --leaf_eval2 alphabeta; as --leaf_depth1."))
+
+    p.add_argument("--leaf_mix1", type=float, default=1.0, help=(
+        "Only relevant with --leaf_eval1 heuristic or alphabeta; weight of"
+        " the evaluation against random rollouts. Default=1 (no rollouts)."))
+
+    p.add_argument("--leaf_mix2", type=float, default=1.0, help=(
+        "Only relevant with --leaf_eval2 heuristic or alphabeta; as"
+        " --leaf_mix1."))
+
+    p.add_argument("--rollout_cutoff1", type=int, default=None, help=(
+        "Only relevant if player1type is mcts; stop rollouts after this many"
+        " plies and score the position reached with the heuristic."))
+
+    p.add_argument("--rollout_cutoff2", type=int, default=None, help=(
+        "Only relevant if player2type is mcts; as --rollout_cutoff1."))
+
+    p.add_argument("--ponder1", action="store_true", default=False, help=(
+        "Only relevant if player1type is alphabeta or mcts; keep searching"
+        " in the background while the opponent chooses their move."))
+
+    p.add_argument("--ponder2", action="store_true", default=False, help=(
+        "Only relevant if player2type is alphabeta or mcts; as --ponder1."))
+
     p.add_argument("--num_games", type=int, default=1,
                    help=("Number of games to play). Default=1"))
 
@@ -65,17 +187,43 @@ def parse_args() -> argparse.Namespace:
         "Seed for random number generator. Defaults to no seed, i.e., using"
         "Python default randomness source."))
 
+    p.add_argument("--record", type=str, default=None, help=(
+        "File to append a record of every game to (moves, players, result and"
+        " time per move). Compressed with gzip if the name ends in .gz."))
+
+    p.add_argument("--profile", type=str, default=None, help=(
+        "Time the engines' hot paths, print a summary after every game and"
+        " write the call stacks to this file in collapsed format (for"
+        " flamegraph.pl or speedscope)."))
+
     args = p.parse_args()
     return args
 
 
-def playGame(players, board_size, silent) -> int:
-    '''Manages playing an actual game.'''
+def playGame(players, board_size, silent,
+             record: Optional[GameRecord] = None,
+             opening: Sequence[Location] = ()) -> int:
+    '''Manages playing an actual game. If record is supplied, the moves made,
+    the time taken to choose each of them and the winner are stored in it.
+    The moves of opening, if any, are made first on the players' behalf and
+    recorded as taking no time.'''
+
+    from game_board import GameBoard
 
     done = False
     currentBoard: GameBoard = GameBoard(board_size)
     currentPlayer = PLAYER_1
 
+    for move in opening:
+        board_copy = currentBoard.make_move(move)
+        if board_copy is None:
+            raise ValueError(f"Illegal opening move {move}")
+        currentBoard = board_copy
+        if record is not None:
+            record.moves.append((move.row, move.column))
+            record.times.append(0.0)
+        currentPlayer *= -1
+
     while not done:
 
         # Display board and statistics
@@ -96,7 +244,9 @@ def playGame(players, board_size, silent) -> int:
 
             firstTime = False
 
+            start = time.perf_counter()
             move = players[currentPlayer].choose_move(currentBoard)
+            elapsed = time.perf_counter() - start
             if not silent:
                 if move is not None:
                     print("Move chosen = ", move.row, ",", move.column)
@@ -105,6 +255,9 @@ def playGame(players, board_size, silent) -> int:
 
             if move is None:
                 # Player concedes
+                if record is not None:
+                    record.moves.append(None)
+                    record.times.append(elapsed)
                 break
 
             board_copy = currentBoard.make_move(move)
@@ -112,6 +265,12 @@ def playGame(players, board_size, silent) -> int:
             if board_copy is not None:
                 # Legal move made
                 currentBoard = board_copy
+                # Let the player think on the opponent's time, if it can
+                if currentBoard.has_legal_move():
+                    players[currentPlayer].ponder(currentBoard)
+                if record is not None:
+                    record.moves.append((move.row, move.column))
+                    record.times.append(elapsed)
                 break
 
         # Flip to other player
@@ -121,13 +280,121 @@ def playGame(players, board_size, silent) -> int:
         if move is None:
             done = True
 
+    for player in players.values():
+        player.stop_pondering()
+
     if not silent:
         # Display final outcome
         print('\n-----\n')
         print(COLOR_NAMES[currentPlayer], "wins!")
+    if record is not None:
+        record.winner = currentPlayer
     return currentPlayer
 
 
+def choose_heuristic(weights: Optional[str]) -> Callable[[GameBoard], float]:
+    '''The default heuristic, or the feature-based evaluator if a weights file
+    was supplied.'''
+    if weights is None:
+        import minimax_player
+        # Looked up at call time, so that a profiler enabled beforehand
+        # sees its wrapped version.
+        return minimax_player.heuristic
+    from features import FeatureEvaluator
+    return FeatureEvaluator(weights)
+
+
+def mcts_config(args: argparse.Namespace, player: int) -> MctsConfig:
+    '''Builds the MCTS tree policy options of one player.'''
+    from mcts_player import MctsConfig
+
+    suffix = "1" if player == PLAYER_1 else "2"
+    puct = getattr(args, "puct" + suffix)
+    rave = getattr(args, "rave" + suffix)
+    transpositions = getattr(args, "transpositions" + suffix)
+    return MctsConfig(widening=getattr(args, "widening" + suffix),
+                      puct=puct is not None,
+                      puct_const=puct if puct is not None else 1.0,
+                      prior=getattr(args, "prior" + suffix),
+                      rave=rave is not None,
+                      rave_equivalence=rave if rave is not None else 300.0,
+                      transpositions=transpositions is not None,
+                      symmetric=transpositions == 'symmetric',
+                      max_nodes=getattr(args, "max_nodes" + suffix),
+                      leaf_eval=getattr(args, "leaf_eval" + suffix),
+                      leaf_depth=getattr(args, "leaf_depth" + suffix),
+                      leaf_mix=getattr(args, "leaf_mix" + suffix),
+                      rollout_cutoff=getattr(args, "rollout_cutoff" + suffix))
+
+
+def make_player(args: argparse.Namespace, player: int) -> Player:
+    '''Builds one player, importing only the backend its type needs.'''
+    suffix = "1" if player == PLAYER_1 else "2"
+    player_type = getattr(args, "player" + suffix + "type")
+    if player_type == 'human':
+        from human_player import HumanPlayer
+        return HumanPlayer()
+    if player_type == 'minimax':
+        from minimax_player import MinimaxPlayer
+        return MinimaxPlayer(
+            choose_heuristic(getattr(args, "weights" + suffix)),
+            getattr(args, "plies" + suffix))
+    if player_type == 'alphabeta':
+        import minimax_player_ab
+        return minimax_player_ab.MinimaxPlayer(
+            choose_heuristic(getattr(args, "weights" + suffix)),
+            getattr(args, "plies" + suffix),
+            pondering=getattr(args, "ponder" + suffix))
+    if player_type == 'mcts':
+        from mcts_player import MctsPlayer
+        return MctsPlayer(getattr(args, "playouts" + suffix),
+                          getattr(args, "ucb" + suffix),
+                          getattr(args, "rollout_batch" + suffix),
+                          mcts_config(args, player),
+                          getattr(args, "threads" + suffix),
+                          getattr(args, "ponder" + suffix))
+    raise Exception(f'Player {suffix} type invalid.')
+
+
+def player_config(args: argparse.Namespace, player: int) -> Dict[str, Any]:
+    '''Describes the configuration of one player, for game records.'''
+    suffix = "1" if player == PLAYER_1 else "2"
+    player_type = getattr(args, "player" + suffix + "type")
+    config: Dict[str, Any] = {"type": player_type}
+    if player_type in ('minimax', 'alphabeta'):
+        config["plies"] = getattr(args, "plies" + suffix)
+        if getattr(args, "weights" + suffix) is not None:
+            config["weights"] = getattr(args, "weights" + suffix)
+    elif player_type == 'mcts':
+        config["playouts"] = getattr(args, "playouts" + suffix)
+        config["ucb"] = getattr(args, "ucb" + suffix)
+        config["rollout_batch"] = getattr(args, "rollout_batch" + suffix)
+        if getattr(args, "threads" + suffix) > 1:
+            config["threads"] = getattr(args, "threads" + suffix)
+        tree_policy = mcts_config(args, player)
+        if tree_policy.uses_priors():
+            config["widening"] = tree_policy.widening
+            config["puct"] = getattr(args, "puct" + suffix)
+            config["prior"] = tree_policy.prior
+        if tree_policy.rave:
+            config["rave"] = tree_policy.rave_equivalence
+        if tree_policy.transpositions:
+            config["transpositions"] = getattr(args, "transpositions" + suffix)
+        if tree_policy.max_nodes is not None:
+            config["max_nodes"] = tree_policy.max_nodes
+        if tree_policy.leaf_eval != 'rollout':
+            config["leaf_eval"] = tree_policy.leaf_eval
+            config["leaf_mix"] = tree_policy.leaf_mix
+            if tree_policy.leaf_eval == 'alphabeta':
+                config["leaf_depth"] = tree_policy.leaf_depth
+        if tree_policy.rollout_cutoff is not None:
+            config["rollout_cutoff"] = tree_policy.rollout_cutoff
+    if (player_type in ('alphabeta', 'mcts')
+            and getattr(args, "ponder" + suffix)):
+        config["ponder"] = True
+    return config
+
+
 def main() -> None:
     args = parse_args()
 
@@ -136,34 +403,54 @@ def main() -> None:
     if args.seed is not None:
         random.seed(args.seed)
 
-    if args.player1type == 'human':
-        players[PLAYER_1] = HumanPlayer()
-    elif args.player1type == 'minimax':
-        players[PLAYER_1] = MinimaxPlayer(heuristic, args.plies1)
-    elif args.player1type == 'mcts':
-        players[PLAYER_1] = MctsPlayer(args.playouts1, args.ucb1)
-    else:
-        raise Exception('Player 1 type invalid.')
-
-    if args.player2type == 'human':
-        players[PLAYER_2] = HumanPlayer()
-    elif args.player2type == 'minimax':
-        players[PLAYER_2] = MinimaxPlayer(heuristic, args.plies2)
-    elif args.player2type == 'mcts':
-        players[PLAYER_2] = MctsPlayer(args.playouts2, args.ucb2)
-    else:
-        raise Exception('Player 2 type invalid.')
+    profiler = None
+    if args.profile is not None:
+        # Imported and enabled only on request, and before the players are
+        # built, so that they pick up the wrapped functions.
+        from profiling import Profiler, print_summary
+        profiler = Profiler()
+        profiler.enable()
+
+    players[PLAYER_1] = make_player(args, PLAYER_1)
+    players[PLAYER_2] = make_player(args, PLAYER_2)
+
+    writer = None
+    if args.record is not None:
+        from game_record import GameRecord, GameRecordWriter
+        writer = GameRecordWriter(args.record)
+        configs = {PLAYER_1: player_config(args, PLAYER_1),
+                   PLAYER_2: player_config(args, PLAYER_2)}
 
     first_player_games_won = 0
-    for _ in range(args.num_games):
-        winner = playGame(players, args.board_size, args.silent)
-        if winner == PLAYER_1:
-            first_player_games_won += 1
-        if args.silent:
-            print(MARKERS[winner], end="", flush=True)
+    try:
+        for game_number in range(args.num_games):
+            record = None
+            if writer is not None:
+                record = GameRecord(args.board_size, configs, seed=args.seed)
+            start = time.perf_counter()
+            winner = playGame(players, args.board_size, args.silent, record)
+            game_time = time.perf_counter() - start
+            if writer is not None:
+                writer.write(record)
+            if winner == PLAYER_1:
+                first_player_games_won += 1
+            if args.silent:
+                print(MARKERS[winner], end="", flush=True)
+            if profiler is not None:
+                print_summary(profiler.end_game(), game_time,
+                              f"Game {game_number + 1}")
+    finally:
+        # Also keeps the games already played if one of them fails.
+        if writer is not None:
+            writer.close()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.write_collapsed(args.profile)
 
     print()
     print(f"Player 1 games won: {first_player_games_won}/{args.num_games}")
+    from game_board import GameBoard
     print("Average number of boards made per game:",
           GameBoard.get_num_boards_made() / args.num_games)
 
@@ -2,16 +2,22 @@ from __future__ import annotations
 from common_values import (
     EMPTY, MAX_PLAYER, MIN_PLAYER, RED, RED_MARKER, YELLOW, YELLOW_MARKER,
     COLOR_NAMES)
-from typing import Optional, List
+from typing import Dict, Iterator, Optional, List, Tuple
 import numpy as np
 import random
-from dataclasses import dataclass
+from board_geometry import BoardGeometry, Location, get_geometry
 
 
-@dataclass(eq=True, frozen=True)
-class Location:
-    row: int
-    column: int
+# Internally, squares are identified by their index in the flattened
+# (size+2)x(size+2) grid, i.e. row*(size+2) + column. Integers are far cheaper
+# to create and hash than Locations, and neighbouring squares are at fixed
+# offsets. Locations are only produced at the edge of the public API, from the
+# interned table in the board's geometry.
+Square = int
+
+# The grid holds EMPTY, RED or YELLOW, so one byte per square is enough; it
+# keeps copies cheap on large boards.
+GRID_DTYPE = np.int8
 
 
 class GameBoard:
@@ -21,28 +27,40 @@ class GameBoard:
     piece. A move, when made, transitions you to a different board/state.
     """
 
+    __slots__ = ("size", "geometry", "grid", "pieces_placed", "frontier",
+                 "ready", "stones", "_value", "_locations")
+
     # Number of boards made (incremented in __init__). Can serve as an
     # approximate proxy for measuring how many states are measured.
     _num_boards_made = 0
 
     def __init__(self, size, array: Optional[np.ndarray] = None,
-                 pieces_placed=None) -> None:
+                 pieces_placed=None,
+                 frontier: Optional[Dict[int, Dict[Square, int]]] = None,
+                 ready: Optional[Dict[int, int]] = None,
+                 stones: Optional[Dict[int, int]] = None) -> None:
         '''If the parameter 'board' is left out, then the game board is
         initialized to its typical starting postion. Alternatively, a
         two-dimensional list with a pre-existing starting position can be
         supplied as well. Note that the size of the board is
         (self.size+2)x(self.size+2), instead of self.sizexself.size; this is
         because leaving a ring around the edge of the board makes the rest of
-        the code much simpler. '''
+        the code much simpler. If frontier, ready and stones are supplied
+        they must match the grid; they are copied rather than recomputed. '''
 
         GameBoard._num_boards_made += 1
 
         self.size = size
+        # Tables shared by all boards of this size (neighbours, interned
+        # Locations, ...).
+        self.geometry: BoardGeometry = get_geometry(size)
+        self._locations = self.geometry.locations
 
         if array is not None:
-            self.grid: np.ndarray = array.copy()
+            self.grid: np.ndarray = array.astype(GRID_DTYPE)
         else:
-            self.grid = np.ones((self.size+2, self.size+2)) * EMPTY
+            self.grid = np.full((self.size+2, self.size+2), EMPTY,
+                                dtype=GRID_DTYPE)
 
         # Tracks number of pieces placed by each player, so as to determine
         # whether in first stage of the same or second. Can also be used to
@@ -55,6 +73,113 @@ class GameBoard:
         else:
             self.pieces_placed = {MAX_PLAYER: 0, MIN_PLAYER: 0}
 
+        # For each color, the empty squares that have at least one friendly
+        # neighbour, mapped to their number of friendly neighbours. In the
+        # second stage the legal moves are exactly the squares with a count
+        # of at least 2. Kept up to date by make_move, which only needs to
+        # visit the 8 neighbours of the new stone.
+        #
+        # ready holds, for each color, a bitboard (bit i set for square i) of
+        # the frontier squares with at least 2 friendly neighbours. Python
+        # ints are immutable, so copying it is free, and a random legal move
+        # can be picked from it without scanning the board.
+        #
+        # stones holds a bitboard of the squares taken by each color; the
+        # pair identifies the position (see position_key).
+        if frontier is not None and ready is not None and stones is not None:
+            self.frontier = {RED: frontier[RED].copy(),
+                             YELLOW: frontier[YELLOW].copy()}
+            self.ready = {RED: ready[RED], YELLOW: ready[YELLOW]}
+            self.stones = {RED: stones[RED], YELLOW: stones[YELLOW]}
+        elif array is not None:
+            self.frontier, self.ready = self._compute_frontier()
+            self.stones = self._compute_stones()
+        else:
+            self.frontier = {RED: {}, YELLOW: {}}
+            self.ready = {RED: 0, YELLOW: 0}
+            self.stones = {RED: 0, YELLOW: 0}
+
+        # Cached result of value(); boards are not changed once a move has
+        # been made from them, so it only needs computing once.
+        self._value: Optional[int] = None
+
+    def __getstate__(self) -> Tuple:
+        # The geometry is shared by every board of the same size, so it is
+        # looked up again when unpickling instead of being pickled (and sent
+        # to worker processes) along with each board.
+        return (self.size, self.grid, self.pieces_placed, self.frontier,
+                self.ready, self.stones, self._value)
+
+    def __setstate__(self, state: Tuple) -> None:
+        (self.size, self.grid, self.pieces_placed, self.frontier, self.ready,
+         self.stones, self._value) = state
+        self.geometry = get_geometry(self.size)
+        self._locations = self.geometry.locations
+
+    def _compute_frontier(self) -> Tuple[Dict[int, Dict[Square, int]],
+                                         Dict[int, int]]:
+        # The neighbour counts of all squares are computed at once with
+        # NumPy; only the frontier squares themselves are visited in Python.
+        frontier: Dict[int, Dict[Square, int]] = {RED: {}, YELLOW: {}}
+        ready = {RED: 0, YELLOW: 0}
+        cells = self.grid.ravel()
+        squares = self.geometry.square_array
+        empty = squares[cells[squares] == EMPTY]
+        for piece in (RED, YELLOW):
+            friendly = cells == piece
+            counts = np.zeros(len(empty), dtype=np.int8)
+            for offset in self.geometry.offsets:
+                counts += friendly[empty + offset]
+            touching = counts > 0
+            frontier[piece] = dict(zip(empty[touching].tolist(),
+                                       counts[touching].tolist()))
+            ready[piece] = _bitboard(empty[counts >= 2])
+        return frontier, ready
+
+    def _compute_stones(self) -> Dict[int, int]:
+        cells = self.grid.ravel()
+        return {piece: _bitboard(np.flatnonzero(cells == piece))
+                for piece in (RED, YELLOW)}
+
+    def position_key(self) -> Tuple[int, int]:
+        """A hashable key that identifies the position: equal for two boards
+        exactly when they hold the same stones (and so have the same player
+        to move and stage)."""
+        return (self.stones[RED], self.stones[YELLOW])
+
+    def canonical_key(self) -> Tuple[int, int]:
+        """Like position_key, but the same for all 8 rotations and
+        reflections of the position."""
+        best = None
+        red = self.stones[RED]
+        yellow = self.stones[YELLOW]
+        for symmetry in self.geometry.symmetries:
+            key = (_permute_bits(red, symmetry),
+                   _permute_bits(yellow, symmetry))
+            if best is None or key < best:
+                best = key
+        return best
+
+    def square_of(self, location: Location) -> Optional[Square]:
+        """Index of the square at location, or None if location is not on
+        the board."""
+        row, column = location.row, location.column
+        if not (1 <= row <= self.size and 1 <= column <= self.size):
+            return None
+        return row * (self.size+2) + column
+
+    def is_on_board(self, square: Square) -> bool:
+        """Whether a square index is inside the playing area (rather than in
+        the ring around the edge)."""
+        return self.geometry.on_board[square]
+
+    def location_of(self, square: Square) -> Location:
+        """Location of a square index. The same object is returned every
+        time."""
+        location = self._locations[square]
+        assert location is not None, "Square is outside the board."
+        return location
+
     @classmethod
     def get_num_boards_made(cls) -> int:
         return GameBoard._num_boards_made
@@ -73,7 +198,8 @@ class GameBoard:
             raise Exception("Pieces placed is inconsistent.")
 
     def copy(self) -> GameBoard:
-        boardCopy = GameBoard(self.size, self.grid, self.pieces_placed)
+        boardCopy = GameBoard(self.size, self.grid, self.pieces_placed,
+                              self.frontier, self.ready, self.stones)
         return boardCopy
 
     def display(self) -> None:
@@ -105,15 +231,14 @@ class GameBoard:
     def num_adjacent_friendlies(self, location, piece) -> int:
         '''Counts the number of friendly pieces that are orthogonal or diagonal
         to the provided location.'''
-        row = location.row
-        col = location.column
+        square = self.square_of(location)
+        if square is None:
+            return 0
+        grid = self.grid
         numAdjacentFriendlies = 0
-        for rowIncrement in [-1, 0, 1]:
-            for colIncrement in [-1, 0, 1]:
-                if rowIncrement == 0 and colIncrement == 0:
-                    continue
-                if self.grid[row + rowIncrement][col + colIncrement] == piece:
-                    numAdjacentFriendlies += 1
+        for neighbour in self.geometry.neighbours[square]:
+            if grid.item(neighbour) == piece:
+                numAdjacentFriendlies += 1
         return numAdjacentFriendlies
 
     def in_second_stage(self) -> bool:
@@ -122,12 +247,18 @@ class GameBoard:
 
     def is_legal_move(self, location) -> bool:
         ''' Returns whether or not move is legal.'''
-        row = location.row
-        col = location.column
+        square = self.square_of(location)
+        return square is not None and self.is_legal_square(square)
+
+    def is_legal_square(self, square: Square) -> bool:
+        ''' Returns whether or not a move to the given square index is
+        legal.'''
         piece = self.get_active_player()
 
-        # A move cannot be made if a piece is already there.
-        if self.grid[row][col] != EMPTY:
+        # A move cannot be made outside the board or if a piece is already
+        # there.
+        if (not self.is_on_board(square)
+                or self.grid.item(square) != EMPTY):
             return False
 
         # A move cannot be made if the piece "value" is not red or yellow.
@@ -136,7 +267,7 @@ class GameBoard:
 
         # Extra restrictions once initial stage is over
         if (self.in_second_stage() and
-                self.num_adjacent_friendlies(location, piece) < 2):
+                not (self.ready[piece] >> square) & 1):
             return False
 
         return True
@@ -144,76 +275,228 @@ class GameBoard:
     def make_move(self, location) -> Optional[GameBoard]:
         ''' Returns None if move is not legal. Otherwise returns an
         updated board, which is a copy of the original.'''
+        square = self.square_of(location)
+        if square is None:
+            return None
+        return self.make_move_square(square)
+
+    def make_move_square(self, square: Square) -> Optional[GameBoard]:
+        ''' As make_move, for a square index.'''
 
         piece = self.get_active_player()
-        if not self.is_legal_move(location):
+        if not self.is_legal_square(square):
             return None
 
         # Make a copy of the board (not just the pointer!) and record move
         boardCopy = self.copy()
-        row = location.row
-        col = location.column
-        boardCopy.grid[row][col] = piece
-        boardCopy.pieces_placed[piece] += 1
+        boardCopy._place(square, piece)
 
         return boardCopy
 
+    def _place(self, square: Square, piece: int) -> None:
+        '''Puts a piece on an empty square of this board, updating the
+        frontiers of both colors.'''
+        grid = self.grid
+        width = self.size + 2
+        grid[divmod(square, width)] = piece
+        self.pieces_placed[piece] += 1
+        self.frontier[RED].pop(square, None)
+        self.frontier[YELLOW].pop(square, None)
+        bit = 1 << square
+        self.stones[piece] |= bit
+        ready = self.ready
+        ready[RED] &= ~bit
+        ready[YELLOW] &= ~bit
+        friendly = self.frontier[piece]
+        for neighbour in self.geometry.neighbours[square]:
+            if grid.item(neighbour) == EMPTY:
+                count = friendly.get(neighbour, 0) + 1
+                friendly[neighbour] = count
+                if count == 2:
+                    ready[piece] |= 1 << neighbour
+
     def get_randomized_moves(self) -> List[Location]:
         """Returns a randomly ordered list of all Locations on this board.
         Note that these are not necessarily legal moves.
         """
 
-        moves = []
-        for row in range(1, self.size+1):
-            for column in range(1, self.size+1):
-                location = Location(row, column)
-                moves.append(location)
+        locations = self._locations
+        moves = [locations[square] for square in self.geometry.squares]
         random.shuffle(moves)
         return moves
 
-    def get_random_legal_move(self) -> Optional[Location]:
+    def get_random_legal_move(self, rng=random) -> Optional[Location]:
         """Returns a randomly chosen legal move. Returns None if none are
-        possible.
+        possible. rng is the source of randomness (a random.Random, or the
+        random module itself).
+        """
+
+        square = self.get_random_legal_square(rng)
+        if square is None:
+            return None
+        return self._locations[square]
+
+    def get_random_legal_square(self, rng=random) -> Optional[Square]:
+        """As get_random_legal_move, for square indices. Takes O(1) expected
+        time in the first stage and O(log size) in the second."""
+
+        if self.in_second_stage():
+            ready = self.ready[self.get_active_player()]
+            if not ready:
+                return None
+            return _select_bit(ready, rng.randrange(ready.bit_count()))
+
+        # In the first stage every empty square is legal, and at most
+        # 2*(size-1) of the size*size squares are taken, so guessing squares
+        # until an empty one turns up almost always succeeds immediately.
+        squares = self.geometry.squares
+        grid = self.grid
+        for _ in range(16):
+            square = squares[rng.randrange(len(squares))]
+            if grid.item(square) == EMPTY:
+                return square
+        empty = self.get_legal_squares()
+        if not empty:
+            return None
+        return empty[rng.randrange(len(empty))]
+
+    def random_playout(self, rng=random,
+                       max_plies: Optional[int] = None) -> GameBoard:
+        """Plays uniformly random legal moves (drawn from rng) from this
+        position until the player to move has none, or until max_plies moves
+        have been made if given, and returns the final board. The moves are
+        made in place on a single copy, so no board is created per move; this
+        board is left unchanged."""
+
+        board = self.copy()
+        plies = 0
+        while max_plies is None or plies < max_plies:
+            square = board.get_random_legal_square(rng)
+            if square is None:
+                break
+            board._place(square, board.get_active_player())
+            plies += 1
+        return board
+
+    def iter_legal_squares(self) -> Iterator[Square]:
+        """Yields the square indices of the legal moves, in row-major order.
+        Nothing beyond the current move is computed, so stopping early is
+        cheap.
+        """
+
+        if self.in_second_stage():
+            # Bits come out lowest first, which is row-major order.
+            ready = self.ready[self.get_active_player()]
+            while ready:
+                low_bit = ready & -ready
+                yield low_bit.bit_length() - 1
+                ready ^= low_bit
+            return
+
+        # Every empty square is legal in the first stage.
+        squares = self.geometry.square_array
+        yield from squares[self.grid.ravel()[squares] == EMPTY].tolist()
+
+    def get_legal_squares(self) -> List[Square]:
+        """Returns a list of the square indices of the legal moves."""
+
+        return list(self.iter_legal_squares())
+
+    def iter_legal_moves(self) -> Iterator[Location]:
+        """Yields the Locations that represent legal moves, in row-major
+        order. Nothing beyond the current move is computed, so stopping early
+        is cheap.
         """
 
-        moves = self.get_randomized_moves()
-        for move in moves:
-            if self.is_legal_move(move):
-                return move
-        return None
+        locations = self._locations
+        for square in self.iter_legal_squares():
+            yield locations[square]
 
     def get_legal_moves(self) -> List[Location]:
         """Returns a list of Locations that represent legal moves that can be
         made.
         """
 
-        legal_moves = []
-        for row in range(1, self.size+1):
-            for column in range(1, self.size+1):
-                location = Location(row, column)
-                if self.is_legal_move(location):
-                    legal_moves.append(location)
-        return legal_moves
+        locations = self._locations
+        return [locations[square] for square in self.iter_legal_squares()]
+
+    def has_legal_move(self) -> bool:
+        """Returns whether the current player has any legal move. Stops at
+        the first one found."""
+
+        if self.in_second_stage():
+            return self.ready[self.get_active_player()] != 0
+        return self.count_legal_moves() > 0
+
+    def count_legal_moves(self) -> int:
+        """Returns the number of legal moves, without building a list of
+        them."""
+
+        if self.in_second_stage():
+            return self.ready[self.get_active_player()].bit_count()
+        # Every empty square is legal in the first stage.
+        return (self.size * self.size - self.pieces_placed[MAX_PLAYER]
+                - self.pieces_placed[MIN_PLAYER])
 
     def is_terminal(self):
         """Returns True if this is a terminal state, i.e. the current player
-        cannot move. Otherwise, returns False. Make sure to notice that this
-        function calls get_legal_moves, so it is slow to call both
-        this function and get_legal_moves if you need to do both.
+        cannot move. Otherwise, returns False.
         """
 
-        return len(self.get_legal_moves()) == 0
+        return self.value() != 0
 
     def value(self) -> int:
         """Returns 0 if the state hasn't been won by anyone, returns 1 if it's
         a win for the first player (i.e., the first player just made a move
         that resulted in this state, which is a win for the first player), and
-        returns -1 if it's a win for the second player.
+        returns -1 if it's a win for the second player. The result is cached.
         """
-        if len(self.get_legal_moves()) > 0:
-            return 0
-
-        if self.get_active_player() == MIN_PLAYER:
-            return 1
-
-        return -1
+        if self._value is None:
+            if self.has_legal_move():
+                self._value = 0
+            elif self.get_active_player() == MIN_PLAYER:
+                self._value = 1
+            else:
+                self._value = -1
+        return self._value
+
+
+def _select_bit(bits: int, k: int) -> int:
+    """Index of the k-th (from 0, lowest first) set bit of bits, found by
+    repeatedly halving the range with popcounts."""
+    base = 0
+    width = bits.bit_length()
+    while width > 1:
+        half = width // 2
+        low = bits & ((1 << half) - 1)
+        low_count = low.bit_count()
+        if k < low_count:
+            bits = low
+            width = half
+        else:
+            k -= low_count
+            bits >>= half
+            base += half
+            width -= half
+    return base
+
+
+def _bitboard(squares: np.ndarray) -> int:
+    """Bitboard with the bits of the given square indices set, packed by
+    NumPy rather than set one at a time."""
+    if not len(squares):
+        return 0
+    mask = np.zeros(int(squares.max()) + 1, dtype=bool)
+    mask[squares] = True
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(),
+                          "little")
+
+
+def _permute_bits(bits: int, permutation) -> int:
+    """Moves every set bit i of bits to permutation[i]."""
+    result = 0
+    while bits:
+        low_bit = bits & -bits
+        result |= 1 << permutation[low_bit.bit_length() - 1]
+        bits ^= low_bit
+    return result
@@ -0,0 +1,128 @@
+"""Streaming storage for finished games.
+
+Each game is stored as one compact JSON line holding the board size, the
+configuration of both players, the list of moves, the time spent choosing
+each move and the winner. Records are only ever appended, so a file can keep
+growing across many runs, and the reader walks through it one game at a time
+without loading the whole file. Files whose name ends in ".gz" are written
+with gzip; appending to them adds a new gzip member, which gzip readers handle
+transparently.
+"""
+
+from __future__ import annotations
+import gzip
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+from game_board import GameBoard, Location
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+@dataclass
+class GameRecord:
+    """Everything needed to analyse or replay one game. A move of None means
+    that the player to move conceded (i.e. had no legal move)."""
+    board_size: int
+    players: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    moves: List[Optional[Tuple[int, int]]] = field(default_factory=list)
+    times: List[float] = field(default_factory=list)
+    winner: int = 0
+    seed: Optional[int] = None
+
+    def to_json(self) -> str:
+        data = {
+            "size": self.board_size,
+            "players": {str(k): v for k, v in self.players.items()},
+            "moves": [None if m is None else [m[0], m[1]]
+                      for m in self.moves],
+            "times": [round(t, 6) for t in self.times],
+            "winner": self.winner,
+        }
+        if self.seed is not None:
+            data["seed"] = self.seed
+        return json.dumps(data, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, line: str) -> GameRecord:
+        data = json.loads(line)
+        return cls(
+            board_size=data["size"],
+            players={int(k): v for k, v in data["players"].items()},
+            moves=[None if m is None else (m[0], m[1])
+                   for m in data["moves"]],
+            times=data["times"],
+            winner=data["winner"],
+            seed=data.get("seed"))
+
+
+class GameRecordWriter:
+    """Appends GameRecords to a file. Records are buffered and written
+    batch_size at a time; close() (or leaving the with block) writes whatever
+    is left over."""
+
+    def __init__(self, path: str, compress: Optional[bool] = None,
+                 batch_size: int = 64) -> None:
+        if compress is None:
+            compress = path.endswith(".gz")
+        self.path = path
+        self.batch_size = batch_size
+        self._buffer: List[str] = []
+        self._file: IO[str]
+        if compress:
+            self._file = gzip.open(path, "at", encoding="utf-8")
+        else:
+            self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: GameRecord) -> None:
+        self._buffer.append(record.to_json() + "\n")
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._file.writelines(self._buffer)
+            self._buffer = []
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> GameRecordWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_game_records(path: str) -> Iterator[GameRecord]:
+    """Yields the GameRecords stored in path, one at a time. Compression is
+    detected from the file contents rather than the name."""
+    with open(path, "rb") as raw:
+        compressed = raw.read(2) == GZIP_MAGIC
+    if compressed:
+        f = gzip.open(path, "rt", encoding="utf-8")
+    else:
+        f = open(path, "r", encoding="utf-8")
+    with f:
+        for line in f:
+            if line.strip():
+                yield GameRecord.from_json(line)
+
+
+def replay_boards(record: GameRecord) -> Iterator[GameBoard]:
+    """Replays a recorded game, yielding the board before each move and
+    finally the board the game ended on."""
+    board = GameBoard(record.board_size)
+    yield board
+    for move in record.moves:
+        if move is None:
+            return
+        next_board = board.make_move(Location(move[0], move[1]))
+        if next_board is None:
+            raise ValueError("Recorded move " + str(move) + " is illegal.")
+        board = next_board
+        yield board
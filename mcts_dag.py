@@ -0,0 +1,169 @@
+"""MCTS over a DAG of positions rather than a tree.
+
+In this game many different move orders lead to the same set of stones, and
+in a plain MCTS tree each of them gets its own node with its own statistics.
+Here nodes are stored in a table keyed by GameBoard.position_key (or by
+GameBoard.canonical_key, which also merges rotations and reflections), so
+all the paths that reach a position share one node and one set of visit and
+win counts. A playout still backpropagates only along the path it actually
+took.
+"""
+
+from __future__ import annotations
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+import numpy
+from batch_rollout import batch_random_playouts
+from common_values import MAX_PLAYER
+from game_board import GameBoard, Location
+
+
+class DagNode:
+    """A position in the search DAG. Statistics are from the perspective of
+    the player to move at this position, as for MctsNode."""
+
+    __slots__ = ("state", "children", "wins_for_this_player",
+                 "total_games_for_this_player", "legal_moves")
+
+    def __init__(self, state: GameBoard) -> None:
+        self.state = state
+
+        # Children reached so far, keyed by the square index of the move in
+        # this node's own state. Several nodes can share a child.
+        self.children: Dict[int, DagNode] = {}
+        self.wins_for_this_player = 0
+        self.total_games_for_this_player = 0
+        self.legal_moves = state.get_legal_squares()
+
+    def get_win_percentage_if_chosen_by_parent(self) -> float:
+        if self.total_games_for_this_player == 0:
+            return 0
+        return 1 - self.wins_for_this_player/self.total_games_for_this_player
+
+    def get_UCB_weight(self, parent_games: int, ucb_const: float) -> float:
+        """UCB weight of this node for a parent with parent_games playouts.
+        The node may have been visited through other parents too, so its own
+        count can exceed the parent's."""
+        if parent_games == 0 or self.total_games_for_this_player == 0:
+            return 0
+        return self.get_win_percentage_if_chosen_by_parent() + ucb_const * \
+            math.sqrt(math.log(max(parent_games, 1)) /
+                      self.total_games_for_this_player)
+
+
+class MctsDag:
+    """One search over a DAG of positions. With symmetric=True, positions
+    that are rotations or reflections of each other share a node; each
+    node's moves are then expressed in the frame of the state it was
+    created with, which is consistent because a node only ever uses its own
+    state."""
+
+    def __init__(self, ucb_const: float, symmetric: bool = False) -> None:
+        self.ucb_const = ucb_const
+        self.symmetric = symmetric
+        self.table: Dict[Tuple[int, int], DagNode] = {}
+
+    def key(self, state: GameBoard) -> Tuple[int, int]:
+        if self.symmetric:
+            return state.canonical_key()
+        return state.position_key()
+
+    def node_for(self, state: GameBoard) -> Tuple[DagNode, bool]:
+        """The node for state, and whether it had to be created."""
+        key = self.key(state)
+        node = self.table.get(key)
+        if node is not None:
+            return node, False
+        node = DagNode(state)
+        self.table[key] = node
+        return node, True
+
+    def choose_move(self, board: GameBoard, playouts: int, rng=random,
+                    rollout_batch: int = 1) -> Optional[Location]:
+        """Runs playouts playouts from board and returns the move leading to
+        the child with the highest win percentage, as
+        MctsNode.choose_move_via_mcts does. The DAG can be reused for a
+        later position of the same game (e.g. after pondering), and its
+        nodes are then shared with the new search."""
+        root, _ = self.node_for(board)
+        if root.state.position_key() != board.position_key():
+            # A symmetric image of board, whose moves are in another frame;
+            # start over rather than translate them.
+            self.table = {}
+            root, _ = self.node_for(board)
+        if playouts == 0:
+            return board.get_random_legal_move(rng)
+
+        if rollout_batch > 1:
+            batch_rng = numpy.random.default_rng(rng.getrandbits(64))
+
+        while playouts > 0:
+            path, leaf_is_new = self.select(root)
+            leaf = path[-1]
+            if not leaf_is_new:
+                # The path ended on a terminal position.
+                outcome = leaf.state.value()
+                self.backpropagate(path, 1 if outcome == MAX_PLAYER else 0, 1)
+            elif rollout_batch > 1:
+                games = min(rollout_batch, playouts)
+                outcomes, _ = batch_random_playouts(leaf.state, games,
+                                                    batch_rng)
+                self.backpropagate(
+                    path, int((outcomes == MAX_PLAYER).sum()), games)
+                playouts -= games - 1
+            else:
+                final_state = leaf.state.random_playout(rng)
+                outcome = -final_state.get_active_player()
+                self.backpropagate(path, 1 if outcome == MAX_PLAYER else 0, 1)
+            playouts -= 1
+
+        best_value = float("-inf")
+        best_move = None
+        for move, child in root.children.items():
+            if child.get_win_percentage_if_chosen_by_parent() > best_value:
+                best_value = child.get_win_percentage_if_chosen_by_parent()
+                best_move = move
+        if best_move is None:
+            return board.get_random_legal_move(rng)
+        return board.location_of(best_move)
+
+    def select(self, root: DagNode) -> Tuple[List[DagNode], bool]:
+        """Walks down from root, expanding the first unexpanded move it meets.
+        Returns the path taken and whether its last node was newly created
+        (and so needs a rollout) rather than terminal. Reaching an existing
+        node through a new edge (a transposition) does not stop the walk."""
+        path = [root]
+        node = root
+        while node.legal_moves:
+            next_node = None
+            for move in node.legal_moves:
+                if move not in node.children:
+                    child, created = self.node_for(
+                        node.state.make_move_square(move))
+                    node.children[move] = child
+                    path.append(child)
+                    if created:
+                        return path, True
+                    next_node = child
+                    break
+            if next_node is None:
+                parent_games = node.total_games_for_this_player
+                next_node = max(
+                    node.children.values(),
+                    key=lambda child: child.get_UCB_weight(parent_games,
+                                                           self.ucb_const))
+                path.append(next_node)
+            node = next_node
+        return path, False
+
+    def backpropagate(self, path: List[DagNode], max_player_wins: int,
+                      games: int) -> None:
+        """Adds games playouts, of which max_player_wins were won by the
+        first player, to every node on path."""
+        for node in path:
+            node.total_games_for_this_player += games
+            if node.state.get_active_player() == MAX_PLAYER:
+                node.wins_for_this_player += max_player_wins
+            else:
+                node.wins_for_this_player += games - max_player_wins
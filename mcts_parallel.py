@@ -0,0 +1,251 @@
+"""Parallel MCTS.
+
+Tree parallelism: several threads share one MctsNode tree. Each thread
+repeatedly selects and expands a leaf, runs a rollout from it and
+backpropagates the result. The tree is only touched while holding a lock,
+and those sections are short; the rollouts, which take most of the time, run
+outside it. To keep the threads from all walking down the same path, every
+node on a path gets a virtual loss while its rollout is in flight, which
+temporarily makes it look worse to its parent. With batched rollouts
+(rollout_batch > 1) the rollout kernel is NumPy, which releases the GIL, so
+threads overlap even on a standard interpreter; on a free-threaded build the
+pure Python rollouts overlap as well.
+
+Root parallelism: several processes each search their own tree from the
+same position, and the root statistics are merged at the end.
+
+Run this module to benchmark the modes against a single-threaded search with
+the same playout budget:
+    python mcts_parallel.py --board_size 7 --playouts 2000 --threads 4
+"""
+
+from __future__ import annotations
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+import numpy
+from batch_rollout import batch_random_playouts
+from common_values import MAX_PLAYER
+from game_board import GameBoard, Location
+from mcts_player import MctsConfig, MctsNode
+from worker_pool import make_pool
+
+
+def tree_parallel_search(root: MctsNode, playouts: int, threads: int,
+                         rng=random, rollout_batch: int = 1,
+                         virtual_loss: int = 1) -> Optional[Location]:
+    """Runs playouts playouts on root's tree with threads worker threads
+    and returns the chosen move, as MctsNode.choose_move_via_mcts does."""
+    if playouts == 0 or not root.legal_moves:
+        return root.state.get_random_legal_move(rng)
+
+    lock = threading.Lock()
+    # Playouts not yet claimed by a worker, and the nodes whose rollouts are
+    # running (which must survive pruning under a node budget); only
+    # accessed under lock.
+    remaining = [playouts]
+    in_flight = []
+    seeds = [rng.getrandbits(64) for _ in range(threads)]
+
+    def worker(seed: int) -> None:
+        thread_rng = random.Random(seed)
+        batch_rng = numpy.random.default_rng(seed)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                root.enforce_node_budget(in_flight)
+                end_node, new_node = root.select()
+                node = end_node if end_node is not None else new_node
+                games = 1
+                if end_node is None and rollout_batch > 1:
+                    games = min(rollout_batch, remaining[0])
+                remaining[0] -= games
+                add_virtual_loss(node, virtual_loss)
+                in_flight.append(node)
+
+            evaluated = end_node is None and root.config.uses_evaluation()
+            if evaluated:
+                wins, used, final_grids, outcomes = node.evaluate(
+                    games, thread_rng, batch_rng)
+                if used < games:
+                    with lock:
+                        remaining[0] += games - used
+                    games = used
+            elif end_node is not None:
+                outcomes = numpy.array([end_node.state.value()])
+                final_grids = end_node.state.grid[numpy.newaxis]
+            elif games > 1:
+                outcomes, final_grids = batch_random_playouts(
+                    node.state, games, batch_rng)
+            else:
+                final_state = node.state.random_playout(thread_rng)
+                outcomes = numpy.array([-final_state.get_active_player()])
+                final_grids = final_state.grid[numpy.newaxis]
+            if not evaluated:
+                wins = int((outcomes == MAX_PLAYER).sum())
+
+            with lock:
+                in_flight.remove(node)
+                add_virtual_loss(node, -virtual_loss)
+                node.update_play_counts_many(wins, games)
+                if root.config.rave and len(outcomes):
+                    node.update_amaf_counts(final_grids, outcomes)
+
+    workers = [threading.Thread(target=worker, args=(seed,))
+               for seed in seeds]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return best_move(root, rng)
+
+
+def add_virtual_loss(node: MctsNode, amount: int) -> None:
+    """Adds amount virtual playouts, all lost from the point of view of the
+    parent choosing each node, to node and its ancestors (a negative amount
+    removes them again)."""
+    while node is not None:
+        node.total_games_for_this_player += amount
+        node.wins_for_this_player += amount
+        node = node.parent
+
+
+def best_move(root: MctsNode, rng=random) -> Optional[Location]:
+    """The move to the expanded child of root with the highest win
+    percentage, or a random legal move if none was expanded."""
+    best_value = float("-inf")
+    best = None
+    for move, child in root.children.items():
+        if child.get_win_percentage_if_chosen_by_parent() > best_value:
+            best_value = child.get_win_percentage_if_chosen_by_parent()
+            best = move
+    if best is None:
+        return root.state.get_random_legal_move(rng)
+    return root.state.location_of(best)
+
+
+def search_root_statistics(board: GameBoard, playouts: int, ucb_const: float,
+                           config: MctsConfig, rollout_batch: int,
+                           seed: int) -> Dict[int, Tuple[float, int]]:
+    """Runs one independent search and returns, for each expanded move at the
+    root, (wins from the root player's perspective, playouts). Runs in a
+    worker process for root_parallel_search."""
+    root = MctsNode(board, None, ucb_const, config)
+    root.choose_move_via_mcts(playouts, random.Random(seed), rollout_batch)
+    return {move: (child.total_games_for_this_player
+                   - child.wins_for_this_player,
+                   child.total_games_for_this_player)
+            for move, child in root.children.items()}
+
+
+def root_parallel_search(board: GameBoard, playouts: int, workers: int,
+                         ucb_const: float, config: Optional[MctsConfig] = None,
+                         rollout_batch: int = 1, rng=random,
+                         pool: Optional[ProcessPoolExecutor] = None
+                         ) -> Optional[Location]:
+    """Splits playouts between workers independent searches run in a process
+    pool, merges their root statistics and returns the move with the highest
+    combined win percentage. A pool can be passed in to avoid starting new
+    processes on every move."""
+    if config is None:
+        config = MctsConfig()
+    shares = [playouts // workers + (i < playouts % workers)
+              for i in range(workers)]
+    own_pool = pool is None
+    if own_pool:
+        pool = make_pool(workers, [board.size])
+    try:
+        futures = [pool.submit(search_root_statistics, board, share,
+                               ucb_const, config, rollout_batch,
+                               rng.getrandbits(64))
+                   for share in shares if share > 0]
+        merged: Dict[int, Tuple[float, int]] = {}
+        for future in futures:
+            for move, (wins, games) in future.result().items():
+                old_wins, old_games = merged.get(move, (0, 0))
+                merged[move] = (old_wins + wins, old_games + games)
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+    best_value = float("-inf")
+    best = None
+    for move, (wins, games) in merged.items():
+        if games > 0 and wins / games > best_value:
+            best_value = wins / games
+            best = move
+    if best is None:
+        return board.get_random_legal_move(rng)
+    return board.location_of(best)
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("--board_size", type=int, default=7, help=(
+        "Size of the game board. 7 by default."))
+    p.add_argument("--playouts", type=int, default=2000, help=(
+        "Playout budget per search. Default=2000."))
+    p.add_argument("--threads", type=int, default=4, help=(
+        "Threads (tree parallel) and processes (root parallel). Default=4."))
+    p.add_argument("--rollout_batch", type=int, default=16, help=(
+        "Playouts per batched rollout. Default=16."))
+    p.add_argument("--searches", type=int, default=5, help=(
+        "Number of positions searched per mode. Default=5."))
+    p.add_argument("--seed", type=int, default=0, help=(
+        "Seed for the positions and the searches. Default=0."))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    # Positions a few random moves into a game.
+    boards = []
+    for _ in range(args.searches):
+        board = GameBoard(args.board_size)
+        for _ in range(rng.randrange(args.board_size)):
+            board = board.make_move_square(board.get_random_legal_square(rng))
+        boards.append(board)
+
+    def single(board, batch):
+        return MctsNode(board, None, 1.0).choose_move_via_mcts(
+            args.playouts, random.Random(rng.getrandbits(64)), batch)
+
+    def tree(board, batch):
+        return tree_parallel_search(
+            MctsNode(board, None, 1.0), args.playouts, args.threads,
+            random.Random(rng.getrandbits(64)), batch)
+
+    with make_pool(args.threads, [args.board_size]) as pool:
+        def root(board, batch):
+            return root_parallel_search(
+                board, args.playouts, args.threads, 1.0, rollout_batch=batch,
+                rng=random.Random(rng.getrandbits(64)), pool=pool)
+
+        # Start the worker processes before timing anything.
+        root(boards[0], 1)
+        modes = [("single-threaded", single, 1),
+                 ("single-threaded, batched", single, args.rollout_batch),
+                 ("tree parallel", tree, 1),
+                 ("tree parallel, batched", tree, args.rollout_batch),
+                 ("root parallel", root, 1),
+                 ("root parallel, batched", root, args.rollout_batch)]
+        print(f"{'mode':<28}{'s/search':>10}{'playouts/s':>12}")
+        for name, search, batch in modes:
+            start = time.perf_counter()
+            for board in boards:
+                search(board, batch)
+            elapsed = (time.perf_counter() - start) / len(boards)
+            print(f"{name:<28}{elapsed:>10.3f}"
+                  f"{args.playouts / elapsed:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,10 +11,167 @@ Originally based on work by:
 from __future__ import annotations
 import random
 from game_board import GameBoard, Location
-from typing import Optional
+from typing import Optional, List, Tuple
+from dataclasses import dataclass
 from player import Player
 import math
+import threading
+import time
 import numpy
+from batch_rollout import batch_random_playouts
+from common_values import MAX_PLAYER, MIN_PLAYER
+from minimax_player import heuristic
+import minimax_player_ab
+from mcts_dag import MctsDag
+
+# Playouts run by a pondering search between checks for being stopped, and
+# the cap on a pondering search, as a multiple of the player's playouts, or
+# for a player with only a time limit, of the playouts its last move took
+# (pondering on a slow opponent would otherwise grow the tree without
+# bound).
+PONDER_CHUNK = 32
+PONDER_PLAYOUTS_FACTOR = 10
+
+# Playouts run between checks of the clock by a player with a time limit.
+TIMED_CHUNK = 32
+
+
+@dataclass
+class MctsConfig:
+    """Options for the tree policy, shared by all the nodes of a search.
+
+    widening:           progressive widening. A node with n playouts only
+                        considers its first ceil(widening_base *
+                        (n+1)**widening_exponent) moves, in order of prior,
+                        so new children are unlocked as the node is
+                        visited more.
+    puct:               select children by PUCT, Q + puct_const * prior *
+                        sqrt(N) / (1 + n), instead of UCB. Children that
+                        have not been expanded yet count as Q = .5.
+    prior:              how move priors are computed when widening or puct
+                        is on: 'adjacency' (friendly and enemy stones next
+                        to the square) or 'heuristic' (the minimax
+                        heuristic of the resulting board).
+    rave:               keep all-moves-as-first (AMAF) statistics: a
+                        playout counts for every move that the player to
+                        move at a node made at any point later in it, not
+                        only for the move actually played at the node. A
+                        stone is worth much the same whenever it was placed,
+                        so these statistics are a good early estimate.
+    rave_equivalence:   k in the RAVE schedule beta = sqrt(k / (3n + k)),
+                        the weight of the AMAF win rate against the normal
+                        one for a child with n playouts; roughly the number
+                        of playouts at which both count equally.
+    transpositions:     search a DAG in which transpositions (different
+                        move orders reaching the same stones) share a node,
+                        see mcts_dag. Only plain UCB selection is supported
+                        in this mode.
+    symmetric:          with transpositions, also merge positions that are
+                        rotations or reflections of each other.
+    max_nodes:          cap on the number of nodes in the tree. When it is
+                        reached, the least visited subtrees below the root's
+                        children are pruned until prune_to * max_nodes
+                        nodes are left, and their nodes are recycled for
+                        later expansions (see NodePool). The root's
+                        children and all statistics of the nodes that are
+                        kept are preserved; a pruned move is simply
+                        expanded again from scratch if it is selected.
+                        As the root and its children are never pruned, a
+                        budget too small for them is raised to their number
+                        divided by prune_to (see NodePool.limits).
+    prune_to:           fraction of max_nodes to prune down to.
+    leaf_eval:          how a newly expanded node is evaluated: 'rollout'
+                        (random playouts), 'heuristic' (the minimax
+                        heuristic h of its position, read as a probability
+                        (h+1)/2 that the first player wins) or 'alphabeta'
+                        (the same for the value of an alpha-beta search
+                        leaf_depth plies deep). Evaluations count as
+                        fractional wins.
+    leaf_depth:         depth of the 'alphabeta' evaluation.
+    leaf_mix:           with 'heuristic' or 'alphabeta', the weight of the
+                        evaluation against random rollouts from the node;
+                        1 uses the evaluation alone, and counts it as a
+                        single playout.
+    rollout_cutoff:     stop random rollouts after this many plies and score
+                        the position reached by the heuristic, as above.
+    """
+    widening: bool = False
+    widening_base: float = 1.0
+    widening_exponent: float = 0.5
+    puct: bool = False
+    puct_const: float = 1.0
+    prior: str = 'adjacency'
+    rave: bool = False
+    rave_equivalence: float = 300.0
+    transpositions: bool = False
+    symmetric: bool = False
+    max_nodes: Optional[int] = None
+    prune_to: float = .75
+    leaf_eval: str = 'rollout'
+    leaf_depth: int = 1
+    leaf_mix: float = 1.0
+    rollout_cutoff: Optional[int] = None
+
+    def uses_priors(self) -> bool:
+        return self.widening or self.puct
+
+    def uses_evaluation(self) -> bool:
+        """Whether leaves are evaluated by MctsNode.evaluate rather than by
+        plain random playouts."""
+        return self.leaf_eval != 'rollout' or self.rollout_cutoff is not None
+
+
+def adjacency_priors(board: GameBoard, moves: List[int]) -> List[float]:
+    """Prior for each move, proportional to 1 + (friendly neighbours) +
+    .5 * (enemy neighbours). Squares next to friendly stones keep options
+    open for the second stage; squares next to enemy stones take them away
+    from the opponent."""
+    piece = board.get_active_player()
+    friendly = board.frontier[piece]
+    enemy = board.frontier[-piece]
+    weights = [1 + friendly.get(move, 0) + .5 * enemy.get(move, 0)
+               for move in moves]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+def heuristic_priors(board: GameBoard, moves: List[int]) -> List[float]:
+    """Prior for each move, proportional to 1 + the minimax heuristic of the
+    resulting board from the mover's point of view (so between 0 and 2)."""
+    piece = board.get_active_player()
+    weights = [1 + piece * heuristic(board.make_move_square(move))
+               for move in moves]
+    total = sum(weights)
+    if total <= 0:
+        return [1 / len(moves)] * len(moves)
+    return [weight / total for weight in weights]
+
+
+def heuristic_win_probability(board: GameBoard) -> float:
+    """Probability that the first player wins from board, read off the
+    minimax heuristic (exact if the game is over)."""
+    value = board.value()
+    if value != 0:
+        return 1.0 if value == MAX_PLAYER else 0.0
+    return (heuristic(board) + 1) / 2
+
+
+def win_probability(board: GameBoard, config: MctsConfig) -> float:
+    """Probability that the first player wins from board, under
+    config.leaf_eval ('heuristic' or 'alphabeta')."""
+    if config.leaf_eval == 'alphabeta' and board.value() == 0:
+        searcher = minimax_player_ab.MinimaxPlayer(heuristic,
+                                                   config.leaf_depth)
+        value, _ = searcher.search(board, config.leaf_depth)
+        # Lost and won positions come back as -inf and inf.
+        return (max(-1.0, min(1.0, value)) + 1) / 2
+    return heuristic_win_probability(board)
+
+
+PRIORS = {'adjacency': adjacency_priors, 'heuristic': heuristic_priors}
+
+# Values of MctsConfig.leaf_eval.
+LEAF_EVALS = ('rollout', 'heuristic', 'alphabeta')
 
 
 class MctsPlayer(Player):
@@ -27,35 +184,277 @@ class MctsPlayer(Player):
     terminal state, values are propagated back along the expanded portion of
     the path. After all playouts are completed, the move generating the highest
     value child of root is returned.
+
+    With pondering, the player keeps searching the position after its move
+    while the opponent thinks, and the next search starts from the subtree
+    of the move the opponent actually made (or, with transpositions, from
+    the DAG built so far). The pondering search runs in a thread, so in a
+    match between two engines in one process it shares the interpreter with
+    the opponent's search; it pays off against opponents that think
+    elsewhere, such as a human or a remote engine.
+
+    With a time_limit (in seconds), the search runs in chunks of playouts
+    until the time is up, and playouts, if not 0, is only an upper bound.
     """
 
-    def __init__(self, playouts, ucb_const):
+    def __init__(self, playouts, ucb_const, rollout_batch=1,
+                 config: Optional[MctsConfig] = None, threads=1,
+                 pondering=False, time_limit: Optional[float] = None):
         self.playouts = playouts
-        self.ucb_const = math.sqrt(2)
+        self.ucb_const = ucb_const
+        self.time_limit = time_limit
+        self.rollout_batch = rollout_batch
+        self.config = config if config is not None else MctsConfig()
+        self.threads = threads
+        if self.config.transpositions and (
+                self.config.uses_priors() or self.config.rave
+                or self.config.uses_evaluation()):
+            raise ValueError("Transpositions cannot be combined with"
+                             " widening, PUCT, RAVE or leaf evaluation.")
+        if self.config.transpositions and threads > 1:
+            raise ValueError("Transpositions cannot be combined with"
+                             " threads.")
+        if self.config.transpositions and self.config.max_nodes is not None:
+            raise ValueError("Transpositions cannot be combined with a node"
+                             " budget.")
+        # Private random stream for playouts. It is seeded from the global
+        # generator, so games are still reproducible under --seed.
+        self.rng = random.Random(random.getrandbits(64))
+
+        self.pondering = pondering
+        # The tree (MctsNode root, or MctsDag) of the last move chosen, kept
+        # for pondering to continue from; the tree grown while pondering; and
+        # the thread growing it.
+        self._searched = None
+        self._pondered = None
+        self._ponder_thread: Optional[threading.Thread] = None
+        self._ponder_stop = threading.Event()
+        # Playouts run by the last search with a time limit.
+        self._timed_playouts = 0
+
+    def ponder(self, board) -> None:
+        if not self.pondering:
+            return
+        self.stop_pondering()
+        searched, self._searched = self._searched, None
+        # Continue from the search of our last move: board is one of its
+        # root's children, and the DAG finds its nodes by position anyway.
+        tree = None
+        if self.config.transpositions:
+            tree = searched
+            if tree is None:
+                tree = MctsDag(self.ucb_const, self.config.symmetric)
+        else:
+            if searched is not None:
+                tree = searched.take_child_for(board)
+            if tree is None:
+                tree = MctsNode(board, None, self.ucb_const, self.config)
+        self._pondered = tree
+        self._ponder_stop = stop = threading.Event()
+
+        playouts = self.playouts if self.playouts > 0 else max(
+            self._timed_playouts, TIMED_CHUNK)
+
+        def search() -> None:
+            remaining = playouts * PONDER_PLAYOUTS_FACTOR
+            while remaining > 0 and not stop.is_set():
+                if self.config.transpositions:
+                    tree.choose_move(board, PONDER_CHUNK, self.rng,
+                                     self.rollout_batch)
+                else:
+                    tree.choose_move_via_mcts(PONDER_CHUNK, self.rng,
+                                              self.rollout_batch)
+                remaining -= PONDER_CHUNK
+
+        self._ponder_thread = threading.Thread(target=search, daemon=True)
+        self._ponder_thread.start()
+
+    def stop_pondering(self) -> None:
+        if self._ponder_thread is not None:
+            self._ponder_stop.set()
+            self._ponder_thread.join()
+            self._ponder_thread = None
 
     def choose_move(self, board) -> Optional[Location]:
-        root = MctsNode(board, None, self.ucb_const)
-        return root.choose_move_via_mcts(self.playouts)
+        self.stop_pondering()
+        pondered, self._pondered = self._pondered, None
+        if self.config.transpositions:
+            dag = pondered
+            if dag is None:
+                dag = MctsDag(self.ucb_const, self.config.symmetric)
+
+            def search(playouts):
+                return dag.choose_move(board, playouts, self.rng,
+                                       self.rollout_batch)
+        else:
+            root = None
+            if pondered is not None:
+                root = pondered.take_child_for(board)
+            if root is None:
+                root = MctsNode(board, None, self.ucb_const, self.config)
+
+            def search(playouts):
+                if self.threads > 1:
+                    # Imported here because mcts_parallel builds on this
+                    # module.
+                    from mcts_parallel import tree_parallel_search
+                    return tree_parallel_search(root, playouts, self.threads,
+                                                self.rng, self.rollout_batch)
+                return root.choose_move_via_mcts(playouts, self.rng,
+                                                 self.rollout_batch)
+
+        if self.pondering:
+            self._searched = dag if self.config.transpositions else root
+
+        if self.time_limit is None:
+            return search(self.playouts)
+        if not board.has_legal_move():
+            # No search would ever return a move, so the loop below would
+            # only stop at the playout limit, if there is one.
+            return None
+
+        # Search in chunks on the same tree until the time is up (or the
+        # playouts, if any were given, have been run).
+        deadline = time.perf_counter() + self.time_limit
+        remaining = self.playouts if self.playouts > 0 else math.inf
+        move = None
+        self._timed_playouts = 0
+        while remaining > 0 and (move is None
+                                 or time.perf_counter() < deadline):
+            chunk = min(TIMED_CHUNK, remaining)
+            move = search(chunk)
+            remaining -= chunk
+            self._timed_playouts += chunk
+        return move
+
+
+class NodePool:
+    """Keeps count of the nodes of one tree against MctsConfig.max_nodes, and
+    the nodes of pruned subtrees in a free list so that they can be reused
+    instead of allocating new ones."""
+
+    __slots__ = ("max_nodes", "prune_to", "live", "free")
+
+    def __init__(self, max_nodes: int, prune_to: float) -> None:
+        self.max_nodes = max_nodes
+        self.prune_to = prune_to
+        self.live = 0
+        self.free: List[MctsNode] = []
+
+    def new_node(self, state: GameBoard, parent: MctsNode, ucb_const: float,
+                 move: int) -> MctsNode:
+        """A child node for parent, recycled from the free list if possible."""
+        if self.free:
+            node = self.free.pop()
+            node.__init__(state, parent, ucb_const, move=move)
+            return node
+        return MctsNode(state, parent, ucb_const, move=move)
+
+    def release(self, node: MctsNode) -> None:
+        """Returns node and its subtree to the free list. The caller must
+        have detached node from its parent."""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children.values())
+            node.children = {}
+            node.state = None
+            node.parent = None
+            node.legal_moves = None
+            node.priors = None
+            node.amaf_wins = None
+            node.amaf_games = None
+            self.live -= 1
+            self.free.append(node)
+
+    def limits(self, root: MctsNode) -> Tuple[int, int]:
+        """The node budget of the tree below root and the number of nodes to
+        prune down to once it is reached. Pruning never goes below root and
+        all of its children, so if those alone are more than prune_to *
+        max_nodes, the budget is raised to (1 + root's number of legal
+        moves) / prune_to; otherwise the tree would be pruned again before
+        every playout."""
+        floor = 1 + len(root.legal_moves)
+        budget = max(self.max_nodes, math.ceil(floor / self.prune_to))
+        target = max(int(budget * self.prune_to), floor)
+        return max(budget, target + 1), target
+
+    def prune(self, root: MctsNode, in_flight=()) -> None:
+        """Releases the least visited subtrees below root's children until
+        the target of limits(root) is reached (or nothing more can be
+        pruned). Nodes in in_flight, which still have results to
+        backpropagate, are kept along with their ancestors."""
+        target = self.limits(root)[1]
+        protected = set()
+        for node in in_flight:
+            while node is not None and id(node) not in protected:
+                protected.add(id(node))
+                node = node.parent
+        # Candidates with their depth below root's grandchildren.
+        candidates = []
+        stack = [(grandchild, 0) for child in root.children.values()
+                 for grandchild in child.children.values()]
+        while stack:
+            node, depth = stack.pop()
+            candidates.append((node, depth))
+            stack.extend((child, depth + 1)
+                         for child in node.children.values())
+
+        # A node has no more playouts than its parent, so the least visited
+        # nodes are mostly leaves; ties go to the deepest.
+        candidates.sort(key=lambda candidate: (
+            candidate[0].total_games_for_this_player, -candidate[1]))
+        for node, _ in candidates:
+            if self.live <= target:
+                break
+            if node.state is None or id(node) in protected:
+                # Already released with an ancestor, or in use.
+                continue
+            del node.parent.children[node.move]
+            self.release(node)
 
 
 class MctsNode:
     """Node used in MCTS. It is a wrapper to contain a board/state as a node
     within a tree."""
 
+    __slots__ = ("state", "parent", "move", "ucb_const", "config",
+                 "children", "wins_for_this_player",
+                 "total_games_for_this_player", "legal_moves", "priors",
+                 "amaf_wins", "amaf_games", "pool")
+
     def __init__(self, state: GameBoard, parent: Optional[MctsNode],
-                 ucb_const: float) -> None:
+                 ucb_const: float, config: Optional[MctsConfig] = None,
+                 move: Optional[int] = None) -> None:
         """Constructor for a new node representing game state
         state. parent_node is the Node that is the parent of this
-        one in the MCTS tree.
+        one in the MCTS tree, and move the square index of the move that
+        leads from it to this node. config defaults to the parent's (or to
+        the default MctsConfig at the root).
         """
 
         self.state = state
         self.parent = parent
+        self.move = move
         self.ucb_const = ucb_const
+        if config is None:
+            config = parent.config if parent is not None else MctsConfig()
+        self.config = config
+
+        # Node budget bookkeeping, shared by the whole tree, if the config
+        # sets one.
+        if parent is not None:
+            self.pool: Optional[NodePool] = parent.pool
+        elif config.max_nodes is not None:
+            self.pool = NodePool(config.max_nodes, config.prune_to)
+        else:
+            self.pool = None
+        if self.pool is not None:
+            self.pool.live += 1
 
         # All of the known children for this node. To get to each child, a move
-        # (specificed by a Location) is used.
-        self.children: dict[Location, MctsNode] = {}
+        # (specified by a square index, see GameBoard.square_of) is used.
+        self.children: dict[int, MctsNode] = {}
 
         # Stats of games played out from this node, from the perspective of the
         # player at this node.
@@ -65,7 +464,25 @@ class MctsNode:
         # All legal moves that can me made from this node; useful to have once
         # to avoid recalculating later. Your code will be faster if you use
         # this value rather than calculating it when you need it.
-        self.legal_moves = self.state.get_legal_moves()
+        self.legal_moves = self.state.get_legal_squares()
+
+        # Prior probability of each legal move (same order as legal_moves),
+        # which is then sorted best first. Only computed if the config needs
+        # it.
+        self.priors: Optional[List[float]] = None
+        if config.uses_priors() and self.legal_moves:
+            priors = PRIORS[config.prior](self.state, self.legal_moves)
+            order = sorted(range(len(priors)), key=lambda i: -priors[i])
+            self.legal_moves = [self.legal_moves[i] for i in order]
+            self.priors = [priors[i] for i in order]
+
+        # AMAF statistics for each move from this node, from the perspective
+        # of the player at this node. Only kept if the config uses RAVE.
+        self.amaf_wins: Optional[dict[int, int]] = None
+        self.amaf_games: Optional[dict[int, int]] = None
+        if config.rave:
+            self.amaf_wins = {}
+            self.amaf_games = {}
 
         # You may add additional fields if needed below.
 
@@ -104,10 +521,25 @@ class MctsNode:
         if (parent.total_games_for_this_player == 0 or self.total_games_for_this_player == 0):
             return 0
 
-        return self.get_win_percentage_if_chosen_by_parent() + self.ucb_const * \
+        return self.get_value_estimate_for_parent() + self.ucb_const * \
             math.sqrt(numpy.log(parent.total_games_for_this_player) /
                       self.total_games_for_this_player)
 
+    def get_value_estimate_for_parent(self) -> float:
+        """The win percentage from the parent's perspective, blended with the
+        parent's AMAF win rate for this move when RAVE is on."""
+        win_percentage = self.get_win_percentage_if_chosen_by_parent()
+        parent = self.parent
+        if parent is None or parent.amaf_games is None:
+            return win_percentage
+        amaf_games = parent.amaf_games.get(self.move, 0)
+        if amaf_games == 0:
+            return win_percentage
+        k = self.config.rave_equivalence
+        beta = math.sqrt(k / (3 * self.total_games_for_this_player + k))
+        amaf_win_percentage = parent.amaf_wins[self.move] / amaf_games
+        return (1 - beta) * win_percentage + beta * amaf_win_percentage
+
     def update_play_counts(self, outcome: int) -> None:
         """Updates the total games played from this node, as well as the number
         of wins from this node for the current player.
@@ -117,21 +549,50 @@ class MctsNode:
         outcome: +1 for 1st player win, -1 for 2nd player win.
         """
 
-        node = self
+        self.update_play_counts_many(1 if outcome == MAX_PLAYER else 0, 1)
+
+    def update_play_counts_many(self, max_player_wins: int,
+                                games: int) -> None:
+        """Backpropagates the results of several games at once, e.g. a batch
+        of rollouts: games were played from this node, of which
+        max_player_wins were won by the first player."""
 
-        while (node.parent != None):
-            if node.state.get_active_player == outcome:
-                node.wins_for_this_player += 1
-            node.total_games_for_this_player += 1
+        node = self
+        while node is not None:
+            node.total_games_for_this_player += games
+            if node.state.get_active_player() == MAX_PLAYER:
+                node.wins_for_this_player += max_player_wins
+            else:
+                node.wins_for_this_player += games - max_player_wins
             node = node.parent
 
-        node.total_games_for_this_player += 1
-        if (node.state.get_active_player() == outcome):
-            node.wins_for_this_player += 1
-        # node.state.display()
-        # print(node.total_games_for_this_player, "root")
+    def update_amaf_counts(self, final_grids: numpy.ndarray,
+                           outcomes: numpy.ndarray) -> None:
+        """Backpropagates AMAF statistics from this node to the root, for
+        playouts that ended on final_grids (shape (K, size+2, size+2)) with
+        the given outcomes (+1/-1 each). Stones are never removed, so a
+        node's player played a move during a playout exactly when their
+        stone is on that square at the end."""
 
-    def choose_move_via_mcts(self, playouts: int) -> Optional[Location]:
+        cells = final_grids.reshape(len(final_grids), -1)
+        node = self
+        while node is not None:
+            if node.amaf_games is not None and node.legal_moves:
+                piece = node.state.get_active_player()
+                played = cells[:, node.legal_moves] == piece
+                games = played.sum(axis=0).tolist()
+                wins = played[outcomes == piece].sum(axis=0).tolist()
+                for move, move_games, move_wins in zip(node.legal_moves,
+                                                       games, wins):
+                    if move_games:
+                        node.amaf_games[move] = (
+                            node.amaf_games.get(move, 0) + move_games)
+                        node.amaf_wins[move] = (
+                            node.amaf_wins.get(move, 0) + move_wins)
+            node = node.parent
+
+    def choose_move_via_mcts(self, playouts: int, rng=random,
+                             rollout_batch: int = 1) -> Optional[Location]:
         """Select a move by Monte Carlo tree search. Plays playouts random
         games from the root node to a terminal state. In each playout, play
         proceeds according to UCB while all children have been expanded. The
@@ -142,7 +603,11 @@ class MctsNode:
         move generating the highest value child of root is returned.
 
         Returns None if no legal moves are available. If playouts is 0, returns
-        a random choice from the legal moves.
+        a random choice from the legal moves. Random moves are drawn from rng.
+
+        If rollout_batch is more than 1, each newly expanded node is evaluated
+        with that many random playouts at once (see batch_rollout), each of
+        which counts towards playouts.
 
         You will undoubtedly want to use helper functions when writing this,
         both some that I've provided, as well as helper functions of your own.
@@ -152,19 +617,50 @@ class MctsNode:
         merge that together
         """
         if playouts == 0:
-            legal_moves = self.state.get_random_legal_move()
+            legal_moves = self.state.get_random_legal_move(rng)
             return legal_moves
 
+        batch_rng = None
+        if rollout_batch > 1:
+            batch_rng = numpy.random.default_rng(rng.getrandbits(64))
+
         while (playouts > 0):
+            self.enforce_node_budget()
             endNode, unvisitedChildren = self.select()
 
             if endNode != None:
                 outcome = endNode.state.value()
                 # print("endstate", outcome)
                 endNode.update_play_counts(outcome)
+                if self.config.rave:
+                    endNode.update_amaf_counts(
+                        endNode.state.grid[numpy.newaxis],
+                        numpy.array([outcome]))
+
+            elif self.config.uses_evaluation():
+                wins, games, final_grids, outcomes = \
+                    unvisitedChildren.evaluate(min(rollout_batch, playouts),
+                                               rng, batch_rng)
+                unvisitedChildren.update_play_counts_many(wins, games)
+                if self.config.rave and len(outcomes):
+                    unvisitedChildren.update_amaf_counts(final_grids,
+                                                         outcomes)
+                playouts -= games - 1
+
+            elif rollout_batch > 1:
+                games = min(rollout_batch, playouts)
+                outcomes, final_grids = batch_random_playouts(
+                    unvisitedChildren.state, games, batch_rng)
+                unvisitedChildren.update_play_counts_many(
+                    int((outcomes == MAX_PLAYER).sum()), games)
+                if self.config.rave:
+                    unvisitedChildren.update_amaf_counts(final_grids,
+                                                         outcomes)
+                playouts -= games - 1
 
             else:
-                outcome, last_node = unvisitedChildren.random_play()
+                outcome, last_node, final_state = \
+                    unvisitedChildren.random_play(rng)
                 # print("unvisted", outcome)
                 # print(outcome)
 
@@ -172,31 +668,136 @@ class MctsNode:
                 # last_node.parent.state.display()
                 # last_node.parent.parent.state.display()
                 last_node.update_play_counts(outcome)
+                if self.config.rave:
+                    last_node.update_amaf_counts(
+                        final_state.grid[numpy.newaxis],
+                        numpy.array([outcome]))
             playouts -= 1
 
         max_UCB_weight_value = float("-inf")
         max_UCB_weight_move = None
 
         for child in self.legal_moves:
+            if child not in self.children:
+                continue
             if self.children[child].get_win_percentage_if_chosen_by_parent() >= max_UCB_weight_value:
                 max_UCB_weight_value = self.children[child].get_win_percentage_if_chosen_by_parent(
                 )
                 max_UCB_weight_move = child
 
         if max_UCB_weight_move == None:
-            move = self.state.get_random_legal_move()
+            move = self.state.get_random_legal_move(rng)
             # print(move, "hi")
             return move
         # self.state.display()
-        return max_UCB_weight_move
+        return self.state.location_of(max_UCB_weight_move)
+
+    def evaluate(self, max_games: int, rng=random, batch_rng=None):
+        """Evaluates this newly expanded node according to the config's
+        leaf_eval, leaf_mix and rollout_cutoff, as worth up to max_games
+        playouts (max_games > 1 needs batch_rng for batched rollouts).
+        Returns the (fractional) number of games won by the first player,
+        the number of games, and the final grids and outcomes of the
+        rollouts that reached the end of the game, for AMAF statistics."""
+        config = self.config
+        state = self.state
+        no_outcomes = numpy.empty(0, dtype=numpy.int8)
+        no_grids = numpy.empty((0,) + state.grid.shape, dtype=numpy.int8)
+
+        evaluation = None
+        if config.leaf_eval != 'rollout':
+            evaluation = win_probability(state, config)
+            if config.leaf_mix >= 1:
+                return evaluation, 1, no_grids, no_outcomes
+
+        games = max_games
+        if games > 1:
+            outcomes, final_grids = batch_random_playouts(
+                state, games, batch_rng, config.rollout_cutoff)
+            finished = outcomes != 0
+            wins = float((outcomes == MAX_PLAYER).sum())
+            for grid in final_grids[~finished]:
+                pieces = {MAX_PLAYER: int((grid == MAX_PLAYER).sum()),
+                          MIN_PLAYER: int((grid == MIN_PLAYER).sum())}
+                wins += heuristic_win_probability(GameBoard(
+                    state.size, grid.astype(state.grid.dtype), pieces))
+            final_grids = final_grids[finished]
+            outcomes = outcomes[finished]
+        else:
+            final_state = state.random_playout(rng, config.rollout_cutoff)
+            wins = heuristic_win_probability(final_state)
+            final_grids, outcomes = no_grids, no_outcomes
+            if final_state.value() != 0:
+                final_grids = final_state.grid[numpy.newaxis]
+                outcomes = numpy.array([final_state.value()])
+
+        if evaluation is not None:
+            wins = (config.leaf_mix * evaluation * games
+                    + (1 - config.leaf_mix) * wins)
+        return wins, games, final_grids, outcomes
+
+    def take_child_for(self, board: GameBoard) -> Optional[MctsNode]:
+        """The child of this node whose position is board, detached from
+        this tree so that a new search can continue from it, or None if no
+        such child was expanded."""
+        key = board.position_key()
+        for child in self.children.values():
+            if child.state.position_key() == key:
+                del self.children[child.move]
+                child.parent = None
+                if child.pool is not None:
+                    # The rest of the old tree is left to the garbage
+                    # collector, so only count the subtree that is kept.
+                    child.pool.live = child.count_nodes()
+                return child
+        return None
+
+    def count_nodes(self) -> int:
+        """Number of nodes in the subtree rooted at this node."""
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children.values())
+        return count
+
+    def visit_counts(self) -> dict[int, int]:
+        """Number of playouts that went through each expanded child, keyed by
+        the square index of the move leading to it."""
+        return {move: child.total_games_for_this_player
+                for move, child in self.children.items()}
+
+    def enforce_node_budget(self, in_flight=()) -> None:
+        """Called on the root before each selection: prunes the tree if it
+        has reached the node budget, so that the expansion that follows
+        stays within it. See NodePool.prune for in_flight."""
+        pool = self.pool
+        if pool is not None and pool.live >= pool.limits(self)[0]:
+            pool.prune(self, in_flight)
+
+    def expand(self, node: MctsNode, move: int) -> MctsNode:
+        """Adds the child of node (in this root's tree) reached by move."""
+        new_state = node.state.make_move_square(move)
+        if self.pool is not None:
+            child = self.pool.new_node(new_state, node, self.ucb_const, move)
+        else:
+            child = MctsNode(new_state, node, self.ucb_const, move=move)
+        node.children[move] = child
+        return child
 
     def select(self):
+        if self.config.uses_priors():
+            return self.select_with_priors()
+
         node = self
         highest_UCB_value = float("-inf")
         highest_UCB_node = None
         unvisitedChidlren = None
 
-        while ((node.state.value() == 0)):
+        # A node without legal moves is terminal; legal_moves is already known,
+        # so this avoids recomputing them through value().
+        while node.legal_moves:
             # print(len(node.legal_moves))
             # print("get in")
             highest_UCB_value = float("-inf")
@@ -204,11 +805,8 @@ class MctsNode:
             for move in node.legal_moves:
                 if move not in node.children:
                     # print("unvisited")
-                    newState = node.state.make_move(move)
                     unvisitedChidlren = True
-                    node.children[move] = MctsNode(
-                        newState, node, self.ucb_const)
-                    return (None, node.children[move])
+                    return (None, self.expand(node, move))
 
                 if move in node.children:
                     temp_node = node.children[move]
@@ -220,13 +818,70 @@ class MctsNode:
             node = highest_UCB_node
         return (node, None)
 
-    def random_play(self):
-        temp_state = self.state
-        temp_node = self
-        while (temp_node.state.value() == 0):
-            random_move = temp_node.state.get_random_legal_move()
-            temp_state = temp_state.make_move(random_move)
-
-            temp_node = MctsNode(temp_state, temp_node, self.ucb_const)
+    def num_widened_moves(self) -> int:
+        """Number of moves (from the front of legal_moves) this node currently
+        considers, under progressive widening."""
+        config = self.config
+        if not config.widening:
+            return len(self.legal_moves)
+        allowed = math.ceil(config.widening_base *
+                            (self.total_games_for_this_player + 1)
+                            ** config.widening_exponent)
+        return min(len(self.legal_moves), max(1, allowed))
+
+    def select_with_priors(self):
+        """Like select, for configs with progressive widening and/or PUCT.
+        Returns (terminal node, None) or (None, newly expanded node)."""
+        node = self
+        config = self.config
+        while node.legal_moves:
+            num_moves = node.num_widened_moves()
+            if config.puct:
+                move = node.best_puct_move(num_moves)
+            else:
+                move = None
+                for candidate in node.legal_moves[:num_moves]:
+                    if candidate not in node.children:
+                        move = candidate
+                        break
+                if move is None:
+                    move = max(
+                        node.legal_moves[:num_moves],
+                        key=lambda m: node.children[m]
+                        .get_UCB_weight_from_parent_perspective())
+
+            if move not in node.children:
+                return (None, self.expand(node, move))
+            node = node.children[move]
+        return (node, None)
 
-        return (temp_state.value(), temp_node)
+    def best_puct_move(self, num_moves: int) -> int:
+        """Among the first num_moves legal moves, the one with the highest
+        PUCT score from this node's perspective."""
+        sqrt_total = math.sqrt(self.total_games_for_this_player)
+        puct_const = self.config.puct_const
+        best_move = self.legal_moves[0]
+        best_score = float("-inf")
+        for move, prior in zip(self.legal_moves[:num_moves],
+                               self.priors[:num_moves]):
+            child = self.children.get(move)
+            if child is None or child.total_games_for_this_player == 0:
+                q, visits = .5, 0
+            else:
+                q = child.get_value_estimate_for_parent()
+                visits = child.total_games_for_this_player
+            score = q + puct_const * prior * sqrt_total / (1 + visits)
+            if score > best_score:
+                best_score, best_move = score, move
+        return best_move
+
+    def random_play(self, rng=random):
+        """Plays uniformly random moves (drawn from rng) from this node's
+        state until the player to move has none. Returns the outcome, the
+        node from which it should be backpropagated (this node; the states
+        visited by the playout are not added to the tree) and the final
+        state."""
+        temp_state = self.state.random_playout(rng)
+
+        # The player to move cannot move, so the other player has won.
+        return (-temp_state.get_active_player(), self, temp_state)
@@ -12,7 +12,7 @@ from player import Player
 from common_values import (
     EMPTY, MAX_PLAYER, MIN_PLAYER, RED, RED_MARKER, YELLOW, YELLOW_MARKER,
     COLOR_NAMES)
-from typing import Optional, List
+from typing import Iterator, Optional, List
 
 
 def heuristic(board: GameBoard) -> float:
@@ -41,14 +41,14 @@ def heuristic(board: GameBoard) -> float:
 
     # If max_player plays:
     if (active_player == 1):
-        num_legal_moves_for_max_player = len(board.get_legal_moves())
-        num_legal_moves_for_min_player = len(
-            get_legal_moves_for_other_player(board))
+        num_legal_moves_for_max_player = board.count_legal_moves()
+        num_legal_moves_for_min_player = \
+            count_legal_moves_for_other_player(board)
 
     else:
-        num_legal_moves_for_max_player = len(
-            get_legal_moves_for_other_player(board))
-        num_legal_moves_for_min_player = len(board.get_legal_moves())
+        num_legal_moves_for_max_player = \
+            count_legal_moves_for_other_player(board)
+        num_legal_moves_for_min_player = board.count_legal_moves()
 
     if num_legal_moves_for_max_player + num_legal_moves_for_min_player <= 0:
         return 0
@@ -73,19 +73,21 @@ class MinimaxPlayer(Player):
             value, move = self.max_value(self.plies, board)
         else:
             value, move = self.min_value(self.plies, board)
-        return move
+        # The search works on square indices; convert back for the caller.
+        if move is None:
+            return None
+        return board.location_of(move)
 
     def max_value(self, depth, board):
-        # Value of the Node
-        value = heuristic(board)
+        # Value of the Node, only needed once there are no plies left
+        value = self.heuristic(board) if depth <= 0 else None
 
-        list_moves = board.get_legal_moves()
+        list_moves = board.get_legal_squares()
         v, new_move = float("-inf"), None
         v2 = float("-inf")
 
         for move in list_moves:
-            temp_board = board.copy()
-            new_board = temp_board.make_move(move)
+            new_board = board.make_move_square(move)
             # If there is more plies
             if depth > 0:
                 v2, a2 = self.min_value(depth-1, new_board)
@@ -97,16 +99,15 @@ class MinimaxPlayer(Player):
         return v, new_move
 
     def min_value(self, depth, board):
-        # Value of the Node
-        value = heuristic(board)
+        # Value of the Node, only needed once there are no plies left
+        value = self.heuristic(board) if depth <= 0 else None
 
-        list_moves = board.get_legal_moves()
+        list_moves = board.get_legal_squares()
         v, new_move = float("inf"), None
         v2 = float("inf")
 
         for move in list_moves:
-            temp_board = board.copy()
-            new_board = temp_board.make_move(move)
+            new_board = board.make_move_square(move)
             # If there is more plies
             if depth > 0:
                 v2, a2 = self.max_value(depth-1, new_board)
@@ -140,15 +141,45 @@ def is_legal_move_for_other_player(board, location) -> bool:
     return True
 
 
+def iter_legal_moves_for_other_player(board) -> Iterator[Location]:
+    """Yields the Locations that the player who is not to move could legally
+    play, in row-major order.
+    """
+
+    for square in iter_legal_squares_for_other_player(board):
+        yield board.location_of(square)
+
+
+def iter_legal_squares_for_other_player(board) -> Iterator[int]:
+    """As iter_legal_moves_for_other_player, for square indices."""
+
+    if board.in_second_stage():
+        # Bits come out lowest first, which is row-major order.
+        ready = board.ready[-board.get_active_player()]
+        while ready:
+            low_bit = ready & -ready
+            yield low_bit.bit_length() - 1
+            ready ^= low_bit
+        return
+
+    # In the first stage both players may play on any empty square.
+    yield from board.iter_legal_squares()
+
+
 def get_legal_moves_for_other_player(board) -> List[Location]:
     """Returns a list of Locations that represent legal moves that can be
     made.
     """
 
-    legal_moves = []
-    for row in range(1, board.size+1):
-        for column in range(1, board.size+1):
-            location = Location(row, column)
-            if is_legal_move_for_other_player(board, location):
-                legal_moves.append(location)
-    return legal_moves
+    return list(iter_legal_moves_for_other_player(board))
+
+
+def count_legal_moves_for_other_player(board) -> int:
+    """Returns the number of legal moves for the player who is not to move,
+    without building a list of them.
+    """
+
+    if board.in_second_stage():
+        return board.ready[-board.get_active_player()].bit_count()
+    # In the first stage both players may play on any empty square.
+    return board.count_legal_moves()
@@ -6,13 +6,14 @@ Feel free to add additional helper methods or functions.
 """
 
 from __future__ import annotations
+import threading
 from game_board import GameBoard, Location
-from typing import Optional, Callable
+from typing import Dict, Optional, Callable, Tuple
 from player import Player
 from common_values import (
     EMPTY, MAX_PLAYER, MIN_PLAYER, RED, RED_MARKER, YELLOW, YELLOW_MARKER,
     COLOR_NAMES)
-from typing import Optional, List
+from typing import Iterator, Optional, List
 
 
 def heuristic(board: GameBoard) -> float:
@@ -41,14 +42,14 @@ def heuristic(board: GameBoard) -> float:
 
     # If max_player plays:
     if (active_player == 1):
-        num_legal_moves_for_max_player = len(board.get_legal_moves())
-        num_legal_moves_for_min_player = len(
-            get_legal_moves_for_other_player(board))
+        num_legal_moves_for_max_player = board.count_legal_moves()
+        num_legal_moves_for_min_player = \
+            count_legal_moves_for_other_player(board)
 
     else:
-        num_legal_moves_for_max_player = len(
-            get_legal_moves_for_other_player(board))
-        num_legal_moves_for_min_player = len(board.get_legal_moves())
+        num_legal_moves_for_max_player = \
+            count_legal_moves_for_other_player(board)
+        num_legal_moves_for_min_player = board.count_legal_moves()
 
     if num_legal_moves_for_max_player + num_legal_moves_for_min_player <= 0:
         return 0
@@ -56,39 +57,151 @@ def heuristic(board: GameBoard) -> float:
     return (num_legal_moves_for_max_player-num_legal_moves_for_min_player)/(num_legal_moves_for_max_player+num_legal_moves_for_min_player)
 
 
+# Kinds of transposition table entries: the stored value is exact, or only a
+# lower or upper bound because the search of that position was cut off.
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# The transposition table is cleared once it holds this many positions.
+MAX_TABLE_SIZE = 1 << 20
+
+
+class SearchStopped(Exception):
+    """Raised inside a search that stop_pondering interrupts."""
+
+
 class MinimaxPlayer(Player):
-    """Minimax player: uses minimax to find the best move."""
+    """Minimax player: uses minimax to find the best move.
+
+    With transpositions=True, the values of searched positions are kept in a
+    transposition table keyed by GameBoard.position_key, from one move to
+    the next; a position already searched at least as deep is not searched
+    again, and the best move found before is tried first.
+
+    With pondering=True (which implies the table), the player searches in
+    a background thread while the opponent thinks: first the opponent's
+    position, to predict their reply, then the position after that reply,
+    one ply deeper at a time. If the opponent plays the predicted move,
+    choose_move returns the deepest completed result at once; otherwise the
+    table has still been warmed. As for MctsPlayer, this only helps against
+    an opponent that does not run in the same interpreter.
+    """
 
     def __init__(self,
                  heuristic: Callable[[GameBoard], float],
-                 plies: int) -> None:
+                 plies: int, transpositions: bool = False,
+                 pondering: bool = False) -> None:
         self.heuristic = heuristic
         self.plies = plies
+        self.pondering = pondering
+        self.table: Optional[Dict[Tuple[int, int], Tuple]] = None
+        if transpositions or pondering:
+            self.table = {}
+        # Result of pondering: position_key of the predicted position, and
+        # the depth and move of the deepest search of it completed.
+        self._pondered: Optional[Tuple[Tuple[int, int], int, int]] = None
+        self._ponder_thread: Optional[threading.Thread] = None
+        self._stopping = False
 
     def choose_move(self, board: GameBoard) -> Optional[Location]:
+        self.stop_pondering()
+        pondered, self._pondered = self._pondered, None
+        if (pondered is not None and pondered[0] == board.position_key()
+                and pondered[1] >= self.plies):
+            return board.location_of(pondered[2])
+
+        _, move = self.search(board, self.plies)
+        # The search works on square indices; convert back for the caller.
+        if move is None:
+            return None
+        return board.location_of(move)
+
+    def search(self, board: GameBoard, depth: int):
+        """Searches board depth plies deep; returns (value, square)."""
+        if self.table is not None and len(self.table) > MAX_TABLE_SIZE:
+            self.table.clear()
         # Get player
         player = board.get_active_player()
         # If player 1, plays max_value
         if player == 1:
-            _, move = self.max_value_alpha_belta_pruning(
-                self.plies, board, float("-inf"), float("inf"))
-        else:
-            _, move = self.min_value_alpha_beta_pruning(
-                self.plies, board, float("-inf"), float("inf"))
-        return move
+            return self.max_value_alpha_belta_pruning(
+                depth, board, float("-inf"), float("inf"))
+        return self.min_value_alpha_beta_pruning(
+            depth, board, float("-inf"), float("inf"))
+
+    def ponder(self, board: GameBoard) -> None:
+        if not self.pondering:
+            return
+        self.stop_pondering()
+        self._stopping = False
+        self._ponder_thread = threading.Thread(
+            target=self.ponder_search, args=(board,), daemon=True)
+        self._ponder_thread.start()
+
+    def ponder_search(self, board: GameBoard) -> None:
+        """Body of the pondering thread."""
+        try:
+            _, reply = self.search(board, self.plies)
+            if reply is None:
+                return
+            predicted = board.make_move_square(reply)
+            key = predicted.position_key()
+            # Deepen until stopped, or until the rest of the game has been
+            # searched.
+            depth = self.plies
+            while depth <= self.plies + predicted.size * predicted.size:
+                _, move = self.search(predicted, depth)
+                if move is None:
+                    return
+                self._pondered = (key, depth, move)
+                depth += 1
+        except SearchStopped:
+            pass
+
+    def stop_pondering(self) -> None:
+        if self._ponder_thread is not None:
+            self._stopping = True
+            self._ponder_thread.join()
+            self._ponder_thread = None
+            self._stopping = False
+
+    def probe(self, board: GameBoard, depth: int, alpha: float, beta: float):
+        """The transposition table entry for board if it settles the search of
+        board at this depth and window, else None. Also returns the key of
+        board and the best move stored for it, if any."""
+        if self._stopping:
+            raise SearchStopped()
+        key = board.position_key()
+        entry = self.table.get(key)
+        if entry is None:
+            return None, key, None
+        entry_depth, value, bound, move = entry
+        if entry_depth >= depth and (
+                bound == EXACT or (bound == LOWER and value >= beta)
+                or (bound == UPPER and value <= alpha)):
+            return (value, move), key, move
+        return None, key, move
 
     def max_value_alpha_belta_pruning(self, depth, board, alpha, beta):
-        # Value of the Node
-        value = heuristic(board)
+        hint = None
+        if self.table is not None:
+            result, key, hint = self.probe(board, depth, alpha, beta)
+            if result is not None:
+                return result
+            alpha_orig = alpha
+        # Value of the Node, only needed once there are no plies left
+        value = self.heuristic(board) if depth <= 0 else None
         # List of possible move
-        list_moves = board.get_legal_moves()
+        list_moves = board.get_legal_squares()
+        if hint is not None:
+            # Best move of an earlier search of this position first
+            list_moves.remove(hint)
+            list_moves.insert(0, hint)
 
         v, new_move = float("-inf"), None
         v2 = float("-inf")
 
         for move in list_moves:
-            temp_board = board.copy()
-            new_board = temp_board.make_move(move)
+            new_board = board.make_move_square(move)
             # If there is more plies
             if depth > 0:
                 v2, a2 = self.min_value_alpha_beta_pruning(
@@ -100,20 +213,33 @@ class MinimaxPlayer(Player):
                 v, new_move = v2, move
                 alpha = max(alpha, v)
             if v >= beta:
-                return v, new_move
+                break
+        if self.table is not None:
+            bound = (LOWER if v >= beta else
+                     UPPER if v <= alpha_orig else EXACT)
+            self.table[key] = (depth, v, bound, new_move)
         return v, new_move
 
     def min_value_alpha_beta_pruning(self, depth, board, alpha, beta):
-        # Value of the Node
-        value = heuristic(board)
+        hint = None
+        if self.table is not None:
+            result, key, hint = self.probe(board, depth, alpha, beta)
+            if result is not None:
+                return result
+            beta_orig = beta
+        # Value of the Node, only needed once there are no plies left
+        value = self.heuristic(board) if depth <= 0 else None
         # List of possible move
-        list_moves = board.get_legal_moves()
+        list_moves = board.get_legal_squares()
+        if hint is not None:
+            # Best move of an earlier search of this position first
+            list_moves.remove(hint)
+            list_moves.insert(0, hint)
         v, new_move = float("inf"), None
         v2 = float("inf")
 
         for move in list_moves:
-            temp_board = board.copy()
-            new_board = temp_board.make_move(move)
+            new_board = board.make_move_square(move)
             # If there is more plies
             if depth > 0:
                 v2, a2 = self.max_value_alpha_belta_pruning(
@@ -125,7 +251,11 @@ class MinimaxPlayer(Player):
                 v, new_move = v2, move
                 beta = min(beta, v)
             if v <= alpha:
-                return v, new_move
+                break
+        if self.table is not None:
+            bound = (UPPER if v <= alpha else
+                     LOWER if v >= beta_orig else EXACT)
+            self.table[key] = (depth, v, bound, new_move)
         return v, new_move
 
 
@@ -151,15 +281,45 @@ def is_legal_move_for_other_player(board, location) -> bool:
     return True
 
 
+def iter_legal_moves_for_other_player(board) -> Iterator[Location]:
+    """Yields the Locations that the player who is not to move could legally
+    play, in row-major order.
+    """
+
+    for square in iter_legal_squares_for_other_player(board):
+        yield board.location_of(square)
+
+
+def iter_legal_squares_for_other_player(board) -> Iterator[int]:
+    """As iter_legal_moves_for_other_player, for square indices."""
+
+    if board.in_second_stage():
+        # Bits come out lowest first, which is row-major order.
+        ready = board.ready[-board.get_active_player()]
+        while ready:
+            low_bit = ready & -ready
+            yield low_bit.bit_length() - 1
+            ready ^= low_bit
+        return
+
+    # In the first stage both players may play on any empty square.
+    yield from board.iter_legal_squares()
+
+
 def get_legal_moves_for_other_player(board) -> List[Location]:
     """Returns a list of Locations that represent legal moves that can be
     made.
     """
 
-    legal_moves = []
-    for row in range(1, board.size+1):
-        for column in range(1, board.size+1):
-            location = Location(row, column)
-            if is_legal_move_for_other_player(board, location):
-                legal_moves.append(location)
-    return legal_moves
+    return list(iter_legal_moves_for_other_player(board))
+
+
+def count_legal_moves_for_other_player(board) -> int:
+    """Returns the number of legal moves for the player who is not to move,
+    without building a list of them.
+    """
+
+    if board.in_second_stage():
+        return board.ready[-board.get_active_player()].bit_count()
+    # In the first stage both players may play on any empty square.
+    return board.count_legal_moves()
@@ -15,3 +15,14 @@ class Player:
     def choose_move(self, board) -> Optional[Location]:
         assert True, "choose_move base method should never be called."
         return None
+
+    def ponder(self, board) -> None:
+        """Called with the board after this player's move, while the opponent
+        is choosing theirs. Players that can use that time to search
+        override this; the work should continue in the background until the
+        next choose_move or stop_pondering call."""
+        pass
+
+    def stop_pondering(self) -> None:
+        """Stops any search started by ponder, e.g. at the end of a game."""
+        pass
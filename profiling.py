@@ -0,0 +1,180 @@
+"""Opt-in profiling of the engines' hot paths.
+
+Profiler.enable wraps the functions and methods listed in HOT_PATHS with
+counters and timers, and disable puts the originals back; nothing is
+wrapped unless profiling is enabled, so it costs nothing otherwise. Each
+wrapped call records its total time and its self time (total time minus the
+time spent in wrapped calls it made), and the self time is also added to the
+stack of wrapped calls that led to it. The stacks are written in the
+collapsed format read by flamegraph.pl and speedscope:
+    MctsPlayer.choose_move;MctsNode.select;GameBoard.make_move_square 1234
+with times in microseconds.
+
+Module-level functions (such as heuristic) are also replaced wherever they
+were imported by name into another loaded module, so players built after
+enable see the wrapped versions. Statistics are kept per thread for the call
+stack but shared for the totals, so with several threads the counts are only
+approximate.
+
+Used by game.py --profile.
+"""
+
+from __future__ import annotations
+import functools
+import importlib
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, DefaultDict, Dict, List, Tuple
+
+# Entry points to wrap: (module, attribute path within it). Calls are
+# labelled with the attribute path.
+HOT_PATHS: Tuple[Tuple[str, str], ...] = (
+    ("game_board", "GameBoard.get_legal_moves"),
+    ("game_board", "GameBoard.get_legal_squares"),
+    ("game_board", "GameBoard.is_legal_move"),
+    ("game_board", "GameBoard.make_move"),
+    ("game_board", "GameBoard.make_move_square"),
+    ("game_board", "GameBoard.copy"),
+    ("game_board", "GameBoard.value"),
+    ("game_board", "GameBoard.random_playout"),
+    ("minimax_player", "heuristic"),
+    ("minimax_player", "MinimaxPlayer.choose_move"),
+    ("minimax_player_ab", "MinimaxPlayer.choose_move"),
+    ("features", "FeatureEvaluator.__call__"),
+    ("batch_rollout", "batch_random_playouts"),
+    ("mcts_player", "MctsPlayer.choose_move"),
+    ("mcts_player", "MctsNode.choose_move_via_mcts"),
+    ("mcts_player", "MctsNode.select"),
+    ("mcts_player", "MctsNode.select_with_priors"),
+    ("mcts_player", "MctsNode.random_play"),
+    ("mcts_player", "MctsNode.evaluate"),
+    ("mcts_player", "MctsNode.update_play_counts"),
+    ("mcts_player", "MctsNode.update_play_counts_many"),
+    ("mcts_player", "MctsNode.update_amaf_counts"),
+    ("mcts_dag", "MctsDag.select"),
+    ("mcts_dag", "MctsDag.backpropagate"),
+)
+
+# Label under which the alpha-beta player's choose_move is reported, to tell
+# it apart from plain minimax.
+LABELS = {("minimax_player_ab", "MinimaxPlayer.choose_move"):
+          "AlphaBetaPlayer.choose_move"}
+
+
+class Profiler:
+    """Counters and timers for the HOT_PATHS, per game and for the whole
+    run."""
+
+    def __init__(self) -> None:
+        self.calls: DefaultDict[str, int] = defaultdict(int)
+        self.total_time: DefaultDict[str, float] = defaultdict(float)
+        self.self_time: DefaultDict[str, float] = defaultdict(float)
+        self.stacks: DefaultDict[Tuple[str, ...], float] = defaultdict(float)
+        # Self time per stack over all games so far.
+        self.run_stacks: DefaultDict[Tuple[str, ...], float] = \
+            defaultdict(float)
+        self._local = threading.local()
+        self._patched: List[Tuple[object, str, Callable]] = []
+
+    def enable(self) -> None:
+        """Wraps every entry of HOT_PATHS."""
+        for module_name, path in HOT_PATHS:
+            module = importlib.import_module(module_name)
+            *owner_names, name = path.split(".")
+            owner = module
+            for owner_name in owner_names:
+                owner = getattr(owner, owner_name)
+            original = owner.__dict__[name]
+            wrapper = self._wrap(LABELS.get((module_name, path), path),
+                                 original)
+            self._patch(owner, name, wrapper)
+            if owner is module:
+                # Also replace copies made by "from module import name".
+                for other in list(sys.modules.values()):
+                    if (other is not module
+                            and getattr(other, name, None) is original):
+                        self._patch(other, name, wrapper)
+
+    def disable(self) -> None:
+        """Restores the original functions."""
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+
+    def _patch(self, owner: object, name: str, wrapper: Callable) -> None:
+        self._patched.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, wrapper)
+
+    def _wrap(self, label: str, function: Callable) -> Callable:
+        calls = self.calls
+        total_time = self.total_time
+        self_time = self.self_time
+        stacks = self.stacks
+        local = self._local
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            frames = getattr(local, "frames", None)
+            if frames is None:
+                frames = local.frames = []
+            # A frame holds the stack of labels leading to this call and the
+            # time spent in wrapped calls made from it.
+            stack = frames[-1][0] + (label,) if frames else (label,)
+            frame = [stack, 0.0]
+            frames.append(frame)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                frames.pop()
+                if frames:
+                    frames[-1][1] += elapsed
+                own = elapsed - frame[1]
+                calls[label] += 1
+                total_time[label] += elapsed
+                self_time[label] += own
+                stacks[stack] += own
+
+        return wrapper
+
+    def end_game(self) -> Dict[str, Tuple[int, float, float]]:
+        """Returns the statistics of the game just played, as {label:
+        (calls, total time, self time)}, and starts counting afresh for the
+        next one."""
+        summary = {label: (self.calls[label], self.total_time[label],
+                           self.self_time[label])
+                   for label in self.calls}
+        for stack, seconds in self.stacks.items():
+            self.run_stacks[stack] += seconds
+        self.calls.clear()
+        self.total_time.clear()
+        self.self_time.clear()
+        self.stacks.clear()
+        return summary
+
+    def write_collapsed(self, path: str) -> None:
+        """Writes the stacks of all finished games in collapsed format, with
+        self times in microseconds."""
+        with open(path, "w") as f:
+            for stack, seconds in sorted(self.run_stacks.items()):
+                microseconds = round(seconds * 1e6)
+                if microseconds > 0:
+                    f.write(";".join(stack) + f" {microseconds}\n")
+
+
+def print_summary(summary: Dict[str, Tuple[int, float, float]],
+                  game_time: float, title: str) -> None:
+    """Prints one game's statistics, most self time first. Percentages are
+    of the game's wall time."""
+    print(f"\n{title}: {game_time:.3f}s")
+    print(f"{'function':<36}{'calls':>10}{'total s':>10}{'self s':>10}"
+          f"{'us/call':>10}{'self %':>8}")
+    for label, (calls, total, own) in sorted(summary.items(),
+                                             key=lambda item: -item[1][2]):
+        print(f"{label:<36}{calls:>10}{total:>10.3f}{own:>10.3f}"
+              f"{1e6 * total / calls:>10.1f}"
+              f"{100 * own / max(game_time, 1e-9):>8.1f}")
@@ -0,0 +1,208 @@
+"""Generates training positions by self-play.
+
+Games between two copies of the same engine are played in a process pool.
+Positions are sampled from each game together with the visit distribution
+of the search that was run on them (for minimax, all of the weight goes to
+the chosen move) and the final result of the game. They are written to a
+columnar position file: the file is a sequence of chunks, and each chunk is
+one np.save'd array per column, so new chunks can be appended at any time and
+read back one chunk at a time.
+
+Example:
+    python self_play.py mcts --playouts 200 --num_games 1000 --workers 8 \\
+        --output positions.npy
+"""
+
+from __future__ import annotations
+import argparse
+import random
+from concurrent.futures import as_completed
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from game_board import GameBoard, Location
+from minimax_player import MinimaxPlayer, heuristic
+from mcts_player import MctsNode
+from worker_pool import make_pool
+
+# Plies played at random at the start of every game, so that games between
+# deterministic engines differ from one seed to the next.
+OPENING_PLIES = 4
+
+# Order in which the columns of a chunk are stored.
+COLUMNS = ("grid", "to_move", "policy", "result")
+
+
+class PositionWriter:
+    """Buffers sampled positions and appends them to a position file in
+    columnar chunks of chunk_size rows."""
+
+    def __init__(self, path: str, chunk_size: int = 4096) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self._rows: Dict[str, List[np.ndarray]] = {c: [] for c in COLUMNS}
+        self._file = open(path, "ab")
+
+    def write(self, position: Dict[str, np.ndarray]) -> None:
+        for column in COLUMNS:
+            self._rows[column].append(position[column])
+        if len(self._rows["result"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows["result"]:
+            return
+        for column in COLUMNS:
+            np.save(self._file, np.stack(self._rows[column]),
+                    allow_pickle=False)
+            self._rows[column] = []
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> PositionWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_position_chunks(path: str) -> Iterator[Dict[str, np.ndarray]]:
+    """Yields the chunks of a position file one at a time, as a dictionary
+    from column name to array."""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                chunk = {column: np.load(f, allow_pickle=False)
+                         for column in COLUMNS}
+            except EOFError:
+                return
+            yield chunk
+
+
+def play_self_play_game(engine: str, board_size: int, strength: int,
+                        ucb_const: float, sample_rate: float,
+                        seed: Optional[int],
+                        opening_plies: int = OPENING_PLIES
+                        ) -> List[Dict[str, np.ndarray]]:
+    """Plays one self-play game and returns the sampled positions. strength
+    is the number of playouts for mcts and the number of plies for minimax.
+    The first opening_plies moves are random and their positions are not
+    sampled. Runs in a worker process, so it only takes picklable
+    arguments."""
+    rng = random.Random(seed)
+    random.seed(rng.getrandbits(64))
+    minimax_player = MinimaxPlayer(heuristic, strength)
+
+    board = GameBoard(board_size)
+    for _ in range(opening_plies):
+        move = board.get_random_legal_move(rng)
+        if move is None:
+            break
+        board = board.make_move(move)
+    samples = []
+    while True:
+        policy = np.zeros(board_size * board_size, dtype=np.float32)
+        if engine == 'mcts':
+            root = MctsNode(board, None, ucb_const)
+            move = root.choose_move_via_mcts(strength)
+            visits = root.visit_counts()
+            total = sum(visits.values())
+            for square, count in visits.items():
+                policy[square_index(board.location_of(square),
+                                    board_size)] = count / total
+        else:
+            move = minimax_player.choose_move(board)
+            if move is not None:
+                policy[square_index(move, board_size)] = 1.0
+        if move is None:
+            break
+        if rng.random() < sample_rate:
+            samples.append({
+                "grid": board.grid.astype(np.int8),
+                "to_move": np.int8(board.get_active_player()),
+                "policy": policy,
+            })
+        board = board.make_move(move)
+
+    # The player to move has no legal moves, so the other player won.
+    winner = -board.get_active_player()
+    for sample in samples:
+        sample["result"] = np.int8(winner)
+    return samples
+
+
+def square_index(location: Location, board_size: int) -> int:
+    """Row-major index of a square within the interior of the board."""
+    return (location.row - 1) * board_size + (location.column - 1)
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+
+    p.add_argument("engine", choices=['minimax', 'mcts'])
+
+    p.add_argument("--plies", type=int, default=1, help=(
+        "Only relevant for minimax; number of plies ahead. Default=1."))
+
+    p.add_argument("--playouts", type=int, default=100, help=(
+        "Only relevant for mcts; number of playouts per move."
+        " Default=100."))
+
+    p.add_argument("--ucb", type=float, default=.5, help=(
+        "Only relevant for mcts; UCB exploration constant. Default=.5"))
+
+    p.add_argument("--num_games", type=int, default=100, help=(
+        "Number of self-play games. Default=100."))
+
+    p.add_argument("--workers", type=int, default=None, help=(
+        "Number of worker processes. Defaults to the number of CPUs."))
+
+    p.add_argument("--sample_rate", type=float, default=.25, help=(
+        "Probability that any given position is kept. Default=.25"))
+
+    p.add_argument("--board_size", type=int, default=7, help=(
+        "Size of the game board. 7 by default."))
+
+    p.add_argument("--seed", type=int, default=None, help=(
+        "Seed from which the seed of every game is derived."))
+
+    p.add_argument("--opening_plies", type=int, default=OPENING_PLIES,
+                   help=("Random moves at the start of every game, which"
+                         f" are not sampled. Default={OPENING_PLIES}."))
+
+    p.add_argument("--output", type=str, required=True, help=(
+        "Position file to append to."))
+
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    strength = args.playouts if args.engine == 'mcts' else args.plies
+    seeds = random.Random(args.seed)
+
+    with make_pool(args.workers, [args.board_size]) as pool, \
+            PositionWriter(args.output) as writer:
+        futures = [
+            pool.submit(play_self_play_game, args.engine, args.board_size,
+                        strength, args.ucb, args.sample_rate,
+                        seeds.getrandbits(64), args.opening_plies)
+            for _ in range(args.num_games)]
+        num_positions = 0
+        for future in as_completed(futures):
+            for position in future.result():
+                writer.write(position)
+                num_positions += 1
+
+    print(f"Wrote {num_positions} positions from {args.num_games} games"
+          f" to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Engine A/B match that stops as soon as the result is clear.
+
+Games between a test engine and a base engine are played in a process pool,
+in pairs with the colours swapped. After every game a sequential probability
+ratio test (SPRT) compares H0, "the test engine is elo0 Elo stronger than
+the base", with H1, "it is elo1 Elo stronger". The match stops as soon as
+the log likelihood ratio leaves [log(beta / (1 - alpha)),
+log((1 - beta) / alpha)], so that H0 is wrongly rejected with probability
+at most alpha and H1 with probability at most beta. The LLR treats the
+results as a binomial stream in which a draw counts as half a win and half
+a loss; that is exact here, since this game has no draws, and errs on the
+side of playing more games if some variant ever has them.
+
+To check that a patch does not lose strength, test it with, e.g.,
+elo0 = -5 and elo1 = 0 (a "non-regression" test); to check that it gains,
+use elo0 = 0 and elo1 = 5.
+
+Engines are given as for tournament.py. Example:
+    python sprt.py new=mcts:playouts=500,rollout_batch=8 \\
+        old=mcts:playouts=500 --elo0 -10 --elo1 0 --workers 8
+"""
+
+from __future__ import annotations
+import argparse
+import math
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Optional, Tuple
+from tournament import EngineSpec, parse_engine_spec, play_game
+from worker_pool import make_pool
+
+
+def expected_score(elo: float) -> float:
+    """Expected score of a player elo Elo stronger than their opponent."""
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def score_statistics(wins: int, draws: int, losses: int
+                     ) -> Tuple[int, float, float]:
+    """Number of games, mean score and variance of the score of one game.
+    While all the results are alike, a virtual draw is added, so that the
+    score stays away from 0 and 1, where the Elo scale is infinite."""
+    if (wins > 0) + (draws > 0) + (losses > 0) <= 1:
+        draws += 1
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (.5 - score) ** 2
+                + losses * score ** 2) / games
+    return games, score, variance
+
+
+def llr(wins: int, draws: int, losses: int, elo0: float,
+        elo1: float) -> float:
+    """Log likelihood ratio of H1 (Elo difference elo1) against H0 (elo0)
+    after the given results of the test engine, for the binomial model in
+    which each game is won with the expected score of the hypothesis and a
+    draw counts as half a win and half a loss."""
+    score0 = expected_score(elo0)
+    score1 = expected_score(elo1)
+    return ((wins + draws / 2) * math.log(score1 / score0)
+            + (losses + draws / 2) * math.log((1 - score1) / (1 - score0)))
+
+
+def sprt_bounds(alpha: float, beta: float) -> Tuple[float, float]:
+    """LLR below the first bound accepts H0, above the second accepts H1."""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def elo_estimate(wins: int, draws: int, losses: int
+                 ) -> Tuple[float, float]:
+    """Elo difference implied by the score so far, and the half-width of
+    its 95% confidence interval."""
+    games, score, variance = score_statistics(wins, draws, losses)
+    elo = -400 * math.log10(1 / score - 1)
+    slope = 400 / math.log(10) / (score * (1 - score))
+    return elo, 1.96 * slope * math.sqrt(variance / games)
+
+
+def run_sprt(test: EngineSpec, base: EngineSpec, elo0: float, elo1: float,
+             alpha: float, beta: float, board_size: int,
+             workers: Optional[int], max_games: int, seed: int,
+             verbose: bool = True) -> Tuple[str, int, int, int]:
+    """Plays the match and returns ("H0" or "H1", or "inconclusive" if
+    max_games were played without a decision) and the wins, draws and
+    losses of the test engine."""
+    lower, upper = sprt_bounds(alpha, beta)
+    seeds = random.Random(seed)
+    wins = draws = losses = 0
+    submitted = 0
+    verdict = "inconclusive"
+    workers = workers or os.cpu_count() or 1
+    pool = make_pool(workers, [board_size])
+    # Keep every worker busy, with a few games queued.
+    in_flight = 2 * workers
+    pending = set()
+    try:
+        while True:
+            while submitted < max_games and len(pending) < in_flight:
+                # Both games of a pair use the same seed, and so the same
+                # random opening (see tournament.play_game), one with each
+                # engine moving first.
+                if submitted % 2 == 0:
+                    pair_seed = seeds.getrandbits(64)
+                    first, second = test, base
+                else:
+                    first, second = base, test
+                pending.add(pool.submit(play_game, first, second,
+                                        board_size, pair_seed))
+                submitted += 1
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result.first_won == (result.first == test.name):
+                    wins += 1
+                else:
+                    losses += 1
+            ratio = llr(wins, draws, losses, elo0, elo1)
+            if verbose:
+                print(f"\r{wins + draws + losses} games: +{wins} ={draws}"
+                      f" -{losses}  LLR {ratio:.2f} [{lower:.2f},"
+                      f" {upper:.2f}]", end="", flush=True)
+            if ratio <= lower:
+                verdict = "H0"
+                break
+            if ratio >= upper:
+                verdict = "H1"
+                break
+    finally:
+        pool.shutdown(cancel_futures=True)
+    if verbose:
+        print()
+    return verdict, wins, draws, losses
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("test", help=(
+        "Engine under test, as name=kind[:option=value,...]; see"
+        " tournament.py."))
+    p.add_argument("base", help="Engine to compare against.")
+    p.add_argument("--elo0", type=float, default=-5.0, help=(
+        "Elo difference under H0. Default=-5."))
+    p.add_argument("--elo1", type=float, default=0.0, help=(
+        "Elo difference under H1. Default=0."))
+    p.add_argument("--alpha", type=float, default=.05, help=(
+        "Probability of accepting H1 when H0 holds. Default=.05."))
+    p.add_argument("--beta", type=float, default=.05, help=(
+        "Probability of accepting H0 when H1 holds. Default=.05."))
+    p.add_argument("--max_games", type=int, default=20000, help=(
+        "Stop without a decision after this many games. Default=20000."))
+    p.add_argument("--board_size", type=int, default=7, help=(
+        "Size of the game board. 7 by default."))
+    p.add_argument("--workers", type=int, default=None, help=(
+        "Number of worker processes. Defaults to the number of CPUs."))
+    p.add_argument("--seed", type=int, default=0, help=(
+        "Seed from which the games' seeds are drawn. Default=0."))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    test = parse_engine_spec(args.test)
+    base = parse_engine_spec(args.base)
+    if test.name == base.name:
+        raise ValueError("The two engines need different names")
+    if args.elo0 >= args.elo1:
+        raise ValueError("elo0 must be below elo1")
+
+    verdict, wins, draws, losses = run_sprt(
+        test, base, args.elo0, args.elo1, args.alpha, args.beta,
+        args.board_size, args.workers, args.max_games, args.seed)
+    elo, error = elo_estimate(wins, draws, losses)
+    if verdict == "H0":
+        print(f"H0 accepted: {test.name} - {base.name} is {args.elo0:g}"
+              f" Elo rather than {args.elo1:g}")
+    elif verdict == "H1":
+        print(f"H1 accepted: {test.name} - {base.name} is {args.elo1:g}"
+              f" Elo rather than {args.elo0:g}")
+    else:
+        print(f"No decision after {wins + draws + losses} games")
+    print(f"Elo difference {elo:.1f} +/- {error:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Tests of batch_analysis.py.
+
+Example:
+    python -m pytest test_batch_analysis.py
+"""
+
+from concurrent.futures import Future
+import pytest
+from batch_analysis import (
+    AnalysisCache, Stats, analyse_positions, engine_config, position_hash)
+from game_board import GameBoard
+
+OPTIONS = {"engine": "alphabeta", "multipv": 2, "depth": 1}
+
+
+class FailingPool:
+    """Runs submissions at once, failing on one position."""
+
+    def __init__(self, failing: str) -> None:
+        self.failing = failing
+
+    def submit(self, function, board, *args):
+        future = Future()
+        if position_hash(board) == self.failing:
+            future.set_exception(ValueError("worker failed"))
+        else:
+            future.set_result(function(board, *args))
+        return future
+
+
+def test_results_are_cached_before_a_failure_is_raised(tmp_path):
+    boards = [GameBoard(4)]
+    for square in boards[0].get_legal_squares()[:5]:
+        boards.append(boards[0].make_move_square(square))
+    failing = position_hash(boards[2])
+    with AnalysisCache(str(tmp_path / "cache.sqlite")) as cache:
+        with pytest.raises(RuntimeError, match=failing) as raised:
+            list(analyse_positions(boards, OPTIONS, cache,
+                                   FailingPool(failing), stats=Stats()))
+        assert isinstance(raised.value.__cause__, ValueError)
+        cached = cache.get_many(map(position_hash, boards),
+                                engine_config(OPTIONS))
+    assert set(cached) == {position_hash(board) for board in boards
+                           if position_hash(board) != failing}
+
+
+def test_minimax_and_alphabeta_share_cache_entries():
+    assert engine_config({**OPTIONS, "engine": "minimax"}) == \
+        engine_config(OPTIONS)
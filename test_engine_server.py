@@ -0,0 +1,59 @@
+"""Tests of engine_server.py.
+
+Example:
+    python -m pytest test_engine_server.py
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from engine_server import EngineServer, search
+from game_board import GameBoard, Location
+
+
+@pytest.mark.parametrize("engine", ["minimax", "alphabeta"])
+def test_search_keeps_to_the_time_limit(engine):
+    board = GameBoard(7)
+    start = time.perf_counter()
+    row, column = search(board, engine, 4, 0, .5, .3, 0)
+    assert time.perf_counter() - start < 1.0
+    assert board.is_legal_move(Location(row, column))
+
+
+def request(server, **fields):
+    return asyncio.run(server.handle_line(json.dumps(fields).encode()))
+
+
+@pytest.mark.parametrize("fields", [
+    {"time": float("nan")}, {"time": float("inf")}, {"time": -1},
+    {"playouts": 10 ** 9}, {"playouts": -1}])
+def test_engine_move_rejects_bad_limits(fields):
+    server = EngineServer(1, [], 1.0, 4)
+    try:
+        game = request(server, cmd="new_game", board_size=5)["game"]
+        reply = request(server, cmd="engine_move", game=game, engine="mcts",
+                        **fields)
+        assert not reply["ok"]
+    finally:
+        server.pool.shutdown()
+
+
+def test_pool_is_replaced_when_a_worker_dies():
+    server = EngineServer(1, [], 1.0, 4)
+    try:
+        game = request(server, cmd="new_game", board_size=5)["game"]
+        broken = server.pool
+        with pytest.raises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        reply = request(server, cmd="engine_move", game=game,
+                        engine="mcts", playouts=16)
+        assert not reply["ok"]
+        assert server.pool is not broken
+        reply = request(server, cmd="engine_move", game=game,
+                        engine="mcts", playouts=16)
+        assert reply["ok"] and reply["move"] is not None
+    finally:
+        server.pool.shutdown()
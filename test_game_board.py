@@ -0,0 +1,43 @@
+"""Tests of GameBoard.
+
+Example:
+    python -m pytest test_game_board.py
+"""
+
+import pickle
+import pytest
+from board_geometry import Location
+from game_board import GameBoard
+
+
+@pytest.mark.parametrize("row, column", [
+    (0, 1), (1, 0), (6, 1), (1, 6), (-1, 3), (3, -1), (0, 0), (6, 6)])
+def test_out_of_range_locations(row, column):
+    board = GameBoard(5)
+    location = Location(row, column)
+    assert board.square_of(location) is None
+    assert not board.is_legal_move(location)
+    assert board.make_move(location) is None
+    assert board.num_adjacent_friendlies(location, 1) == 0
+
+
+def test_corner_locations_are_legal():
+    board = GameBoard(5)
+    for location in (Location(1, 1), Location(1, 5), Location(5, 1),
+                     Location(5, 5)):
+        assert board.is_legal_move(location)
+        assert board.make_move(location) is not None
+
+
+def test_pickle_round_trip_leaves_out_geometry():
+    board = GameBoard(7)
+    for location in (Location(4, 4), Location(1, 1), Location(4, 5)):
+        board = board.make_move(location)
+    data = pickle.dumps(board)
+    copy = pickle.loads(data)
+    assert copy.geometry is board.geometry
+    assert copy.position_key() == board.position_key()
+    assert copy.frontier == board.frontier
+    assert copy.ready == board.ready
+    assert copy.get_legal_moves() == board.get_legal_moves()
+    assert len(data) < len(pickle.dumps(board.geometry))
@@ -0,0 +1,105 @@
+"""Tests of MctsNode and MctsPlayer.
+
+Example:
+    python -m pytest test_mcts_player.py
+"""
+
+import random
+import threading
+from game_board import GameBoard
+from mcts_player import MctsConfig, MctsNode, MctsPlayer, NodePool
+from tournament import make_player, parse_engine_spec
+
+
+def test_budget_smaller_than_root_fan_out(monkeypatch):
+    prunes = []
+    prune = NodePool.prune
+
+    def counting_prune(self, root, in_flight=()):
+        prunes.append(self.live)
+        prune(self, root, in_flight)
+
+    monkeypatch.setattr(NodePool, "prune", counting_prune)
+    board = GameBoard(7)
+    root = MctsNode(board, None, .5, MctsConfig(max_nodes=20))
+    budget, target = root.pool.limits(root)
+    assert target >= 1 + len(board.get_legal_squares())
+    assert budget > target
+
+    root.choose_move_via_mcts(500, random.Random(0))
+    assert root.pool.live <= budget
+    # Every prune frees room for budget - target expansions.
+    assert len(prunes) <= 500 // (budget - target) + 1
+
+
+def test_ponder_continues_from_the_chosen_move():
+    random.seed(0)
+    player = MctsPlayer(200, .5, pondering=True)
+    board = GameBoard(5)
+    move = player.choose_move(board)
+    searched = player._searched.children[board.square_of(move)]
+    visits = searched.total_games_for_this_player
+    assert visits > 0
+
+    player.ponder(board.make_move(move))
+    player.stop_pondering()
+    assert player._pondered is searched
+    assert searched.parent is None
+    assert searched.total_games_for_this_player >= visits
+
+
+def test_time_only_search_on_a_terminal_position():
+    board = GameBoard(5).random_playout(random.Random(0))
+    assert not board.has_legal_move()
+    player = MctsPlayer(0, .5, time_limit=.05)
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(player.choose_move(board)),
+        daemon=True)
+    thread.start()
+    thread.join(5)
+    assert result == [None]
+
+
+def test_time_only_tournament_engine_has_no_playout_cap():
+    player = make_player(parse_engine_spec("m=mcts:time=0.1"))
+    assert player.playouts == 0
+    assert player.time_limit == .1
+    assert make_player(parse_engine_spec("m=mcts")).playouts == 1000
+
+
+def test_time_only_player_ponders():
+    random.seed(0)
+    player = MctsPlayer(0, .5, pondering=True, time_limit=.05)
+    board = GameBoard(5)
+    move = player.choose_move(board)
+    searched = player._searched.children[board.square_of(move)]
+    visits = searched.total_games_for_this_player
+
+    player.ponder(board.make_move(move))
+    player._ponder_thread.join(10)
+    player.stop_pondering()
+    assert player._pondered is searched
+    assert searched.total_games_for_this_player > visits
+
+
+
+def test_prune_releases_the_deepest_of_equally_visited_nodes():
+    board = GameBoard(5)
+    root = MctsNode(board, None, .5, MctsConfig(max_nodes=1000))
+    for move in root.legal_moves:
+        root.expand(root, move)
+    # A grandchild and a great-grandchild of root, with one playout each.
+    child = root.children[root.legal_moves[0]]
+    grandchild = root.expand(child, child.legal_moves[0])
+    great_grandchild = root.expand(grandchild, grandchild.legal_moves[0])
+    grandchild.total_games_for_this_player = 1
+    great_grandchild.total_games_for_this_player = 1
+
+    # Room for all but one node.
+    root.pool.max_nodes = root.pool.live - 1
+    root.pool.prune_to = 1.0
+    root.pool.prune(root)
+    assert grandchild.state is not None
+    assert great_grandchild.state is None
+    assert not grandchild.children
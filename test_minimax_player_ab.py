@@ -0,0 +1,68 @@
+"""Tests of the alpha-beta player.
+
+Example:
+    python -m pytest test_minimax_player_ab.py
+"""
+
+import random
+import time
+import pytest
+import minimax_player
+import minimax_player_ab
+from game_board import GameBoard
+
+
+def random_position(rng, size):
+    board = GameBoard(size)
+    for _ in range(rng.randrange(size * size)):
+        square = board.get_random_legal_square(rng)
+        if square is None:
+            break
+        board = board.make_move_square(square)
+    return board
+
+
+def minimax_value(board, depth):
+    player = minimax_player.MinimaxPlayer(minimax_player.heuristic, depth)
+    if board.get_active_player() == 1:
+        return player.max_value(depth, board)[0]
+    return player.min_value(depth, board)[0]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_transposition_table_matches_minimax(seed):
+    rng = random.Random(seed)
+    # One player for all positions and depths, so that entries stored by
+    # earlier searches, bounds included, are probed by later ones.
+    searcher = minimax_player_ab.MinimaxPlayer(
+        minimax_player_ab.heuristic, 1, transpositions=True)
+    for _ in range(6):
+        board = random_position(rng, rng.choice((4, 5)))
+        # Plain minimax is slow, so only the small board is searched deep.
+        for depth in ((1, 2, 3) if board.size == 4 else (1, 2)):
+            value, _ = searcher.search(board, depth)
+            assert value == minimax_value(board, depth)
+
+
+def test_pondered_move_is_in_the_subtree_of_the_move_chosen():
+    player = minimax_player_ab.MinimaxPlayer(
+        minimax_player_ab.heuristic, 2, pondering=True)
+    board = GameBoard(5)
+    move = player.choose_move(board)
+    after = board.make_move(move)
+    player.ponder(after)
+    deadline = time.perf_counter() + 10
+    while player._pondered is None and time.perf_counter() < deadline:
+        time.sleep(.01)
+    player.stop_pondering()
+    assert player._pondered is not None
+
+    key, depth, reply = player._pondered
+    predicted = [after.make_move_square(square)
+                 for square in after.get_legal_squares()]
+    predicted = [child for child in predicted if child.position_key() == key]
+    assert len(predicted) == 1
+    assert depth >= player.plies
+    assert predicted[0].is_legal_square(reply)
+    assert player.choose_move(predicted[0]) == \
+        predicted[0].location_of(reply)
@@ -0,0 +1,45 @@
+"""Tests of tournament.py.
+
+Example:
+    python -m pytest test_tournament.py
+"""
+
+import pytest
+from tournament import OPENING_PLIES, parse_engine_spec, play_game
+
+FIRST = parse_engine_spec("a=alphabeta:plies=1")
+SECOND = parse_engine_spec("b=minimax:plies=1")
+
+
+def test_deterministic_engines_play_different_games():
+    games = {tuple(play_game(FIRST, SECOND, 5, seed).record.moves)
+             for seed in range(4)}
+    assert len(games) == 4
+
+
+def test_pair_shares_its_opening():
+    one = play_game(FIRST, SECOND, 5, 7).record
+    other = play_game(SECOND, FIRST, 5, 7).record
+    assert one.moves[:OPENING_PLIES] == other.moves[:OPENING_PLIES]
+    assert one.times[:OPENING_PLIES] == [0.0] * OPENING_PLIES
+    assert one.players[1]["name"] == other.players[-1]["name"] == "a"
+
+
+@pytest.mark.parametrize("text, field", [
+    ("m=mcts:prior=heurstic", "prior"),
+    ("m=mcts:leaf_eval=rollouts", "leaf_eval"),
+    ("m=mcts:transpositions=yes", "transpositions"),
+    ("m=mcts:max_nodes=many", "max_nodes"),
+    ("m=mcts:rave=lots", "rave"),
+    ("m=mcts:widening=1", "widening"),
+    ("m=mcts:playouts=1.5", "playouts")])
+def test_bad_mcts_options_are_named(text, field):
+    with pytest.raises(ValueError, match=f"Option {field} of engine m"):
+        parse_engine_spec(text)
+
+
+def test_good_mcts_options():
+    spec = parse_engine_spec(
+        "m=mcts:prior=heuristic,widening=true,leaf_eval=heuristic,"
+        "max_nodes=500,leaf_mix=1,time=0.5,ucb=1")
+    assert spec.options["prior"] == "heuristic"
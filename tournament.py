@@ -0,0 +1,411 @@
+"""Plays tournaments between engine configurations and rates them.
+
+Every pairing plays the same number of games, alternating which engine
+moves first, in a process pool. Each game starts from a few random moves
+drawn from its seed, and both games of a pair share the seed, so each
+opening is played once with each engine moving first; without them,
+deterministic engines would play the same game over and over. Engines are
+rated on the Elo scale by fitting a Bradley-Terry model to all the results,
+and each rating comes with a 95% confidence interval. Ratings are relative
+to the average of the field. The CPU time per move is reported too, so that strength can be
+weighed against compute, and so is the number of boards made per move (see
+GameBoard.get_num_boards_made). The latter only compares engines of the same
+kind: MCTS plays its rollouts in place or in batches, without making boards,
+so it does far more work per board made than minimax does.
+
+Engines are given as name=kind[:option=value,...], where kind is minimax,
+alphabeta or mcts:
+    mm2=minimax:plies=2
+    ab4=alphabeta:plies=4,transpositions=true
+    m500=mcts:playouts=500,ucb=0.5
+    mfast=mcts:time=0.2,rollout_batch=8,rave=300
+minimax and alphabeta take plies and weights (see game.py --weights1), and
+alphabeta also takes transpositions. mcts takes playouts (1000 by default,
+or no limit given a time), ucb, time (seconds per move), rollout_batch and
+threads, and these tree-policy options, as in game.py: widening, puct,
+prior, rave, transpositions, max_nodes, leaf_eval, leaf_depth, leaf_mix and
+rollout_cutoff.
+
+Example:
+    python tournament.py mm2=minimax:plies=2 m500=mcts:playouts=500 \\
+        m1k=mcts:playouts=1000 --games 20 --workers 8
+"""
+
+from __future__ import annotations
+import argparse
+import math
+import random
+import time
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from common_values import PLAYER_1, PLAYER_2
+from features import FeatureEvaluator
+from game import playGame
+from game_board import GameBoard, Location
+from game_record import GameRecord, GameRecordWriter
+from mcts_player import LEAF_EVALS, PRIORS, MctsConfig, MctsPlayer
+from player import Player
+import minimax_player
+import minimax_player_ab
+from worker_pool import make_pool
+
+KINDS = ("minimax", "alphabeta", "mcts")
+
+# MCTS options that are arguments of MctsPlayer rather than MctsConfig
+# fields, with a value of the type each takes.
+MCTS_PLAYER_OPTIONS = {"playouts": 0, "ucb": .5, "time": .0,
+                       "rollout_batch": 1, "threads": 1}
+
+# Random moves made at the start of every game.
+OPENING_PLIES = 4
+
+# Values of the mcts options that take a name. The others take a value of
+# the type of the MctsConfig field they set.
+MCTS_CHOICES = {"prior": tuple(PRIORS), "leaf_eval": LEAF_EVALS,
+                "transpositions": ("exact", "symmetric")}
+
+# Elo points per unit of the Bradley-Terry (natural log odds) scale.
+ELO_PER_LOG_ODDS = 400 / math.log(10)
+
+
+@dataclass
+class EngineSpec:
+    """A named engine configuration, as given on the command line."""
+    name: str
+    kind: str
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    def describe(self) -> Dict[str, Any]:
+        """The configuration as stored in game records."""
+        return {"name": self.name, "type": self.kind, **self.options}
+
+
+def parse_value(text: str) -> Any:
+    """An option value: an int, float or boolean if it looks like one, else
+    the string itself."""
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    return text
+
+
+def parse_engine_spec(text: str) -> EngineSpec:
+    """Parses name=kind[:option=value,...]."""
+    name, sep, rest = text.partition("=")
+    if not sep or not name:
+        raise ValueError(f"Engine {text!r} is not of the form name=kind")
+    kind, _, option_text = rest.partition(":")
+    if kind not in KINDS:
+        raise ValueError(f"Unknown engine kind {kind!r} in {text!r}")
+    options = {}
+    for item in option_text.split(","):
+        if not item:
+            continue
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Option {item!r} of {text!r} has no value")
+        options[key] = parse_value(value)
+    # Catch unknown options now rather than in a worker process.
+    make_player(EngineSpec(name, kind, options))
+    return EngineSpec(name, kind, options)
+
+
+def make_player(spec: EngineSpec) -> Player:
+    """Builds a fresh player for spec. Raises ValueError on options the kind
+    does not take."""
+    options = dict(spec.options)
+    if spec.kind in ("minimax", "alphabeta"):
+        plies = options.pop("plies", 1)
+        weights = options.pop("weights", None)
+        evaluator = (minimax_player.heuristic if weights is None
+                     else FeatureEvaluator(weights))
+        if spec.kind == "minimax":
+            player = minimax_player.MinimaxPlayer(evaluator, plies)
+        else:
+            player = minimax_player_ab.MinimaxPlayer(
+                evaluator, plies, options.pop("transpositions", False))
+    else:
+        player_options = {
+            key: check_mcts_option(spec, key, options.pop(key), example)
+            for key, example in MCTS_PLAYER_OPTIONS.items()
+            if key in options}
+        config = MctsConfig()
+        config_fields = {f.name for f in fields(MctsConfig)}
+        # Options that switch a feature on and set its parameter at once,
+        # as the game.py flags do.
+        if "puct" in options:
+            config.puct = True
+            config.puct_const = check_mcts_option(
+                spec, "puct", options.pop("puct"), config.puct_const)
+        if "rave" in options:
+            config.rave = True
+            config.rave_equivalence = check_mcts_option(
+                spec, "rave", options.pop("rave"), config.rave_equivalence)
+        if "transpositions" in options:
+            config.transpositions = True
+            config.symmetric = check_mcts_option(
+                spec, "transpositions",
+                options.pop("transpositions")) == "symmetric"
+        for key in list(options):
+            if key in config_fields:
+                setattr(config, key, check_mcts_option(
+                    spec, key, options.pop(key), getattr(config, key)))
+        # With a time limit, playouts only caps the search if it is given.
+        default_playouts = 0 if "time" in player_options else 1000
+        player = MctsPlayer(player_options.get("playouts", default_playouts),
+                            player_options.get("ucb", .5),
+                            player_options.get("rollout_batch", 1),
+                            config, player_options.get("threads", 1),
+                            time_limit=player_options.get("time"))
+    if options:
+        raise ValueError(f"Unknown options for {spec.kind} engine"
+                         f" {spec.name}: {', '.join(options)}")
+    return player
+
+
+def check_mcts_option(spec: EngineSpec, key: str, value: Any,
+                      default: Any = None) -> Any:
+    """Returns value if it is one of MCTS_CHOICES[key], or else of the type
+    of default (an int if default is None); raises ValueError otherwise."""
+    choices = MCTS_CHOICES.get(key)
+    if choices is not None:
+        valid = value in choices
+        expected = "one of " + ", ".join(choices)
+    elif isinstance(default, bool):
+        valid = isinstance(value, bool)
+        expected = "true or false"
+    elif isinstance(default, float):
+        valid = (isinstance(value, (int, float))
+                 and not isinstance(value, bool))
+        expected = "a number"
+    else:
+        valid = isinstance(value, int) and not isinstance(value, bool)
+        expected = "an integer"
+    if not valid:
+        raise ValueError(f"Option {key} of engine {spec.name} must be"
+                         f" {expected}, not {value!r}")
+    return value
+
+
+class MeteredPlayer(Player):
+    """Wraps a player and keeps count of its moves, the CPU time they took
+    and the boards made while choosing them."""
+
+    def __init__(self, player: Player) -> None:
+        self.player = player
+        self.moves = 0
+        self.cpu_time = 0.0
+        self.boards = 0
+
+    def choose_move(self, board) -> Optional[Location]:
+        start_cpu = time.process_time()
+        start_boards = GameBoard.get_num_boards_made()
+        move = self.player.choose_move(board)
+        self.cpu_time += time.process_time() - start_cpu
+        self.boards += GameBoard.get_num_boards_made() - start_boards
+        self.moves += 1
+        return move
+
+
+@dataclass
+class GameResult:
+    """Outcome of one game, from the point of view of the two engines."""
+    first: str
+    second: str
+    first_won: bool
+    # Moves, CPU seconds and boards made, for each engine name.
+    moves: Dict[str, int]
+    cpu_time: Dict[str, float]
+    boards: Dict[str, int]
+    record: GameRecord
+
+
+def random_opening(board_size: int, plies: int,
+                   rng: random.Random) -> List[Location]:
+    """plies random legal moves from the empty board (fewer if the game
+    ends first)."""
+    board = GameBoard(board_size)
+    moves = []
+    for _ in range(plies):
+        move = board.get_random_legal_move(rng)
+        if move is None:
+            break
+        moves.append(move)
+        board = board.make_move(move)
+    return moves
+
+
+def play_game(first: EngineSpec, second: EngineSpec, board_size: int,
+              seed: int, opening_plies: int = OPENING_PLIES) -> GameResult:
+    """Plays one game, first moving first, from a random opening of
+    opening_plies moves drawn from seed. Runs in a worker process."""
+    opening = random_opening(board_size, opening_plies, random.Random(seed))
+    random.seed(seed)
+    players = {PLAYER_1: MeteredPlayer(make_player(first)),
+               PLAYER_2: MeteredPlayer(make_player(second))}
+    record = GameRecord(board_size, {PLAYER_1: first.describe(),
+                                     PLAYER_2: second.describe()}, seed=seed)
+    winner = playGame(players, board_size, True, record, opening)
+    metered = {first.name: players[PLAYER_1], second.name: players[PLAYER_2]}
+    return GameResult(
+        first.name, second.name, winner == PLAYER_1,
+        {name: p.moves for name, p in metered.items()},
+        {name: p.cpu_time for name, p in metered.items()},
+        {name: p.boards for name, p in metered.items()},
+        record)
+
+
+def pairings(num_engines: int, mode: str) -> List[Tuple[int, int]]:
+    """Pairs of engine indices that play each other: all pairs for a
+    round-robin, or the first engine against each of the others for a
+    gauntlet."""
+    if mode == "gauntlet":
+        return [(0, j) for j in range(1, num_engines)]
+    return [(i, j) for i in range(num_engines)
+            for j in range(i + 1, num_engines)]
+
+
+def elo_ratings(num_engines: int, games: List[Tuple[int, int, float]],
+                iterations: int = 50) -> Tuple[np.ndarray, np.ndarray]:
+    """Fits Bradley-Terry strengths to games, given as (i, j, score of i
+    against j), by Newton's method. Each pair that played also gets one
+    virtual drawn game, so that a perfect score still has a finite rating.
+    Returns Elo ratings relative to the average of the field and the
+    half-widths of their 95% confidence intervals."""
+    wins = np.zeros((num_engines, num_engines))
+    for i, j, score in games:
+        wins[i, j] += score
+        wins[j, i] += 1 - score
+    counts = wins + wins.T
+    played = counts > 0
+    wins[played] += .5
+    counts[played] += 1
+
+    strengths = np.zeros(num_engines)
+    for _ in range(iterations):
+        expected = 1 / (1 + np.exp(strengths[np.newaxis, :]
+                                   - strengths[:, np.newaxis]))
+        gradient = (wins - counts * expected).sum(axis=1)
+        weights = counts * expected * (1 - expected)
+        # Hessian of the negative log likelihood. It is singular along
+        # (1, ..., 1), since only differences matter; the pseudo-inverse
+        # keeps the strengths centred.
+        hessian = np.diag(weights.sum(axis=1)) - weights
+        step = np.linalg.pinv(hessian) @ gradient
+        strengths += step
+        if np.abs(step).max() < 1e-9:
+            break
+
+    covariance = np.linalg.pinv(hessian)
+    errors = np.sqrt(np.maximum(np.diag(covariance), 0))
+    return (strengths - strengths.mean()) * ELO_PER_LOG_ODDS, \
+        1.96 * errors * ELO_PER_LOG_ODDS
+
+
+def run_tournament(engines: List[EngineSpec], mode: str, games: int,
+                   board_size: int, workers: Optional[int], seed: int,
+                   writer: Optional[GameRecordWriter] = None
+                   ) -> List[GameResult]:
+    """Plays games games per pairing, half of them with each engine moving
+    first, and returns the results (in the order they finished). Each pair
+    of games shares a seed, and so an opening."""
+    seeds = random.Random(seed)
+    results = []
+    with make_pool(workers, [board_size]) as pool:
+        futures = []
+        for i, j in pairings(len(engines), mode):
+            for game in range(games):
+                first, second = engines[i], engines[j]
+                if game % 2:
+                    first, second = second, first
+                else:
+                    pair_seed = seeds.getrandbits(64)
+                futures.append(pool.submit(play_game, first, second,
+                                           board_size, pair_seed))
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if writer is not None:
+                writer.write(result.record)
+            print(".", end="", flush=True)
+    print()
+    return results
+
+
+def report(engines: List[EngineSpec], results: List[GameResult]) -> None:
+    """Prints a table of ratings and per-move costs, strongest first. Boards
+    made per move are only comparable between engines of the same kind."""
+    index = {spec.name: i for i, spec in enumerate(engines)}
+    games = [(index[r.first], index[r.second], 1.0 if r.first_won else 0.0)
+             for r in results]
+    elo, error = elo_ratings(len(engines), games)
+
+    print(f"{'engine':<16}{'games':>7}{'score':>8}{'elo':>8}{'+/-':>6}"
+          f"{'cpu s/move':>12}{'boards/move':>12}")
+    for i in sorted(range(len(engines)), key=lambda i: -elo[i]):
+        name = engines[i].name
+        played = [r for r in results if name in (r.first, r.second)]
+        score = sum(r.first_won == (r.first == name) for r in played)
+        moves = sum(r.moves[name] for r in played)
+        cpu = sum(r.cpu_time[name] for r in played)
+        boards = sum(r.boards[name] for r in played)
+        print(f"{name:<16}{len(played):>7}"
+              f"{score / max(len(played), 1):>8.1%}{elo[i]:>8.0f}"
+              f"{error[i]:>6.0f}{cpu / max(moves, 1):>12.4f}"
+              f"{boards / max(moves, 1):>12.0f}")
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("engines", nargs="+", help=(
+        "Engines, as name=kind[:option=value,...]; see the module"
+        " documentation."))
+    p.add_argument("--mode", choices=["round_robin", "gauntlet"],
+                   default="round_robin", help=(
+        "Play every pair of engines, or the first engine against each of"
+        " the others. Default=round_robin."))
+    p.add_argument("--games", type=int, default=10, help=(
+        "Games per pairing, alternating colours. Default=10."))
+    p.add_argument("--board_size", type=int, default=7, help=(
+        "Size of the game board. 7 by default."))
+    p.add_argument("--workers", type=int, default=None, help=(
+        "Number of worker processes. Defaults to the number of CPUs."))
+    p.add_argument("--seed", type=int, default=0, help=(
+        "Seed from which the games' seeds are drawn. Default=0."))
+    p.add_argument("--record", type=str, default=None, help=(
+        "File to append a record of every game to, as for game.py."))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    engines = [parse_engine_spec(text) for text in args.engines]
+    names = [spec.name for spec in engines]
+    if len(set(names)) != len(names):
+        raise ValueError("Engine names must be unique")
+    if len(engines) < 2:
+        raise ValueError("A tournament needs at least two engines")
+
+    writer = None
+    if args.record is not None:
+        writer = GameRecordWriter(args.record)
+    try:
+        results = run_tournament(engines, args.mode, args.games,
+                                 args.board_size, args.workers, args.seed,
+                                 writer)
+    finally:
+        if writer is not None:
+            writer.close()
+    report(engines, results)
+
+
+if __name__ == '__main__':
+    main()
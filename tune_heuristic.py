@@ -0,0 +1,78 @@
+"""Fits the weights of the feature-based evaluator to self-play results.
+
+The evaluator's value for a board is tanh(w . features), read as the
+expected result for red (+1 win, -1 loss). That is the same as saying red
+wins with probability sigmoid(2 w . features), so the weights are fitted by
+L2-regularised logistic regression (Newton's method) on the positions in a
+file written by self_play.py.
+
+Example:
+    python tune_heuristic.py positions.npy --output weights.json
+"""
+
+from __future__ import annotations
+import argparse
+from typing import Tuple
+import numpy as np
+from features import FEATURE_NAMES, extract_features, save_weights
+from self_play import read_position_chunks
+
+
+def load_training_data(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Feature matrix and red-win indicators (1 or 0) for every position in
+    a position file. Only the features are kept in memory, not the grids."""
+    features = []
+    targets = []
+    for chunk in read_position_chunks(path):
+        features.append(extract_features(chunk["grid"]))
+        targets.append((chunk["result"] > 0).astype(np.float64))
+    if not features:
+        raise ValueError("No positions in " + path)
+    return np.concatenate(features), np.concatenate(targets)
+
+
+def fit_weights(features: np.ndarray, targets: np.ndarray,
+                l2: float = 1e-3, iterations: int = 25) -> np.ndarray:
+    """Logistic regression by Newton's method. Returns the weights w such
+    that tanh(w . features) predicts the result from red's point of view."""
+    x = 2 * features
+    w = np.zeros(x.shape[1])
+    regulariser = l2 * len(x) * np.eye(x.shape[1])
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-(x @ w)))
+        gradient = x.T @ (p - targets) + regulariser @ w
+        hessian = (x * (p * (1 - p))[:, None]).T @ x + regulariser
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return w
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse command line arguments.
+    """
+    p = argparse.ArgumentParser()
+    p.add_argument("positions", help="Position file written by self_play.py")
+    p.add_argument("--output", type=str, required=True, help=(
+        "File to write the fitted weights to."))
+    p.add_argument("--l2", type=float, default=1e-3, help=(
+        "L2 regularisation strength. Default=1e-3"))
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    features, targets = load_training_data(args.positions)
+    weights = fit_weights(features, targets, args.l2)
+    predictions = np.tanh(features @ weights) > 0
+    accuracy = np.mean(predictions == (targets > 0))
+
+    for name, weight in zip(FEATURE_NAMES, weights):
+        print(f"{name:>16}: {weight: .4f}")
+    print(f"Fitted on {len(targets)} positions, accuracy {accuracy:.3f}")
+    save_weights(args.output, weights)
+
+
+if __name__ == '__main__':
+    main()
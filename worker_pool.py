@@ -0,0 +1,67 @@
+"""Process pools whose workers start with the engines already loaded.
+
+Every worker of a plain process pool imports NumPy and the engine modules
+and builds the geometry tables of its board sizes again before it can play
+its first game. make_pool avoids most of that: where the platform supports
+it, workers are forked from a fork server that imported the modules in
+PRELOAD once, so a new worker starts with them in memory, and every worker
+then builds the tables of the given board sizes (and anything else its
+initializer sets up) once, for all the games it plays. Elsewhere workers are
+started the platform's default way and only the second part applies.
+
+Used by self_play.py, tournament.py, sprt.py and engine_server.py.
+
+Example:
+    with make_pool(8, board_sizes=[7, 9]) as pool:
+        results = list(pool.map(play_one_game, seeds))
+"""
+
+from __future__ import annotations
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Optional, Tuple
+
+# Modules the fork server imports before forking any worker.
+PRELOAD: Tuple[str, ...] = (
+    "numpy", "board_geometry", "game_board", "features", "batch_rollout",
+    "minimax_player", "minimax_player_ab", "mcts_dag", "mcts_player")
+
+
+def start_method() -> str:
+    """The start method make_pool uses on this platform."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return "forkserver"
+    return multiprocessing.get_start_method()
+
+
+def make_pool(workers: Optional[int] = None, board_sizes: Iterable[int] = (),
+              initializer: Optional[Callable] = None,
+              initargs: Tuple = (), preload: Tuple[str, ...] = PRELOAD
+              ) -> ProcessPoolExecutor:
+    """A ProcessPoolExecutor with workers processes (the number of CPUs by
+    default) that start with the modules in preload imported and the tables
+    of board_sizes built, and then run initializer(*initargs)."""
+    context = multiprocessing.get_context(start_method())
+    if context.get_start_method() == "forkserver":
+        # Only takes effect if the fork server is not running yet; once it
+        # is, it already has the modules of the first pool loaded.
+        context.set_forkserver_preload(list(preload))
+    return ProcessPoolExecutor(
+        workers, mp_context=context, initializer=warm_up,
+        initargs=(tuple(preload), tuple(board_sizes), initializer, initargs))
+
+
+def warm_up(preload: Tuple[str, ...], board_sizes: Tuple[int, ...],
+            initializer: Optional[Callable], initargs: Tuple) -> None:
+    """Worker initializer: imports preload (a no-op for workers forked from
+    the fork server), builds the per-size tables and runs initializer."""
+    for module in preload:
+        importlib.import_module(module)
+    from board_geometry import get_geometry
+    from game_board import GameBoard
+    for size in board_sizes:
+        get_geometry(size)
+        GameBoard(size).get_legal_squares()
+    if initializer is not None:
+        initializer(*initargs)